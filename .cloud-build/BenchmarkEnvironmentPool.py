@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+from jupyter_client.kernelspecapp import KernelSpecManager
+from tabulate import tabulate
+
+import EnvironmentPool
+import ExecuteNotebook
+
+# This script is used to compare the per-notebook kernel setup time of creating a new
+# environment for each notebook against cloning one from the environment pool.
+
+
+def time_setups(
+    setup: Callable[[], Tuple[str, str]],
+    teardown: Callable[[str, str], None],
+    runs: int,
+) -> List[float]:
+    durations = []
+    for _ in range(runs):
+        time_start = time.perf_counter()
+        kernel_name, env_name = setup()
+        durations.append(time.perf_counter() - time_start)
+
+        teardown(kernel_name, env_name)
+
+    return durations
+
+
+def remove_environment(kernel_name: str, env_name: str):
+    EnvironmentPool.return_environment(env_name=env_name)
+    KernelSpecManager().remove_kernel_spec(kernel_name)
+
+
+def benchmark(runs: int):
+    # Build the template up front, as a previous run on the same machine would have
+    time_start = time.perf_counter()
+    EnvironmentPool.build_template(
+        environments_path=ExecuteNotebook.ENVIRONMENTS_PATH, requirements=[]
+    )
+    template_duration = time.perf_counter() - time_start
+
+    results = {
+        "create_and_install_kernel": time_setups(
+            setup=ExecuteNotebook.create_and_install_kernel,
+            teardown=remove_environment,
+            runs=runs,
+        ),
+        "checkout_and_install_kernel": time_setups(
+            setup=ExecuteNotebook.checkout_and_install_kernel,
+            teardown=remove_environment,
+            runs=runs,
+        ),
+    }
+
+    print(f"One-time template build: {template_duration:.3f}s\n")
+    print(
+        tabulate(
+            [
+                [
+                    name,
+                    f"{statistics.mean(durations):.3f}s",
+                    f"{statistics.median(durations):.3f}s",
+                    f"{max(durations):.3f}s",
+                ]
+                for name, durations in results.items()
+            ],
+            headers=["setup", "mean", "median", "max"],
+        )
+    )
+
+
+parser = argparse.ArgumentParser(description="Benchmark kernel setup time.")
+parser.add_argument(
+    "--runs",
+    type=int,
+    default=10,
+    help="The number of kernels to set up with each method.",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    benchmark(runs=args.runs)
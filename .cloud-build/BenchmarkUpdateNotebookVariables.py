@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import subprocess
+import time
+from typing import Callable, Dict, List
+
+import nbformat
+from tabulate import tabulate
+
+import UpdateNotebookVariables
+
+# This script is used to compare replacing variables one at a time against replacing them
+# in a single pass, over the code cells of every notebook in the repository.
+
+
+def update_variables_sequentially(content: str, replacement_map: Dict[str, str]) -> str:
+    for variable_name, variable_value in replacement_map.items():
+        content = UpdateNotebookVariables.get_updated_value(
+            content=content,
+            variable_name=variable_name,
+            variable_value=variable_value,
+        )
+
+    return content
+
+
+def time_updates(
+    update: Callable[[str, Dict[str, str]], str],
+    sources: List[str],
+    replacement_map: Dict[str, str],
+    runs: int,
+) -> float:
+    time_start = time.perf_counter()
+    for _ in range(runs):
+        for source in sources:
+            update(source, replacement_map)
+    return (time.perf_counter() - time_start) / runs
+
+
+def benchmark(runs: int, replacement_map: Dict[str, str]):
+    notebooks = subprocess.check_output(["git", "ls-files", "*.ipynb"])
+    notebooks = [
+        notebook for notebook in notebooks.decode("utf-8").split("\n") if notebook
+    ]
+
+    sources = []
+    for notebook in notebooks:
+        try:
+            with open(notebook, encoding="utf-8") as f:
+                nb = nbformat.read(f, as_version=4)
+        except nbformat.reader.NotJSONError:
+            print(f"Skipping notebook that isn't valid JSON: {notebook}")
+            continue
+
+        sources.extend(cell.source for cell in nb.cells if cell.cell_type == "code")
+
+    num_different = sum(
+        update_variables_sequentially(source, replacement_map)
+        != UpdateNotebookVariables.get_updated_values(source, replacement_map)
+        for source in sources
+    )
+
+    sequential_duration = time_updates(
+        update_variables_sequentially, sources, replacement_map, runs
+    )
+    single_pass_duration = time_updates(
+        UpdateNotebookVariables.get_updated_values, sources, replacement_map, runs
+    )
+
+    print(
+        f"{len(notebooks)} notebooks, {len(sources)} code cells, "
+        f"{len(replacement_map)} variables, {num_different} cells with different output\n"
+    )
+    print(
+        tabulate(
+            [
+                ["sequential", f"{sequential_duration * 1000:.1f}ms", "1.0x"],
+                [
+                    "single pass",
+                    f"{single_pass_duration * 1000:.1f}ms",
+                    f"{sequential_duration / single_pass_duration:.1f}x",
+                ],
+            ],
+            headers=["update", "time per sweep", "speedup"],
+        )
+    )
+
+    if num_different > 0:
+        raise RuntimeError(f"Output differs for {num_different} cells.")
+
+
+parser = argparse.ArgumentParser(description="Benchmark notebook variable updates.")
+parser.add_argument(
+    "--runs",
+    type=int,
+    default=5,
+    help="The number of sweeps over all notebooks with each method.",
+)
+parser.add_argument(
+    "--variable_names",
+    type=str,
+    nargs="+",
+    default=["PROJECT_ID", "REGION"],
+    help="The names of the variables to replace.",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    benchmark(
+        runs=args.runs,
+        replacement_map={
+            variable_name: f"sample-{variable_name.lower()}"
+            for variable_name in args.variable_names
+        },
+    )
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fcntl
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+from typing import List, Optional, Tuple
+
+import virtualenv
+
+"""
+ This script is used to hand out virtual environments for notebook kernels.
+
+Building a virtual environment takes seconds to minutes, so a template environment is built
+once per set of requirements and kept under TEMPLATES_PATH. Each notebook gets a clone of the
+template in which every file is a hard link to the template file. Cloning therefore takes
+milliseconds, regardless of how many packages the template has.
+
+Installing packages into a clone doesn't change the template, since pip replaces files
+instead of writing to them in place. The few files that contain the absolute path of the
+environment, such as script shebangs, are rewritten as regular files in each clone.
+"""
+
+TEMPLATES_PATH = "templates"
+
+
+def get_requirements_hash(requirements: List[str]) -> str:
+    """Hashes the requirements together with the Python and virtualenv versions."""
+    key = "\n".join([sys.version, virtualenv.__version__] + sorted(set(requirements)))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def build_template(environments_path: str, requirements: List[str]) -> str:
+    """Builds the template environment for the requirements, unless it was built already.
+
+    Returns:
+        The path to the template environment.
+    """
+    templates_path = os.path.join(environments_path, TEMPLATES_PATH)
+    os.makedirs(templates_path, exist_ok=True)
+
+    template_name = os.path.join(templates_path, get_requirements_hash(requirements))
+
+    # Lock the template so concurrent workers build it only once
+    with open(f"{template_name}.lock", mode="w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(template_name):
+                template_name_tmp = f"{template_name}.{uuid.uuid4()}"
+                virtualenv.cli_run([template_name_tmp, "--system-site-packages"])
+                if requirements:
+                    subprocess.check_call(
+                        [f"{template_name_tmp}/bin/python", "-m", "pip", "install"]
+                        + requirements
+                    )
+
+                # Move into place only once complete, so a failed build is never reused
+                os.rename(template_name_tmp, template_name)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    return template_name
+
+
+def _link_or_copy(source: str, destination: str):
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Hard links don't work across file systems
+        shutil.copy2(source, destination)
+
+
+def clone_environment(template_name: str, env_name: str):
+    """Clones the template environment by hard linking its files."""
+    shutil.copytree(template_name, env_name, symlinks=True, copy_function=_link_or_copy)
+
+    # Rewrite the files that refer to the template, so the clone refers to itself
+    template_path = os.path.abspath(template_name).encode("utf-8")
+    env_path = os.path.abspath(env_name).encode("utf-8")
+
+    bin_path = os.path.join(env_name, "bin")
+    file_paths = [os.path.join(env_name, "pyvenv.cfg")] + [
+        os.path.join(bin_path, file_name) for file_name in os.listdir(bin_path)
+    ]
+
+    for file_path in file_paths:
+        if os.path.islink(file_path) or not os.path.isfile(file_path):
+            continue
+
+        with open(file_path, mode="rb") as f:
+            content = f.read()
+
+        if template_path not in content:
+            continue
+
+        # Unlink first, so the template's copy of the file is left untouched
+        mode = os.stat(file_path).st_mode
+        os.remove(file_path)
+        with open(file_path, mode="wb") as f:
+            f.write(content.replace(template_path, env_path))
+        os.chmod(file_path, mode)
+
+
+def checkout_environment(
+    environments_path: str, requirements: Optional[List[str]] = None
+) -> Tuple[str, str]:
+    """Checks out a fresh environment for the requirements.
+
+    Returns:
+        A tuple of the environment's name, which is also used as its kernel name, and path.
+    """
+    template_name = build_template(
+        environments_path=environments_path, requirements=requirements or []
+    )
+
+    kernel_name = str(uuid.uuid4())
+    env_name = os.path.join(environments_path, kernel_name)
+    clone_environment(template_name=template_name, env_name=env_name)
+
+    return kernel_name, env_name
+
+
+def return_environment(env_name: str):
+    """Returns an environment that was checked out, resetting it for the next notebook.
+
+    The template is kept, so the next checkout is a clone instead of a build.
+    """
+    shutil.rmtree(path=env_name)
+
+
+def test_clone_environment_rewrites_paths(tmp_path):
+    template_name = tmp_path / "template"
+    (template_name / "bin").mkdir(parents=True)
+    (template_name / "lib").mkdir()
+    (template_name / "pyvenv.cfg").write_text("home = /usr/bin\n")
+    (template_name / "lib" / "module.py").write_text("x = 1\n")
+    (template_name / "bin" / "pip").write_text(f"#!{template_name}/bin/python\n")
+
+    env_name = tmp_path / "env"
+    clone_environment(template_name=str(template_name), env_name=str(env_name))
+
+    assert (env_name / "bin" / "pip").read_text() == f"#!{env_name}/bin/python\n"
+    assert (template_name / "bin" / "pip").read_text() == (
+        f"#!{template_name}/bin/python\n"
+    )
+    assert os.path.samefile(
+        template_name / "lib" / "module.py", env_name / "lib" / "module.py"
+    )
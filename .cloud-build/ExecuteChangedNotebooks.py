@@ -17,15 +17,24 @@ import argparse
 import dataclasses
 import datetime
 import functools
+import json
 import pathlib
 import os
 import subprocess
+import time
+import uuid
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 import concurrent
+import nbformat
+import shutil
 from tabulate import tabulate
 
 import ExecuteNotebook
+import NotebookCellEvents
+import NotebookCellProfiler
+import NotebookExecutionHistory
+import NotebookResultCache
 
 
 def str2bool(v):
@@ -60,23 +69,151 @@ def format_timedelta(delta: datetime.timedelta) -> str:
     return time_fmt
 
 
+def format_cpu_time(seconds: str) -> str:
+    """Formats a CPU time from a cell profile, which is empty when unavailable"""
+    return f"{float(seconds):.1f}s" if seconds else "--"
+
+
+def format_memory(size_in_bytes: str) -> str:
+    """Formats a memory size from a cell profile, which is empty when unavailable"""
+    return f"{int(size_in_bytes) / 1024 ** 2:.0f} MiB" if size_in_bytes else "--"
+
+
 @dataclasses.dataclass
 class NotebookExecutionResult:
     notebook: str
     duration: datetime.timedelta
     is_pass: bool
     error_message: Optional[str]
+    is_cached: bool = False
+    is_skipped: bool = False
+
+
+def get_skipped_result(notebook: str, reason: str) -> NotebookExecutionResult:
+    """Gets the result of a notebook that wasn't run"""
+    print(f"{notebook} SKIPPED because {reason}.")
+    return NotebookExecutionResult(
+        notebook=notebook,
+        duration=datetime.timedelta(seconds=0),
+        is_pass=False,
+        error_message=f"Skipped because {reason}.",
+        is_skipped=True,
+    )
+
+
+def get_durations(results: List[NotebookExecutionResult]) -> Dict[str, float]:
+    """Gets the duration in seconds of each notebook that was run and passed"""
+    return {
+        result.notebook: result.duration.total_seconds()
+        for result in results
+        if result.is_pass and not result.is_cached
+    }
+
+
+RESULTS_FILE_NAME = "results.json"
+
+
+def save_results(results_file: str, results: List[NotebookExecutionResult]):
+    """Saves the results of a run, so that the results of shards can be merged"""
+    with open(results_file, mode="w", encoding="utf-8") as f:
+        json.dump(
+            [
+                {
+                    "notebook": result.notebook,
+                    "duration_in_seconds": result.duration.total_seconds(),
+                    "is_pass": result.is_pass,
+                    "error_message": result.error_message,
+                    "is_cached": result.is_cached,
+                    "is_skipped": result.is_skipped,
+                }
+                for result in results
+            ],
+            f,
+            indent=2,
+        )
+
+
+def load_results(results_file: str) -> List[NotebookExecutionResult]:
+    """Loads the results of a run that were saved with save_results"""
+    with open(results_file, encoding="utf-8") as f:
+        return [
+            NotebookExecutionResult(
+                notebook=result["notebook"],
+                duration=datetime.timedelta(seconds=result["duration_in_seconds"]),
+                is_pass=result["is_pass"],
+                error_message=result["error_message"],
+                is_cached=result["is_cached"],
+                is_skipped=result["is_skipped"],
+            )
+            for result in json.load(f)
+        ]
+
+
+def print_results(results: List[NotebookExecutionResult]):
+    """Prints a table of results, with passing notebooks first"""
+    notebooks_sorted = sorted(
+        results,
+        key=lambda result: result.is_pass,
+        reverse=True,
+    )
+    print(
+        tabulate(
+            [
+                [
+                    os.path.basename(os.path.normpath(result.notebook)),
+                    (
+                        "CACHED"
+                        if result.is_cached
+                        else (
+                            "PASSED"
+                            if result.is_pass
+                            else "SKIPPED" if result.is_skipped else "FAILED"
+                        )
+                    ),
+                    format_timedelta(result.duration),
+                    result.error_message or "--",
+                ]
+                for result in notebooks_sorted
+            ],
+            headers=["file", "status", "duration", "error"],
+        )
+    )
 
 
 def execute_notebook(
+    notebook: str,
     artifacts_path: str,
     variable_project_id: str,
     variable_region: str,
     should_log_output: bool,
     should_use_new_kernel: bool,
-    notebook: str,
+    should_isolate_paths: bool = False,
+    should_keep_notebook_paths: bool = False,
+    kernel_requirements: Optional[List[str]] = None,
+    result_cache_folder: Optional[str] = None,
+    environment_fingerprint: str = "",
+    cell_event_log_file: Optional[str] = None,
+    cell_profile_file: Optional[str] = None,
+    cell_timeout: Optional[int] = None,
+    notebook_timeout: Optional[float] = None,
+    run_deadline: Optional[float] = None,
 ) -> NotebookExecutionResult:
-    print(f"Running notebook: {notebook}")
+    replacement_map = {
+        "PROJECT_ID": variable_project_id,
+        "REGION": variable_region,
+    }
+
+    staging_folder = ExecuteNotebook.STAGING_FOLDER
+    output_file_name = None
+    if should_isolate_paths:
+        # Give each notebook its own staging folder, so that concurrent workers never
+        # share a file.
+        staging_folder = os.path.join(staging_folder, str(uuid.uuid4()))
+    if should_isolate_paths or should_keep_notebook_paths or result_cache_folder:
+        # Keep the repository path of the notebook in the output folder, so that
+        # notebooks with the same file name don't overwrite each other's output,
+        # and the result cache never stores the output of another notebook.
+        output_file_name = os.path.normpath(notebook)
 
     result = NotebookExecutionResult(
         notebook=notebook,
@@ -85,22 +222,88 @@ def execute_notebook(
         error_message=None,
     )
 
+    cache_key = None
+    if result_cache_folder:
+        with open(notebook) as f:
+            nb = nbformat.read(f, as_version=4)
+
+        cache_key = NotebookResultCache.get_cache_key(
+            nb=ExecuteNotebook.preprocess_notebook(
+                nb=nb, replacement_map=replacement_map
+            ),
+            environment_fingerprint=environment_fingerprint,
+        )
+
+        cached_file_path = NotebookResultCache.lookup(
+            cache_folder=result_cache_folder, cache_key=cache_key
+        )
+        if cached_file_path:
+            # Reuse the output of the previous passing execution
+            shutil.copyfile(
+                cached_file_path,
+                ExecuteNotebook.get_output_file_path(
+                    output_file_folder=artifacts_path,
+                    notebook_file_path=notebook,
+                    has_error=False,
+                    output_file_name=output_file_name,
+                ),
+            )
+            result.is_pass = True
+            result.is_cached = True
+            print(f"{notebook} PASSED previously, reusing cached output.")
+
+            if cell_event_log_file:
+                NotebookCellEvents.log_event(
+                    cell_event_log_file,
+                    "notebook_end",
+                    notebook,
+                    is_pass=True,
+                    is_cached=True,
+                    duration_in_seconds=0.0,
+                )
+            return result
+
+    # Don't start new notebooks once the run has timed out
+    if run_deadline and time.time() >= run_deadline:
+        return get_skipped_result(notebook=notebook, reason="the run timed out")
+
+    # Stop the notebook at its own deadline or the run's, whichever comes first
+    deadlines = [run_deadline] if run_deadline else []
+    if notebook_timeout:
+        deadlines.append(time.time() + notebook_timeout)
+    deadline = min(deadlines) if deadlines else None
+
+    print(f"Running notebook: {notebook}")
+    if cell_event_log_file:
+        NotebookCellEvents.log_event(cell_event_log_file, "notebook_start", notebook)
+
     # TODO: Handle cases where multiple notebooks have the same name
     time_start = datetime.datetime.now()
     try:
-        ExecuteNotebook.execute_notebook(
+        output_file_path = ExecuteNotebook.execute_notebook(
             notebook_file_path=notebook,
             output_file_folder=artifacts_path,
-            replacement_map={
-                "PROJECT_ID": variable_project_id,
-                "REGION": variable_region,
-            },
+            replacement_map=replacement_map,
             should_log_output=should_log_output,
             should_use_new_kernel=should_use_new_kernel,
+            staging_folder=staging_folder,
+            output_file_name=output_file_name,
+            kernel_requirements=kernel_requirements,
+            cell_event_log_file=cell_event_log_file,
+            cell_profile_file=cell_profile_file,
+            cell_timeout=cell_timeout,
+            deadline=deadline,
         )
         result.duration = datetime.datetime.now() - time_start
         result.is_pass = True
         print(f"{notebook} PASSED in {format_timedelta(result.duration)}.")
+
+        if cache_key:
+            NotebookResultCache.store(
+                cache_folder=result_cache_folder,
+                cache_key=cache_key,
+                output_file_path=output_file_path,
+            )
     except Exception as error:
         result.duration = datetime.datetime.now() - time_start
         result.is_pass = False
@@ -109,6 +312,16 @@ def execute_notebook(
             f"{notebook} FAILED in {format_timedelta(result.duration)}: {result.error_message}"
         )
 
+    if cell_event_log_file:
+        NotebookCellEvents.log_event(
+            cell_event_log_file,
+            "notebook_end",
+            notebook,
+            is_pass=result.is_pass,
+            is_cached=False,
+            duration_in_seconds=result.duration.total_seconds(),
+        )
+
     return result
 
 
@@ -120,6 +333,20 @@ def run_changed_notebooks(
     variable_region: str,
     should_parallelize: bool,
     should_use_separate_kernels: bool,
+    should_use_process_pool: bool = False,
+    max_workers: Optional[int] = None,
+    execution_history_file: Optional[str] = None,
+    kernel_requirements_file: Optional[str] = None,
+    result_cache_folder: Optional[str] = None,
+    cell_event_log_file: Optional[str] = None,
+    cell_profile_file: Optional[str] = None,
+    top_cells: Optional[int] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    cell_timeout: Optional[int] = None,
+    notebook_timeout: Optional[float] = None,
+    timeout: Optional[float] = None,
+    max_failures: Optional[int] = None,
 ):
     """
     Run the notebooks that exist under the folders defined in the test_paths_file.
@@ -149,6 +376,57 @@ def run_changed_notebooks(
             See https://github.com/nteract/papermill/issues/625
 
             Required. Should run each notebook in a separate and independent virtual environment.
+        should_use_process_pool (bool):
+            Optional. When running in parallel, run each notebook in its own worker process
+            instead of a thread. Each notebook then gets a dedicated kernel and its own
+            staging and output paths.
+        max_workers (int):
+            Optional. The maximum number of notebooks to run at the same time when running in
+            parallel. Defaults to the executor's own default.
+        execution_history_file (str):
+            Optional. The JSON file that stores the duration of previous notebook runs.
+            If provided, the notebooks are run longest first and the durations of passing
+            notebooks are saved back to it. In a sharded run, every shard must read the
+            same history file, and it is only read: the durations of all shards are merged
+            into it by MergeShardResults.py.
+        kernel_requirements_file (str):
+            Optional. The requirements file to pre-install in the environment of each separate
+            kernel. The environment is built once and cloned for each notebook.
+        result_cache_folder (str):
+            Optional. The folder that caches the output of passing notebooks. A notebook whose
+            preprocessed source and environment are unchanged since it last passed is not run
+            again, and its cached output is reused.
+        cell_event_log_file (str):
+            Optional. The line-delimited JSON file to log an event to when each notebook and
+            cell starts and ends. When running in parallel, a summary of the progress is also
+            printed periodically.
+        cell_profile_file (str):
+            Optional. The CSV file to write the wall time, CPU time and peak memory of each
+            executed cell to. The profile is also written to the metadata of each cell.
+        top_cells (int):
+            Optional. The number of most expensive cells across the run to report at the end.
+            Requires cell_profile_file.
+        shard_index (int):
+            Optional. The shard of the notebooks to run on this machine, from 0 to shard_count - 1.
+        shard_count (int):
+            Optional. The number of machines that the notebooks are split across. Each shard
+            gets about the same predicted duration when an execution history is available,
+            which every shard must read from the same history file. The results of each
+            shard are written to results.json in its output_folder, and can be combined with
+            MergeShardResults.py. The output of each notebook keeps its repository path, so
+            that notebooks with the same file name can be combined.
+        cell_timeout (int):
+            Optional. The number of seconds after which a single cell fails the notebook.
+        notebook_timeout (float):
+            Optional. The number of seconds after which a notebook is stopped, by killing
+            its kernel and the processes it started.
+        timeout (float):
+            Optional. The number of seconds after which the whole run is stopped. Running
+            notebooks are stopped like timed out notebooks, and notebooks that haven't
+            started are skipped.
+        max_failures (int):
+            Optional. The number of failed notebooks after which no new notebooks are
+            started. Notebooks that are already running are allowed to finish.
     """
 
     test_paths = []
@@ -162,6 +440,20 @@ def run_changed_notebooks(
 
     print(f"Checking folders: {test_paths}")
 
+    kernel_requirements = []
+    if kernel_requirements_file:
+        with open(kernel_requirements_file) as file:
+            lines = [line.strip() for line in file.readlines()]
+            kernel_requirements = [
+                line for line in lines if len(line) > 0 and not line.startswith("#")
+            ]
+
+    environment_fingerprint = ""
+    if result_cache_folder:
+        environment_fingerprint = NotebookResultCache.get_environment_fingerprint(
+            kernel_requirements=kernel_requirements
+        )
+
     # Find notebooks
     notebooks = []
     if base_branch:
@@ -186,64 +478,243 @@ def run_changed_notebooks(
 
     notebook_execution_results: List[NotebookExecutionResult] = []
 
+    # Run the longest notebooks first, so that a slow notebook doesn't start last
+    predicted_durations = NotebookExecutionHistory.predict_durations(
+        notebooks=notebooks,
+        durations=NotebookExecutionHistory.load_durations(execution_history_file),
+    )
+    notebooks = NotebookExecutionHistory.sort_longest_first(
+        notebooks, predicted_durations
+    )
+
+    # Only run this machine's share of the notebooks
+    if shard_count > 1:
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(
+                f"shard_index must be between 0 and {shard_count - 1}, got {shard_index}."
+            )
+
+        notebooks = NotebookExecutionHistory.shard_notebooks(
+            notebooks=notebooks,
+            predicted_durations=predicted_durations,
+            shard_count=shard_count,
+        )[shard_index]
+        print(f"Running shard {shard_index + 1} of {shard_count}.")
+
+    if should_parallelize and len(notebooks) > 1:
+        if max_workers:
+            num_workers = max_workers
+        elif should_use_process_pool:
+            # Same defaults as the executors
+            num_workers = os.cpu_count() or 1
+        else:
+            num_workers = min(32, (os.cpu_count() or 1) + 4)
+    else:
+        num_workers = 1
+
+    predicted_makespan = NotebookExecutionHistory.predict_makespan(
+        durations=[predicted_durations[notebook] for notebook in notebooks],
+        num_workers=num_workers,
+    )
+
+    # Start a new event log for this run
+    if cell_event_log_file:
+        open(cell_event_log_file, mode="w").close()
+
+    # Start a new cell profile for this run
+    if cell_profile_file:
+        NotebookCellProfiler.create_profile_file(cell_profile_file)
+
+    time_start = datetime.datetime.now()
+    run_deadline = time.time() + timeout if timeout else None
+
     if len(notebooks) > 0:
         print(f"Found {len(notebooks)} modified notebooks: {notebooks}")
 
         if should_parallelize and len(notebooks) > 1:
-            print(
-                "Running notebooks in parallel, so no logs will be displayed. Please wait..."
+            progress_reporter = None
+            if cell_event_log_file:
+                print(
+                    "Running notebooks in parallel, so progress will be reported every "
+                    f"{NotebookCellEvents.PROGRESS_INTERVAL_IN_SECONDS} seconds. Please wait..."
+                )
+                progress_reporter = NotebookCellEvents.ProgressReporter(
+                    event_log_file=cell_event_log_file, num_notebooks=len(notebooks)
+                )
+                progress_reporter.start()
+            else:
+                print(
+                    "Running notebooks in parallel, so no logs will be displayed. Please wait..."
+                )
+
+            if should_use_process_pool:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=num_workers
+                )
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=num_workers
+                )
+
+            run_notebook = functools.partial(
+                execute_notebook,
+                artifacts_path=artifacts_path,
+                variable_project_id=variable_project_id,
+                variable_region=variable_region,
+                should_log_output=False,
+                should_use_new_kernel=should_use_separate_kernels
+                or should_use_process_pool,
+                should_isolate_paths=should_use_process_pool,
+                should_keep_notebook_paths=shard_count > 1,
+                kernel_requirements=kernel_requirements,
+                result_cache_folder=result_cache_folder,
+                environment_fingerprint=environment_fingerprint,
+                cell_event_log_file=cell_event_log_file,
+                cell_profile_file=cell_profile_file,
+                cell_timeout=cell_timeout,
+                notebook_timeout=notebook_timeout,
+                run_deadline=run_deadline,
             )
-            with concurrent.futures.ThreadPoolExecutor(max_workers=None) as executor:
-                notebook_execution_results = list(
-                    executor.map(
-                        functools.partial(
-                            execute_notebook,
-                            artifacts_path,
-                            variable_project_id,
-                            variable_region,
-                            False,
-                            should_use_separate_kernels,
-                        ),
-                        notebooks,
+
+            # Only submit a notebook when a worker is free, so that no notebooks are
+            # queued in the executor when the run has to stop scheduling them
+            results_by_notebook = {}
+            num_failures = 0
+            with executor:
+                pending_notebooks = list(reversed(notebooks))
+                running_futures = set()
+                while pending_notebooks or running_futures:
+                    while pending_notebooks and len(running_futures) < num_workers:
+                        running_futures.add(
+                            executor.submit(run_notebook, pending_notebooks.pop())
+                        )
+
+                    done_futures, running_futures = concurrent.futures.wait(
+                        running_futures,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
                     )
-                )
-        else:
+                    for future in done_futures:
+                        result = future.result()
+                        results_by_notebook[result.notebook] = result
+                        if not result.is_pass and not result.is_skipped:
+                            num_failures += 1
+
+                    # Stop scheduling new notebooks and let the running ones finish
+                    if (
+                        max_failures
+                        and num_failures >= max_failures
+                        and pending_notebooks
+                    ):
+                        print(
+                            f"{num_failures} notebooks failed, so no new notebooks will be started."
+                        )
+                        for notebook in reversed(pending_notebooks):
+                            results_by_notebook[notebook] = get_skipped_result(
+                                notebook=notebook,
+                                reason=f"{max_failures} notebooks failed",
+                            )
+                        pending_notebooks = []
+
             notebook_execution_results = [
-                execute_notebook(
+                results_by_notebook[notebook] for notebook in notebooks
+            ]
+
+            if progress_reporter:
+                progress_reporter.stop()
+                progress_reporter.report()
+        else:
+            num_failures = 0
+            for notebook in notebooks:
+                if max_failures and num_failures >= max_failures:
+                    notebook_execution_results.append(
+                        get_skipped_result(
+                            notebook=notebook,
+                            reason=f"{max_failures} notebooks failed",
+                        )
+                    )
+                    continue
+
+                result = execute_notebook(
                     artifacts_path=artifacts_path,
                     variable_project_id=variable_project_id,
                     variable_region=variable_region,
                     notebook=notebook,
                     should_log_output=True,
                     should_use_new_kernel=should_use_separate_kernels,
+                    should_keep_notebook_paths=shard_count > 1,
+                    kernel_requirements=kernel_requirements,
+                    result_cache_folder=result_cache_folder,
+                    environment_fingerprint=environment_fingerprint,
+                    cell_event_log_file=cell_event_log_file,
+                    cell_profile_file=cell_profile_file,
+                    cell_timeout=cell_timeout,
+                    notebook_timeout=notebook_timeout,
+                    run_deadline=run_deadline,
                 )
-                for notebook in notebooks
-            ]
+                if not result.is_pass and not result.is_skipped:
+                    num_failures += 1
+                notebook_execution_results.append(result)
     else:
         print("No notebooks modified in this pull request.")
 
-    print("\n=== RESULTS ===\n")
+    actual_makespan = datetime.datetime.now() - time_start
 
-    notebooks_sorted = sorted(
-        notebook_execution_results,
-        key=lambda result: result.is_pass,
-        reverse=True,
+    # The shards of a sharded run must keep reading the same history, so their durations are
+    # merged into it by MergeShardResults.py instead
+    if execution_history_file and shard_count == 1:
+        NotebookExecutionHistory.save_durations(
+            history_file=execution_history_file,
+            durations=get_durations(notebook_execution_results),
+        )
+
+    save_results(
+        results_file=artifacts_path.joinpath(RESULTS_FILE_NAME),
+        results=notebook_execution_results,
     )
+
+    print("\n=== RESULTS ===\n")
+
     # Print results
-    print(
-        tabulate(
-            [
+    print_results(notebook_execution_results)
+
+    print("")
+    if execution_history_file:
+        predicted_makespan = datetime.timedelta(seconds=predicted_makespan)
+        print(f"Predicted total duration: {format_timedelta(predicted_makespan)}")
+    print(f"Actual total duration: {format_timedelta(actual_makespan)}")
+
+    if cell_profile_file and top_cells:
+        print(f"\nTop {top_cells} cells by wall time:\n")
+        print(
+            tabulate(
                 [
-                    os.path.basename(os.path.normpath(result.notebook)),
-                    "PASSED" if result.is_pass else "FAILED",
-                    format_timedelta(result.duration),
-                    result.error_message or "--",
-                ]
-                for result in notebooks_sorted
-            ],
-            headers=["file", "status", "duration", "error"],
+                    [
+                        os.path.basename(os.path.normpath(profile["notebook"])),
+                        int(profile["cell_index"]) + 1,
+                        format_timedelta(
+                            datetime.timedelta(
+                                seconds=float(profile["wall_time_in_seconds"])
+                            )
+                        ),
+                        format_cpu_time(profile["cpu_time_in_seconds"]),
+                        format_memory(profile["peak_memory_in_bytes"]),
+                        profile["source"],
+                    ]
+                    for profile in NotebookCellProfiler.get_top_cells(
+                        profiles=NotebookCellProfiler.read_profiles(cell_profile_file),
+                        num_cells=top_cells,
+                    )
+                ],
+                headers=[
+                    "file",
+                    "cell",
+                    "wall time",
+                    "cpu time",
+                    "peak memory",
+                    "source",
+                ],
+            )
         )
-    )
 
     print("\n=== END RESULTS===\n")
 
@@ -300,13 +771,115 @@ parser.add_argument(
     help="(Experimental) Should run each notebook in a separate and independent virtual environment.",
 )
 
-args = parser.parse_args()
-run_changed_notebooks(
-    test_paths_file=args.test_paths_file,
-    base_branch=args.base_branch,
-    output_folder=args.output_folder,
-    variable_project_id=args.variable_project_id,
-    variable_region=args.variable_region,
-    should_parallelize=args.should_parallelize,
-    should_use_separate_kernels=args.should_use_separate_kernels,
+parser.add_argument(
+    "--should_use_process_pool",
+    type=str2bool,
+    nargs="?",
+    const=True,
+    default=False,
+    help="When running in parallel, run each notebook in its own worker process with a dedicated kernel.",
 )
+parser.add_argument(
+    "--max_workers",
+    type=int,
+    help="The maximum number of notebooks to run at the same time when running in parallel.",
+    required=False,
+)
+parser.add_argument(
+    "--execution_history_file",
+    type=pathlib.Path,
+    help="The path to a JSON file that stores notebook durations, used to run the longest notebooks first.",
+    required=False,
+)
+parser.add_argument(
+    "--kernel_requirements_file",
+    type=pathlib.Path,
+    help="The path to a requirements file to pre-install in the environment of each separate kernel.",
+    required=False,
+)
+parser.add_argument(
+    "--result_cache_folder",
+    type=pathlib.Path,
+    help="The path to a folder that caches the output of passing notebooks, so unchanged notebooks are not run again.",
+    required=False,
+)
+parser.add_argument(
+    "--cell_event_log_file",
+    type=pathlib.Path,
+    help="The path to a line-delimited JSON file to log notebook and cell execution events to.",
+    required=False,
+)
+parser.add_argument(
+    "--cell_profile_file",
+    type=pathlib.Path,
+    help="The path to a CSV file to write the wall time, CPU time and peak memory of each cell to.",
+    required=False,
+)
+parser.add_argument(
+    "--top_cells",
+    type=int,
+    help="The number of most expensive cells to report at the end of the run. Requires --cell_profile_file.",
+    required=False,
+)
+parser.add_argument(
+    "--shard_index",
+    type=int,
+    default=0,
+    help="The shard of the notebooks to run on this machine, from 0 to --shard_count minus 1.",
+)
+parser.add_argument(
+    "--shard_count",
+    type=int,
+    default=1,
+    help="The number of machines to split the notebooks across. Every machine must read the same --execution_history_file, which is only updated by MergeShardResults.py.",
+)
+parser.add_argument(
+    "--cell_timeout",
+    type=int,
+    help="The number of seconds after which a single cell fails its notebook.",
+    required=False,
+)
+parser.add_argument(
+    "--notebook_timeout",
+    type=float,
+    help="The number of seconds after which a notebook is stopped and fails.",
+    required=False,
+)
+parser.add_argument(
+    "--timeout",
+    type=float,
+    help="The number of seconds after which running notebooks are stopped and the remaining notebooks are skipped.",
+    required=False,
+)
+parser.add_argument(
+    "--max_failures",
+    type=int,
+    help="The number of failed notebooks after which no new notebooks are started.",
+    required=False,
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    run_changed_notebooks(
+        test_paths_file=args.test_paths_file,
+        base_branch=args.base_branch,
+        output_folder=args.output_folder,
+        variable_project_id=args.variable_project_id,
+        variable_region=args.variable_region,
+        should_parallelize=args.should_parallelize,
+        should_use_separate_kernels=args.should_use_separate_kernels,
+        should_use_process_pool=args.should_use_process_pool,
+        max_workers=args.max_workers,
+        execution_history_file=args.execution_history_file,
+        kernel_requirements_file=args.kernel_requirements_file,
+        result_cache_folder=args.result_cache_folder,
+        cell_event_log_file=args.cell_event_log_file,
+        cell_profile_file=args.cell_profile_file,
+        top_cells=args.top_cells,
+        shard_index=args.shard_index,
+        shard_count=args.shard_count,
+        cell_timeout=args.cell_timeout,
+        notebook_timeout=args.notebook_timeout,
+        timeout=args.timeout,
+        max_failures=args.max_failures,
+    )
@@ -19,7 +19,11 @@ import nbformat
 import os
 import errno
 from NotebookProcessors import RemoveNoExecuteCells, UpdateVariablesPreprocessor
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
+import EnvironmentPool
+import NotebookCellEvents
+import NotebookCellProfiler
+import NotebookWatchdog
 import papermill as pm
 import shutil
 import virtualenv
@@ -41,6 +45,29 @@ def create_and_install_kernel() -> Tuple[str, str]:
     # venv.create(env_name, system_site_packages=True, with_pip=True)
     virtualenv.cli_run([env_name, "--system-site-packages"])
 
+    install_kernel(kernel_name=kernel_name, env_name=env_name)
+
+    return kernel_name, env_name
+
+
+def checkout_and_install_kernel(
+    requirements: Optional[List[str]] = None,
+) -> Tuple[str, str]:
+    # Clone a pre-built environment instead of creating one
+    kernel_name, env_name = EnvironmentPool.checkout_environment(
+        environments_path=ENVIRONMENTS_PATH, requirements=requirements
+    )
+
+    install_kernel(kernel_name=kernel_name, env_name=env_name)
+
+    return kernel_name, env_name
+
+
+def install_kernel(kernel_name: str, env_name: str):
+    # Put the environment first on the PATH so shell commands such as
+    # "!pip install" inside the notebook resolve to this environment.
+    env_bin_path = os.path.join(os.path.abspath(env_name), "bin")
+
     # Create kernel spec
     kernel_spec = {
         "argv": [
@@ -52,6 +79,10 @@ def create_and_install_kernel() -> Tuple[str, str]:
         ],
         "display_name": "Python 3",
         "language": "python",
+        "env": {
+            "PATH": os.pathsep.join([env_bin_path, os.environ.get("PATH", "")]),
+            "VIRTUAL_ENV": os.path.abspath(env_name),
+        },
     }
     kernel_spec_folder = os.path.join(KERNELS_SPECS_PATH, kernel_name)
     kernel_spec_file = os.path.join(kernel_spec_folder, "kernel.json")
@@ -73,7 +104,50 @@ def create_and_install_kernel() -> Tuple[str, str]:
         source_dir=kernel_spec_folder, kernel_name=kernel_name
     )
 
-    return kernel_name, env_name
+
+def preprocess_notebook(
+    nb: nbformat.NotebookNode, replacement_map: Dict[str, str]
+) -> nbformat.NotebookNode:
+    # Create preprocessors
+    remove_no_execute_cells_preprocessor = RemoveNoExecuteCells()
+    update_variables_preprocessor = UpdateVariablesPreprocessor(
+        replacement_map=replacement_map
+    )
+
+    # Use no-execute preprocessor
+    (
+        nb,
+        resources,
+    ) = remove_no_execute_cells_preprocessor.preprocess(nb)
+
+    (nb, resources) = update_variables_preprocessor.preprocess(nb, resources)
+
+    return nb
+
+
+def get_output_file_path(
+    output_file_folder: str,
+    notebook_file_path: str,
+    has_error: bool,
+    output_file_name: Optional[str] = None,
+) -> str:
+    file_name = output_file_name or os.path.basename(
+        os.path.normpath(notebook_file_path)
+    )
+
+    output_file_path = os.path.join(
+        output_file_folder, "failure" if has_error else "success", file_name
+    )
+
+    # Create directories if they don't exist
+    if not os.path.exists(os.path.dirname(output_file_path)):
+        try:
+            os.makedirs(os.path.dirname(output_file_path))
+        except OSError as exc:  # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+
+    return output_file_path
 
 
 def execute_notebook(
@@ -82,9 +156,16 @@ def execute_notebook(
     replacement_map: Dict[str, str],
     should_log_output: bool,
     should_use_new_kernel: bool,
-):
+    staging_folder: str = STAGING_FOLDER,
+    output_file_name: Optional[str] = None,
+    kernel_requirements: Optional[List[str]] = None,
+    cell_event_log_file: Optional[str] = None,
+    cell_profile_file: Optional[str] = None,
+    cell_timeout: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> str:
     # Create staging directory if it doesn't exist
-    staging_file_path = f"{STAGING_FOLDER}/{notebook_file_path}"
+    staging_file_path = f"{staging_folder}/{notebook_file_path}"
     if not os.path.exists(os.path.dirname(staging_file_path)):
         try:
             os.makedirs(os.path.dirname(staging_file_path))
@@ -92,8 +173,6 @@ def execute_notebook(
             if exc.errno != errno.EEXIST:
                 raise
 
-    file_name = os.path.basename(os.path.normpath(notebook_file_path))
-
     # Create environments folder
     if not os.path.exists(ENVIRONMENTS_PATH):
         try:
@@ -108,34 +187,52 @@ def execute_notebook(
     )  # Find first existing kernel and use as default
     env_name = None
     if should_use_new_kernel:
-        kernel_name, env_name = create_and_install_kernel()
+        kernel_name, env_name = checkout_and_install_kernel(
+            requirements=kernel_requirements
+        )
 
     # Read notebook
     with open(notebook_file_path) as f:
         nb = nbformat.read(f, as_version=4)
 
     has_error = False
+    watchdog = None
 
     # Execute notebook
     try:
-        # Create preprocessors
-        remove_no_execute_cells_preprocessor = RemoveNoExecuteCells()
-        update_variables_preprocessor = UpdateVariablesPreprocessor(
-            replacement_map=replacement_map
-        )
-
-        # Use no-execute preprocessor
-        (
-            nb,
-            resources,
-        ) = remove_no_execute_cells_preprocessor.preprocess(nb)
-
-        (nb, resources) = update_variables_preprocessor.preprocess(nb, resources)
+        nb = preprocess_notebook(nb=nb, replacement_map=replacement_map)
 
         # print(f"Staging modified notebook to: {staging_file_path}")
         with open(staging_file_path, mode="w", encoding="utf-8") as f:
             nbformat.write(nb, f)
 
+        # Log an event for each cell and profile each cell, if requested
+        cell_observers = []
+        if cell_event_log_file:
+            cell_observers.append(
+                NotebookCellEvents.CellEventLogger(
+                    event_log_file=cell_event_log_file, notebook=notebook_file_path
+                )
+            )
+        if cell_profile_file:
+            cell_observers.append(
+                NotebookCellProfiler.CellProfiler(
+                    notebook=notebook_file_path, profile_file=cell_profile_file
+                )
+            )
+
+        # Stop the kernel if the notebook is still running at the deadline
+        if deadline:
+            watchdog = NotebookWatchdog.NotebookWatchdog(deadline=deadline)
+            cell_observers.append(watchdog)
+
+        engine_kwargs = {}
+        if cell_observers:
+            engine_kwargs = {
+                "engine_name": NotebookCellEvents.CELL_EVENTS_ENGINE_NAME,
+                "cell_observers": cell_observers,
+            }
+
         # Execute notebook
         pm.execute_notebook(
             input_path=staging_file_path,
@@ -146,30 +243,40 @@ def execute_notebook(
             log_output=should_log_output,
             stdout_file=sys.stdout if should_log_output else None,
             stderr_file=sys.stderr if should_log_output else None,
+            execution_timeout=cell_timeout,
+            **engine_kwargs,
         )
-    except Exception:
+    except Exception as error:
         # print(f"Error executing the notebook: {notebook_file_path}.\n\n")
         has_error = True
 
+        # A notebook that failed on its own before the deadline keeps its own error
+        if (
+            watchdog
+            and watchdog.has_timed_out
+            and not isinstance(error, pm.PapermillExecutionError)
+        ):
+            raise TimeoutError(
+                "The notebook didn't finish before its deadline, so its kernel was stopped."
+            ) from error
+
         raise
 
     finally:
         # Clear env
         if env_name is not None:
-            shutil.rmtree(path=env_name)
+            EnvironmentPool.return_environment(env_name=env_name)
+            KernelSpecManager().remove_kernel_spec(kernel_name)
 
         # Copy execute notebook
-        output_file_path = os.path.join(
-            output_file_folder, "failure" if has_error else "success", file_name
+        output_file_path = get_output_file_path(
+            output_file_folder=output_file_folder,
+            notebook_file_path=notebook_file_path,
+            has_error=has_error,
+            output_file_name=output_file_name,
         )
 
-        # Create directories if they don't exist
-        if not os.path.exists(os.path.dirname(output_file_path)):
-            try:
-                os.makedirs(os.path.dirname(output_file_path))
-            except OSError as exc:  # Guard against race condition
-                if exc.errno != errno.EEXIST:
-                    raise
-
         # print(f"Writing output to: {output_file_path}")
         shutil.move(staging_file_path, output_file_path)
+
+    return output_file_path
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import datetime
+import os
+import pathlib
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+import NotebookExecutionHistory
+from ExecuteChangedNotebooks import (
+    RESULTS_FILE_NAME,
+    NotebookExecutionResult,
+    format_timedelta,
+    get_durations,
+    load_results,
+    print_results,
+    save_results,
+)
+
+"""
+ This script is used to combine the output folders of a sharded run into one output folder.
+
+Each shard of ExecuteChangedNotebooks.py writes its executed notebooks to the success and
+failure folders of its own output folder, together with a results.json file. This script
+copies the executed notebooks of every shard into the success and failure folders of the
+merged output folder, writes the combined results.json and prints the combined results.
+
+The shards only read the execution history, so that they all compute the same split. This
+script merges the durations of every shard into the history for the next run.
+"""
+
+
+def merge_shard_results(
+    shard_folders: List[str],
+    output_folder: str,
+    execution_history_file: Optional[str] = None,
+) -> List[NotebookExecutionResult]:
+    """Merges the output folders of the shards into the output folder.
+
+    The durations of passing notebooks of all the shards are merged into the execution
+    history file, if given.
+
+    Returns:
+        The results of all the shards.
+    """
+    artifacts_path = Path(output_folder)
+    artifacts_path.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for shard_folder in shard_folders:
+        for folder_name in ["success", "failure"]:
+            shard_folder_path = Path(shard_folder).joinpath(folder_name)
+            if shard_folder_path.exists():
+                shutil.copytree(
+                    shard_folder_path,
+                    artifacts_path.joinpath(folder_name),
+                    dirs_exist_ok=True,
+                )
+
+        results_file = Path(shard_folder).joinpath(RESULTS_FILE_NAME)
+        if results_file.exists():
+            results += load_results(results_file)
+        else:
+            print(f"No results found for shard: {shard_folder}")
+
+    artifacts_path.joinpath("success").mkdir(exist_ok=True)
+    artifacts_path.joinpath("failure").mkdir(exist_ok=True)
+
+    save_results(
+        results_file=artifacts_path.joinpath(RESULTS_FILE_NAME), results=results
+    )
+
+    if execution_history_file:
+        NotebookExecutionHistory.save_durations(
+            history_file=execution_history_file, durations=get_durations(results)
+        )
+
+    return results
+
+
+parser = argparse.ArgumentParser(description="Merge the results of sharded runs.")
+parser.add_argument(
+    "--shard_folders",
+    type=pathlib.Path,
+    nargs="+",
+    help="The output folders of the shards.",
+    required=True,
+)
+parser.add_argument(
+    "--output_folder",
+    type=pathlib.Path,
+    help="The path to the folder to combine the executed notebooks and results into.",
+    required=True,
+)
+parser.add_argument(
+    "--execution_history_file",
+    type=pathlib.Path,
+    help="The path to the JSON file of notebook durations that the shards read, to merge their durations into.",
+    required=False,
+)
+
+
+def test_merge_shard_results(tmp_path):
+    for shard_index, is_pass in enumerate([True, False]):
+        shard_folder = tmp_path / f"shard_{shard_index}"
+        folder_name = "success" if is_pass else "failure"
+        (shard_folder / folder_name).mkdir(parents=True)
+        (shard_folder / folder_name / f"{shard_index}.ipynb").write_text("{}")
+        save_results(
+            results_file=shard_folder / RESULTS_FILE_NAME,
+            results=[
+                NotebookExecutionResult(
+                    notebook=f"{shard_index}.ipynb",
+                    duration=datetime.timedelta(seconds=shard_index),
+                    is_pass=is_pass,
+                    error_message=None if is_pass else "boom",
+                )
+            ],
+        )
+
+    output_folder = tmp_path / "merged"
+    results = merge_shard_results(
+        shard_folders=[tmp_path / "shard_0", tmp_path / "shard_1"],
+        output_folder=output_folder,
+    )
+
+    assert [result.notebook for result in results] == ["0.ipynb", "1.ipynb"]
+    assert results[1].error_message == "boom"
+    assert os.listdir(output_folder / "success") == ["0.ipynb"]
+    assert os.listdir(output_folder / "failure") == ["1.ipynb"]
+    assert len(load_results(output_folder / RESULTS_FILE_NAME)) == 2
+
+
+def test_merge_shard_results_keeps_paths_and_merges_history(tmp_path):
+    # Shards keep the repository path of each notebook in their output folder
+    for shard_index in range(2):
+        notebook = f"notebooks/folder_{shard_index}/sample.ipynb"
+        shard_folder = tmp_path / f"shard_{shard_index}"
+        (shard_folder / "success" / os.path.dirname(notebook)).mkdir(parents=True)
+        (shard_folder / "success" / notebook).write_text(str(shard_index))
+        save_results(
+            results_file=shard_folder / RESULTS_FILE_NAME,
+            results=[
+                NotebookExecutionResult(
+                    notebook=notebook,
+                    duration=datetime.timedelta(seconds=shard_index + 1),
+                    is_pass=True,
+                    error_message=None,
+                )
+            ],
+        )
+
+    history_file = str(tmp_path / "history.json")
+    NotebookExecutionHistory.save_durations(history_file, {"other.ipynb": 5.0})
+
+    output_folder = tmp_path / "merged"
+    merge_shard_results(
+        shard_folders=[tmp_path / "shard_0", tmp_path / "shard_1"],
+        output_folder=output_folder,
+        execution_history_file=history_file,
+    )
+
+    for shard_index in range(2):
+        notebook = f"notebooks/folder_{shard_index}/sample.ipynb"
+        assert (output_folder / "success" / notebook).read_text() == str(shard_index)
+    assert NotebookExecutionHistory.load_durations(history_file) == {
+        "other.ipynb": 5.0,
+        "notebooks/folder_0/sample.ipynb": 1.0,
+        "notebooks/folder_1/sample.ipynb": 2.0,
+    }
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    results = merge_shard_results(
+        shard_folders=args.shard_folders,
+        output_folder=args.output_folder,
+        execution_history_file=args.execution_history_file,
+    )
+
+    print("\n=== RESULTS ===\n")
+
+    print_results(results)
+
+    print("")
+    total_duration = sum(
+        (result.duration for result in results), datetime.timedelta(seconds=0)
+    )
+    print(f"Total notebook duration across shards: {format_timedelta(total_duration)}")
+
+    print("\n=== END RESULTS===\n")
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from papermill.clientwrap import PapermillNotebookClient
+from papermill.engines import NBClientEngine, papermill_engines
+from papermill.log import logger
+from papermill.utils import merge_kwargs, remove_args
+
+"""
+ This script is used to log structured events while notebooks execute.
+
+Events are appended as JSON lines to an event log file, which can be shared by all
+notebooks of a run, including notebooks that run in other processes. For example:
+
+    {"event": "cell_end", "notebook": "sample.ipynb", "cell_index": 3, "num_cells": 20,
+     "time": 1609459200.0, "duration_in_seconds": 12.5, "output_size_in_bytes": 1024,
+     "kernel_memory_in_bytes": 104857600}
+
+The ProgressReporter tails the event log to print a live summary of a parallel run.
+"""
+
+CELL_EVENTS_ENGINE_NAME = "cell_events"
+PROGRESS_INTERVAL_IN_SECONDS = 30
+
+
+def log_event(event_log_file: str, event: str, notebook: str, **fields: Any):
+    """Appends an event to the event log file."""
+    line = json.dumps(
+        {"event": event, "notebook": notebook, "time": time.time(), **fields}
+    )
+
+    # Each event is written with a single append, so concurrent writers don't interleave
+    with open(event_log_file, mode="a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def read_events(
+    event_log_file: str, offset: int = 0
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Reads the complete events after the offset.
+
+    Returns:
+        A tuple of the events and the offset to read the next events from.
+    """
+    if not os.path.exists(event_log_file):
+        return [], offset
+
+    with open(event_log_file, mode="rb") as f:
+        f.seek(offset)
+        content = f.read()
+
+    # Leave a partially written last line for the next read
+    content = content[: content.rfind(b"\n") + 1]
+    events = [json.loads(line) for line in content.splitlines() if line]
+    return events, offset + len(content)
+
+
+def get_kernel_pid(client: PapermillNotebookClient) -> Optional[int]:
+    """Gets the process id of the kernel that a notebook client started."""
+    kernel_manager = getattr(client, "km", None)
+    provisioner = getattr(kernel_manager, "provisioner", None)
+    process = getattr(provisioner, "process", None) or getattr(
+        kernel_manager, "kernel", None
+    )
+    return getattr(process, "pid", None)
+
+
+def get_process_memory(pid: Optional[int]) -> Optional[int]:
+    """Gets the resident memory of a process in bytes, if available on this platform."""
+    if pid is None:
+        return None
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+class CellObserver:
+    """Gets called when each cell of a notebook starts and ends.
+
+    cell_complete is called before papermill saves the cell, so changes to the cell's
+    metadata are written to the output notebook. detach is called once the notebook stops
+    executing, whether it passed or not.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._num_cells = 0
+
+    def attach(self, nb_man, client: PapermillNotebookClient):
+        """Wraps the cell callbacks of the notebook execution manager."""
+        self._client = client
+        self._num_cells = len(nb_man.nb.cells)
+
+        cell_start = nb_man.cell_start
+        cell_complete = nb_man.cell_complete
+
+        def cell_start_with_observer(cell, cell_index=None, **kwargs):
+            self.cell_start(cell, cell_index)
+            return cell_start(cell, cell_index, **kwargs)
+
+        def cell_complete_with_observer(cell, cell_index=None, **kwargs):
+            self.cell_complete(cell, cell_index)
+            return cell_complete(cell, cell_index, **kwargs)
+
+        nb_man.cell_start = cell_start_with_observer
+        nb_man.cell_complete = cell_complete_with_observer
+
+    @property
+    def kernel_pid(self) -> Optional[int]:
+        return get_kernel_pid(self._client)
+
+    def cell_start(self, cell, cell_index: int):
+        pass
+
+    def cell_complete(self, cell, cell_index: int):
+        pass
+
+    def detach(self):
+        pass
+
+
+class CellEventLogger(CellObserver):
+    """Logs an event when each cell of a notebook starts and ends."""
+
+    def __init__(self, event_log_file: str, notebook: str):
+        super().__init__()
+        self._event_log_file = event_log_file
+        self._notebook = notebook
+        self._cell_start_time = 0.0
+
+    def cell_start(self, cell, cell_index: int):
+        self._cell_start_time = time.time()
+        log_event(
+            self._event_log_file,
+            "cell_start",
+            self._notebook,
+            cell_index=cell_index,
+            num_cells=self._num_cells,
+        )
+
+    def cell_complete(self, cell, cell_index: int):
+        log_event(
+            self._event_log_file,
+            "cell_end",
+            self._notebook,
+            cell_index=cell_index,
+            num_cells=self._num_cells,
+            duration_in_seconds=time.time() - self._cell_start_time,
+            output_size_in_bytes=len(json.dumps(cell.get("outputs", []))),
+            kernel_memory_in_bytes=get_process_memory(self.kernel_pid),
+        )
+
+
+class CellEventEngine(NBClientEngine):
+    """The default papermill engine, with optional cell observers attached."""
+
+    @classmethod
+    def execute_managed_notebook(
+        cls,
+        nb_man,
+        kernel_name,
+        log_output=False,
+        stdout_file=None,
+        stderr_file=None,
+        start_timeout=60,
+        execution_timeout=None,
+        cell_observers: Optional[List[CellObserver]] = None,
+        **kwargs,
+    ):
+        # Same arguments as NBClientEngine, which creates the client internally
+        kwargs = remove_args(["input_path"], **kwargs)
+        safe_kwargs = remove_args(["timeout", "startup_timeout"], **kwargs)
+        final_kwargs = merge_kwargs(
+            safe_kwargs,
+            timeout=execution_timeout if execution_timeout else kwargs.get("timeout"),
+            startup_timeout=start_timeout,
+            kernel_name=kernel_name,
+            log=logger,
+            log_output=log_output,
+            stdout_file=stdout_file,
+            stderr_file=stderr_file,
+        )
+
+        client = PapermillNotebookClient(nb_man, **final_kwargs)
+        for cell_observer in cell_observers or []:
+            cell_observer.attach(nb_man, client)
+
+        try:
+            return client.execute()
+        finally:
+            for cell_observer in cell_observers or []:
+                cell_observer.detach()
+
+
+papermill_engines.register(CELL_EVENTS_ENGINE_NAME, CellEventEngine)
+
+
+def format_duration(seconds: float) -> str:
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class ProgressReporter(threading.Thread):
+    """Periodically prints a summary of a run from its event log."""
+
+    def __init__(
+        self,
+        event_log_file: str,
+        num_notebooks: int,
+        interval_in_seconds: float = PROGRESS_INTERVAL_IN_SECONDS,
+    ):
+        super().__init__(daemon=True)
+        self._event_log_file = event_log_file
+        self._num_notebooks = num_notebooks
+        self._interval_in_seconds = interval_in_seconds
+        self._stop_event = threading.Event()
+        self._offset = 0
+        self._time_start = time.time()
+        self._num_passed = 0
+        self._num_failed = 0
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._slowest_cell: Optional[Dict[str, Any]] = None
+
+    def run(self):
+        while not self._stop_event.wait(self._interval_in_seconds):
+            self.report()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def update(self, events: List[Dict[str, Any]]):
+        for event in events:
+            notebook = event["notebook"]
+            if event["event"] == "notebook_start":
+                self._running[notebook] = {"time": event["time"]}
+            elif event["event"] == "notebook_end":
+                self._running.pop(notebook, None)
+                if event.get("is_pass"):
+                    self._num_passed += 1
+                else:
+                    self._num_failed += 1
+            elif event["event"] == "cell_start" and notebook in self._running:
+                self._running[notebook].update(
+                    cell_index=event["cell_index"], num_cells=event["num_cells"]
+                )
+            elif event["event"] == "cell_end":
+                if (
+                    self._slowest_cell is None
+                    or event["duration_in_seconds"]
+                    > self._slowest_cell["duration_in_seconds"]
+                ):
+                    self._slowest_cell = event
+
+    def report(self):
+        events, self._offset = read_events(self._event_log_file, self._offset)
+        self.update(events)
+
+        now = time.time()
+        lines = [
+            f"[{format_duration(now - self._time_start)}] "
+            f"{self._num_passed + self._num_failed}/{self._num_notebooks} notebooks finished "
+            f"({self._num_passed} passed, {self._num_failed} failed), "
+            f"{len(self._running)} running:"
+        ]
+        for notebook, state in sorted(self._running.items()):
+            cell = ""
+            if "cell_index" in state:
+                cell = f", cell {state['cell_index'] + 1}/{state['num_cells']}"
+            lines.append(f"  {notebook} ({format_duration(now - state['time'])}{cell})")
+        if self._slowest_cell is not None:
+            lines.append(
+                f"  Slowest cell so far: {self._slowest_cell['notebook']} "
+                f"cell {self._slowest_cell['cell_index'] + 1} "
+                f"({format_duration(self._slowest_cell['duration_in_seconds'])})"
+            )
+
+        print("\n".join(lines), flush=True)
+
+
+def test_read_events_skips_partial_line(tmp_path):
+    event_log_file = str(tmp_path / "events.jsonl")
+    log_event(event_log_file, "notebook_start", "a.ipynb")
+    with open(event_log_file, mode="a") as f:
+        f.write('{"event": "cell_st')
+
+    events, offset = read_events(event_log_file)
+    assert [event["event"] for event in events] == ["notebook_start"]
+
+    with open(event_log_file, mode="a") as f:
+        f.write('art", "notebook": "a.ipynb"}\n')
+
+    events, _ = read_events(event_log_file, offset)
+    assert [event["event"] for event in events] == ["cell_start"]
+
+
+def test_progress_reporter_tracks_notebooks(tmp_path):
+    event_log_file = str(tmp_path / "events.jsonl")
+    reporter = ProgressReporter(event_log_file, num_notebooks=2)
+
+    log_event(event_log_file, "notebook_start", "a.ipynb")
+    log_event(event_log_file, "notebook_start", "b.ipynb")
+    log_event(event_log_file, "cell_start", "a.ipynb", cell_index=0, num_cells=2)
+    log_event(
+        event_log_file,
+        "cell_end",
+        "a.ipynb",
+        cell_index=0,
+        num_cells=2,
+        duration_in_seconds=5.0,
+    )
+    log_event(event_log_file, "notebook_end", "b.ipynb", is_pass=False)
+    reporter.report()
+
+    assert list(reporter._running) == ["a.ipynb"]
+    assert reporter._running["a.ipynb"]["cell_index"] == 0
+    assert reporter._num_failed == 1
+    assert reporter._slowest_cell["notebook"] == "a.ipynb"
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import io
+import os
+import time
+from typing import Dict, List, Optional
+
+from NotebookCellEvents import CellObserver
+
+"""
+ This script is used to profile each cell of a notebook while it executes.
+
+For each cell, the profiler records:
+
+    wall_time_in_seconds: The time from the cell starting to the cell ending.
+    cpu_time_in_seconds: The CPU time that the kernel, and the subprocesses it waited for
+        such as "!pip install", used while running the cell.
+    peak_memory_in_bytes: The peak resident memory of the kernel while running the cell.
+
+The profile is written to the cell's metadata under "profile", and appended as a row to a
+summary CSV file that can be shared by all notebooks of a run.
+
+CPU time and memory are read from /proc, so they are only recorded on Linux.
+"""
+
+PROFILE_FIELDS = [
+    "notebook",
+    "cell_index",
+    "wall_time_in_seconds",
+    "cpu_time_in_seconds",
+    "peak_memory_in_bytes",
+    "source",
+]
+
+
+def get_process_cpu_time(pid: Optional[int]) -> Optional[float]:
+    """Gets the CPU time in seconds of a process and of its waited-for children."""
+    if pid is None:
+        return None
+
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+
+    # The process name may contain spaces, so split after its closing parenthesis.
+    # utime, stime, cutime and cstime are the 14th to 17th fields.
+    fields = stat[stat.rfind(")") + 2 :].split()
+    clock_ticks = sum(int(field) for field in fields[11:15])
+    return clock_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def get_process_peak_memory(pid: Optional[int]) -> Optional[int]:
+    """Gets the peak resident memory of a process in bytes."""
+    if pid is None:
+        return None
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def reset_process_peak_memory(pid: Optional[int]):
+    """Resets the peak resident memory of a process to its current resident memory.
+
+    If this isn't permitted, the peak memory of a cell is the peak since the kernel started.
+    """
+    if pid is None:
+        return
+
+    try:
+        with open(f"/proc/{pid}/clear_refs", mode="w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_source_summary(source: str) -> str:
+    """Gets the first non-empty line of a cell's source."""
+    lines = [line.strip() for line in source.splitlines() if line.strip()]
+    return lines[0][:80] if lines else ""
+
+
+class CellProfiler(CellObserver):
+    """Records the wall time, CPU time and peak memory of each cell."""
+
+    def __init__(self, notebook: str, profile_file: Optional[str] = None):
+        super().__init__()
+        self._notebook = notebook
+        self._profile_file = profile_file
+        self._wall_time_start = 0.0
+        self._cpu_time_start = None
+
+    def cell_start(self, cell, cell_index: int):
+        reset_process_peak_memory(self.kernel_pid)
+        self._cpu_time_start = get_process_cpu_time(self.kernel_pid)
+        self._wall_time_start = time.time()
+
+    def cell_complete(self, cell, cell_index: int):
+        wall_time = time.time() - self._wall_time_start
+
+        cpu_time = None
+        cpu_time_end = get_process_cpu_time(self.kernel_pid)
+        if cpu_time_end is not None and self._cpu_time_start is not None:
+            cpu_time = cpu_time_end - self._cpu_time_start
+
+        profile = {
+            "wall_time_in_seconds": wall_time,
+            "cpu_time_in_seconds": cpu_time,
+            "peak_memory_in_bytes": get_process_peak_memory(self.kernel_pid),
+        }
+        cell.metadata["profile"] = profile
+
+        if self._profile_file:
+            write_profile(
+                profile_file=self._profile_file,
+                profile={
+                    "notebook": self._notebook,
+                    "cell_index": cell_index,
+                    "source": get_source_summary(cell.source),
+                    **profile,
+                },
+            )
+
+
+def create_profile_file(profile_file: str):
+    """Creates an empty summary CSV file with a header row."""
+    with open(profile_file, mode="w", encoding="utf-8", newline="") as f:
+        csv.DictWriter(f, fieldnames=PROFILE_FIELDS).writeheader()
+
+
+def write_profile(profile_file: str, profile: Dict):
+    """Appends the profile of a cell to the summary CSV file."""
+    row = io.StringIO()
+    csv.DictWriter(row, fieldnames=PROFILE_FIELDS).writerow(profile)
+
+    # Each row is written with a single append, so concurrent writers don't interleave
+    with open(profile_file, mode="a", encoding="utf-8", newline="") as f:
+        f.write(row.getvalue())
+
+
+def read_profiles(profile_file: str) -> List[Dict]:
+    """Reads the profiles of all cells from the summary CSV file."""
+    with open(profile_file, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def get_top_cells(profiles: List[Dict], num_cells: int) -> List[Dict]:
+    """Gets the cells with the longest wall time."""
+    return sorted(
+        profiles,
+        key=lambda profile: float(profile["wall_time_in_seconds"]),
+        reverse=True,
+    )[:num_cells]
+
+
+def test_get_process_cpu_time_and_peak_memory():
+    pid = os.getpid()
+    if not os.path.exists(f"/proc/{pid}/stat"):
+        return
+
+    assert get_process_cpu_time(pid) > 0
+    assert get_process_peak_memory(pid) > 0
+    assert get_process_cpu_time(None) is None
+    assert get_process_peak_memory(None) is None
+
+
+def test_write_and_read_profiles(tmp_path):
+    profile_file = str(tmp_path / "profile.csv")
+    create_profile_file(profile_file)
+
+    for cell_index, wall_time in enumerate([1.0, 3.0, 2.0]):
+        write_profile(
+            profile_file,
+            {
+                "notebook": "a.ipynb",
+                "cell_index": cell_index,
+                "wall_time_in_seconds": wall_time,
+                "cpu_time_in_seconds": 0.5,
+                "peak_memory_in_bytes": 1024,
+                "source": 'print("a, b")',
+            },
+        )
+
+    top_cells = get_top_cells(read_profiles(profile_file), num_cells=2)
+    assert [top_cell["cell_index"] for top_cell in top_cells] == ["1", "2"]
+    assert top_cells[0]["source"] == 'print("a, b")'
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import heapq
+import json
+import os
+from typing import Dict, List
+
+"""
+ This script is used to persist how long each notebook took to execute.
+
+The history file is a JSON file of the format:
+
+    {
+        "notebooks": {
+            "notebooks/official/sample.ipynb": {
+                "duration_in_seconds": 123.4,
+                "updated_at": "2021-01-01T00:00:00"
+            }
+        }
+    }
+
+The durations are used to run the longest notebooks first, so that a slow notebook that
+is scheduled last doesn't determine the total run time, and to split the notebooks into
+shards that take about the same time to run.
+"""
+
+
+def load_durations(history_file: str) -> Dict[str, float]:
+    """Loads the last known duration in seconds of each notebook."""
+    if not history_file or not os.path.exists(history_file):
+        return {}
+
+    with open(history_file, encoding="utf-8") as f:
+        history = json.load(f)
+
+    return {
+        notebook: entry["duration_in_seconds"]
+        for notebook, entry in history.get("notebooks", {}).items()
+    }
+
+
+def save_durations(history_file: str, durations: Dict[str, float]):
+    """Merges the durations in seconds of the given notebooks into the history file."""
+    history = {"notebooks": {}}
+    if os.path.exists(history_file):
+        with open(history_file, encoding="utf-8") as f:
+            history = json.load(f)
+
+    updated_at = datetime.datetime.now().isoformat(timespec="seconds")
+    for notebook, duration in durations.items():
+        history.setdefault("notebooks", {})[notebook] = {
+            "duration_in_seconds": duration,
+            "updated_at": updated_at,
+        }
+
+    # Write to a temporary file first so an interrupted run doesn't corrupt the history
+    history_file_tmp = f"{history_file}.tmp"
+    with open(history_file_tmp, mode="w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2, sort_keys=True)
+    os.replace(history_file_tmp, history_file)
+
+
+def predict_durations(
+    notebooks: List[str], durations: Dict[str, float]
+) -> Dict[str, float]:
+    """Predicts the duration of each notebook.
+
+    Notebooks without history are predicted to take the average known duration.
+    """
+    known_durations = [
+        durations[notebook] for notebook in notebooks if notebook in durations
+    ]
+    default_duration = (
+        sum(known_durations) / len(known_durations) if known_durations else 0.0
+    )
+
+    return {
+        notebook: durations.get(notebook, default_duration) for notebook in notebooks
+    }
+
+
+def sort_longest_first(
+    notebooks: List[str], predicted_durations: Dict[str, float]
+) -> List[str]:
+    """Sorts the notebooks by predicted duration, longest first.
+
+    Ties are broken by notebook path so the order is deterministic.
+    """
+    return sorted(
+        notebooks, key=lambda notebook: (-predicted_durations[notebook], notebook)
+    )
+
+
+def predict_makespan(durations: List[float], num_workers: int) -> float:
+    """Predicts the total run time of running the durations, in order, on num_workers workers.
+
+    Each duration is assigned to the worker that becomes free first, which is how a pool
+    executor picks up queued work.
+    """
+    worker_end_times = [0.0] * max(1, min(num_workers, len(durations)))
+    for duration in durations:
+        heapq.heapreplace(worker_end_times, worker_end_times[0] + duration)
+
+    return max(worker_end_times)
+
+
+def shard_notebooks(
+    notebooks: List[str], predicted_durations: Dict[str, float], shard_count: int
+) -> List[List[str]]:
+    """Splits the notebooks into shards with about the same total predicted duration.
+
+    Each notebook, longest first, is assigned to the shard with the least total duration so
+    far, then the fewest notebooks. Without history all durations are equal, so the notebooks
+    are dealt out round-robin. The split only depends on its inputs, so every machine of a
+    sharded run computes the same shards.
+    """
+    shards: List[List[str]] = [[] for _ in range(shard_count)]
+    shard_heap = [(0.0, 0, shard_index) for shard_index in range(shard_count)]
+    for notebook in sort_longest_first(notebooks, predicted_durations):
+        shard_duration, shard_size, shard_index = shard_heap[0]
+        shards[shard_index].append(notebook)
+        heapq.heapreplace(
+            shard_heap,
+            (
+                shard_duration + predicted_durations[notebook],
+                shard_size + 1,
+                shard_index,
+            ),
+        )
+
+    return shards
+
+
+def test_sort_longest_first():
+    notebooks = ["a.ipynb", "b.ipynb", "c.ipynb", "d.ipynb"]
+    predicted_durations = predict_durations(
+        notebooks=notebooks,
+        durations={"a.ipynb": 10.0, "b.ipynb": 30.0, "c.ipynb": 20.0},
+    )
+
+    assert predicted_durations["d.ipynb"] == 20.0
+    assert sort_longest_first(notebooks, predicted_durations) == [
+        "b.ipynb",
+        "c.ipynb",
+        "d.ipynb",
+        "a.ipynb",
+    ]
+
+
+def test_predict_makespan():
+    assert predict_makespan([], num_workers=4) == 0.0
+    assert predict_makespan([1.0, 2.0, 3.0], num_workers=1) == 6.0
+    assert predict_makespan([1.0, 1.0, 1.0, 3.0], num_workers=2) == 4.0
+    assert predict_makespan([3.0, 1.0, 1.0, 1.0], num_workers=2) == 3.0
+
+
+def test_shard_notebooks():
+    notebooks = ["a.ipynb", "b.ipynb", "c.ipynb", "d.ipynb", "e.ipynb"]
+
+    # Without history, the notebooks are dealt out round-robin by path
+    assert shard_notebooks(
+        notebooks, predict_durations(notebooks, durations={}), shard_count=2
+    ) == [["a.ipynb", "c.ipynb", "e.ipynb"], ["b.ipynb", "d.ipynb"]]
+
+    # With history, the shards are balanced by duration
+    assert shard_notebooks(
+        notebooks,
+        predict_durations(
+            notebooks,
+            durations={
+                "a.ipynb": 1.0,
+                "b.ipynb": 5.0,
+                "c.ipynb": 4.0,
+                "d.ipynb": 3.0,
+                "e.ipynb": 3.0,
+            },
+        ),
+        shard_count=2,
+    ) == [["b.ipynb", "e.ipynb"], ["c.ipynb", "d.ipynb", "a.ipynb"]]
+
+
+def test_save_and_load_durations(tmp_path):
+    history_file = str(tmp_path / "history.json")
+    assert load_durations(history_file) == {}
+
+    save_durations(history_file, {"a.ipynb": 1.5})
+    save_durations(history_file, {"b.ipynb": 2.5})
+
+    assert load_durations(history_file) == {"a.ipynb": 1.5, "b.ipynb": 2.5}
@@ -40,14 +40,10 @@ class UpdateVariablesPreprocessor(Preprocessor):
         # looking for this format inside notebooks:
         # VARIABLE_NAME = '[description]'
 
-        for variable_name, variable_value in replacement_map.items():
-            content = UpdateNotebookVariables.get_updated_value(
-                content=content,
-                variable_name=variable_name,
-                variable_value=variable_value,
-            )
-
-        return content
+        return UpdateNotebookVariables.get_updated_values(
+            content=content,
+            replacement_map=replacement_map,
+        )
 
     def preprocess(self, notebook, resources=None):
         executable_cells = []
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+from typing import List, Optional
+
+import nbformat
+
+"""
+ This script is used to cache the executed output of notebooks that passed.
+
+The cache key is a hash of the notebook source, after no-execute cells are removed and
+variables are replaced, together with a fingerprint of the execution environment. A notebook
+whose key has passed before doesn't need to run again, and its cached output is reused.
+
+Cached outputs are stored in the cache folder as <cache key>.ipynb.
+"""
+
+
+def get_environment_fingerprint(kernel_requirements: Optional[List[str]] = None) -> str:
+    """Hashes the Python version, the installed packages and the kernel requirements."""
+    installed_packages = subprocess.check_output(
+        [sys.executable, "-m", "pip", "freeze"]
+    ).decode("utf-8")
+
+    fingerprint = hashlib.sha256()
+    fingerprint.update(sys.version.encode("utf-8"))
+    fingerprint.update(installed_packages.encode("utf-8"))
+    fingerprint.update("\n".join(kernel_requirements or []).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def get_cache_key(nb: nbformat.NotebookNode, environment_fingerprint: str) -> str:
+    """Hashes the source of the code cells of a preprocessed notebook and the environment.
+
+    Only code cell sources are hashed, so edits to markdown or stale outputs in the
+    committed notebook don't invalidate the cache.
+    """
+    cache_key = hashlib.sha256()
+    cache_key.update(environment_fingerprint.encode("utf-8"))
+    for cell in nb.cells:
+        if cell.cell_type == "code":
+            cache_key.update(b"\0")
+            cache_key.update(cell.source.encode("utf-8"))
+    return cache_key.hexdigest()
+
+
+def lookup(cache_folder: str, cache_key: str) -> Optional[str]:
+    """Returns the path to the cached output notebook, if the cache key passed before."""
+    cached_file_path = os.path.join(cache_folder, f"{cache_key}.ipynb")
+    if os.path.exists(cached_file_path):
+        return cached_file_path
+
+    return None
+
+
+def store(cache_folder: str, cache_key: str, output_file_path: str):
+    """Stores the output notebook of a passing execution."""
+    os.makedirs(cache_folder, exist_ok=True)
+
+    # Copy to a temporary file first so a concurrent lookup never sees a partial file
+    cached_file_path = os.path.join(cache_folder, f"{cache_key}.ipynb")
+    cached_file_path_tmp = f"{cached_file_path}.{uuid.uuid4()}"
+    shutil.copyfile(output_file_path, cached_file_path_tmp)
+    os.replace(cached_file_path_tmp, cached_file_path)
+
+
+def test_cache_key_ignores_markdown_and_outputs():
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_markdown_cell("# Title"),
+        nbformat.v4.new_code_cell("print(1)"),
+    ]
+    cache_key = get_cache_key(nb, environment_fingerprint="env")
+
+    nb.cells[0].source = "# New title"
+    nb.cells[1].outputs = [nbformat.v4.new_output("stream", text="1")]
+    assert get_cache_key(nb, environment_fingerprint="env") == cache_key
+
+    nb.cells[1].source = "print(2)"
+    assert get_cache_key(nb, environment_fingerprint="env") != cache_key
+    assert get_cache_key(nb, environment_fingerprint="other") != get_cache_key(
+        nb, environment_fingerprint="env"
+    )
+
+
+def test_store_and_lookup(tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    output_file_path = tmp_path / "output.ipynb"
+    output_file_path.write_text("{}")
+
+    assert lookup(cache_folder, "key") is None
+
+    store(cache_folder, "key", str(output_file_path))
+
+    cached_file_path = lookup(cache_folder, "key")
+    assert cached_file_path is not None
+    with open(cached_file_path) as f:
+        assert f.read() == "{}"
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Optional
+
+from NotebookCellEvents import CellObserver
+
+"""
+ This script is used to stop notebooks that run past their deadline.
+
+The deadline is an absolute time, so it can be computed by the parent process from both
+the per-notebook timeout and the timeout of the whole run, and handed to a worker process.
+
+When the deadline passes, the kernel is killed along with every process that it started,
+such as "!pip install". The notebook client then fails the notebook with a dead kernel
+error, which is reported as a timeout.
+"""
+
+
+def kill_process_group(pid: Optional[int]):
+    """Kills a process and the processes in its group.
+
+    Kernels are started in a new session, so their process group contains the processes
+    that they started. A process in the group of this process is killed on its own, so that
+    the runner is never killed along with a kernel that wasn't started in a new session.
+    """
+    if pid is None:
+        return
+
+    try:
+        process_group = os.getpgid(pid)
+        if process_group == os.getpgrp():
+            os.kill(pid, signal.SIGKILL)
+        else:
+            os.killpg(process_group, signal.SIGKILL)
+    except OSError:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+class NotebookWatchdog(CellObserver):
+    """Kills the kernel of a notebook if it is still running at the deadline."""
+
+    def __init__(self, deadline: float):
+        super().__init__()
+        self._deadline = deadline
+        self._timer: Optional[threading.Timer] = None
+        self.has_timed_out = False
+
+    def attach(self, nb_man, client):
+        super().attach(nb_man, client)
+        self._timer = threading.Timer(
+            max(0.0, self._deadline - time.time()), self._stop_kernel
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def detach(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def _stop_kernel(self):
+        self.has_timed_out = True
+        kill_process_group(self.kernel_pid)
+
+
+def test_kill_process_group():
+    process = subprocess.Popen(["sleep", "60"], start_new_session=True)
+
+    kill_process_group(process.pid)
+
+    assert process.wait(timeout=10) == -signal.SIGKILL
+
+
+def test_kill_process_group_spares_own_group():
+    process = subprocess.Popen(["sleep", "60"])
+
+    kill_process_group(process.pid)
+
+    # Only the process is killed, since its group is the group of the test runner
+    assert process.wait(timeout=10) == -signal.SIGKILL
@@ -13,7 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import re
+from typing import Dict, Tuple
 
 """
  This script is used to update variables in the notebook via regex
@@ -42,6 +44,34 @@ def get_updated_value(content: str, variable_name: str, variable_value: str) ->
     )
 
 
+@functools.lru_cache(maxsize=None)
+def get_variables_pattern(variable_names: Tuple[str, ...]) -> "re.Pattern[str]":
+    # Longer names first, so a name that is a prefix of another doesn't shadow it
+    variable_names = sorted(variable_names, key=lambda name: (-len(name), name))
+    alternation = "|".join(re.escape(name) for name in variable_names)
+    return re.compile(
+        rf"(({alternation}).*?=.*?[\",\'])\[.+?\]([\",\'].*?)",
+        flags=re.M,
+    )
+
+
+def get_updated_values(content: str, replacement_map: Dict[str, str]) -> str:
+    """Replaces all variables in a single pass over the content.
+
+    The result is the same as calling get_updated_value for each variable, unless one
+    variable's match spans another variable on the same line. The content is scanned once
+    instead of once per variable.
+    """
+    if not replacement_map:
+        return content
+
+    pattern = get_variables_pattern(tuple(sorted(replacement_map)))
+    return pattern.sub(
+        lambda match: match.group(1) + replacement_map[match.group(2)] + match.group(3),
+        content,
+    )
+
+
 def test_update_value():
     new_content = get_updated_value(
         content='asdf\nPROJECT_ID = "[your-project-id]" #@param {type:"string"} \nasdf',
@@ -78,4 +108,35 @@ def test_region():
         variable_name="REGION",
         variable_value="us-central1",
     )
-    assert new_content == 'REGION = "us-central1"  # @param {type:"string"}'
\ No newline at end of file
+    assert new_content == 'REGION = "us-central1"  # @param {type:"string"}'
+
+
+def test_update_values_single_pass():
+    new_content = get_updated_values(
+        content='PROJECT_ID = "[your-project-id]"\nREGION = "[your-region]"\nasdf',
+        replacement_map={"PROJECT_ID": "sample-project", "REGION": "us-central1"},
+    )
+    assert new_content == 'PROJECT_ID = "sample-project"\nREGION = "us-central1"\nasdf'
+
+
+def test_update_values_matches_update_value():
+    replacement_map = {"PROJECT_ID": "sample-project", "REGION": "us-central1"}
+    content = "\n".join(
+        [
+            'PROJECT_ID = "[your-project-id]" #@param {type:"string"}',
+            'if PROJECT_ID == "" or PROJECT_ID is None or PROJECT_ID == "[your-project-id]":',
+            "PROJECT_ID = shell_output[0] ",
+            "REGION = '[your-region]'",
+            'BUCKET_NAME = "[your-bucket-name]"',
+        ]
+    )
+
+    expected_content = content
+    for variable_name, variable_value in replacement_map.items():
+        expected_content = get_updated_value(
+            content=expected_content,
+            variable_name=variable_name,
+            variable_value=variable_value,
+        )
+
+    assert get_updated_values(content, replacement_map) == expected_content
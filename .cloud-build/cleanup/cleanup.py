@@ -1,30 +1,15 @@
-from typing import List
+from cleanup_engine import CleanupEngine, print_summaries
 from resource_cleanup_manager import (
-    ResourceCleanupManager,
     DatasetResourceCleanupManager,
     EndpointResourceCleanupManager,
     ModelResourceCleanupManager,
 )
 
+# The number of resources to delete at the same time.
+MAX_WORKERS = 16
 
-def run_cleanup_managers(managers: List[ResourceCleanupManager], is_dry_run: bool):
-    for manager in managers:
-        type_name = manager.type_name
-
-        print(f"Fetching {type_name}'s...")
-        resources = manager.list()
-        print(f"Found {len(resources)} {type_name}'s")
-        for resource in resources:
-            if not manager.is_deletable(resource):
-                continue
-
-            if is_dry_run:
-                resource_name = manager.resource_name(resource)
-                print(f"Will delete '{type_name}': {resource_name}")
-            else:
-                manager.delete(resource)
-
-        print("")
+# The maximum number of API calls per second, across all workers.
+REQUESTS_PER_SECOND = 10
 
 
 is_dry_run = False
@@ -32,11 +17,15 @@ is_dry_run = False
 if is_dry_run:
     print("Starting cleanup in dry run mode...")
 
-# List of all cleanup managers
-managers = [
-    DatasetResourceCleanupManager(),
-    EndpointResourceCleanupManager(),
-    ModelResourceCleanupManager(),
-]
+engine = CleanupEngine(max_workers=MAX_WORKERS, requests_per_second=REQUESTS_PER_SECOND)
+
+summaries = engine.run_teardown(
+    dataset_manager=DatasetResourceCleanupManager(),
+    endpoint_manager=EndpointResourceCleanupManager(),
+    model_manager=ModelResourceCleanupManager(),
+    is_dry_run=is_dry_run,
+)
 
-run_cleanup_managers(managers=managers, is_dry_run=is_dry_run)
+print("")
+print("Summary:")
+print_summaries(summaries)
@@ -0,0 +1,316 @@
+import concurrent.futures
+import dataclasses
+import random
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from google.api_core import exceptions
+from resource_cleanup_manager import (
+    EndpointResourceCleanupManager,
+    ResourceCleanupManager,
+)
+from teardown_planner import (
+    TeardownTask,
+    create_delete_task,
+    plan_endpoint_teardown,
+)
+
+# Errors that are worth retrying, since the same request may succeed later.
+RETRYABLE_EXCEPTIONS = (
+    exceptions.TooManyRequests,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.ServiceUnavailable,
+    exceptions.GatewayTimeout,
+    ConnectionError,
+)
+
+
+class TokenBucket:
+    """Limits the rate of API calls across all workers.
+
+    Up to `capacity` calls can be made at once, after which calls are made at
+    `rate` calls per second.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._rate = rate
+        self._capacity = capacity or rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self._capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, num_tokens: int = 1):
+        # Reserve the tokens, going into debt if there aren't enough, and wait for the debt
+        # to be repaid. Waiting callers are served in the order that they reserved.
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (now - self._last_refill) * self._rate,
+            )
+            self._last_refill = now
+            self._tokens -= num_tokens
+            wait_in_seconds = -self._tokens / self._rate
+
+        if wait_in_seconds > 0:
+            self._sleep(wait_in_seconds)
+
+
+@dataclasses.dataclass
+class CleanupSummary:
+    type_name: str
+    num_found: int = 0
+    num_deleted: int = 0
+    num_skipped: int = 0
+    num_failed: int = 0
+    num_retries: int = 0
+    duration_in_seconds: float = 0.0
+    errors: List[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def deletes_per_second(self) -> float:
+        if self.duration_in_seconds == 0:
+            return 0.0
+        return self.num_deleted / self.duration_in_seconds
+
+
+class CleanupEngine:
+    """Deletes the deletable resources of cleanup managers on a bounded pool of workers.
+
+    Resources are listed a page at a time, and deletion starts with the first page. Every
+    API call waits for a token from a shared token bucket, and deletes that fail with a
+    retryable error are retried with exponential backoff and jitter. Each page of a listing
+    is requested the same way.
+
+    run_teardown deletes the resources in waves, which respect the dependencies between
+    resources.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 16,
+        requests_per_second: float = 10.0,
+        max_attempts: int = 5,
+        initial_backoff_in_seconds: float = 1.0,
+        max_backoff_in_seconds: float = 60.0,
+        retryable_exceptions=RETRYABLE_EXCEPTIONS,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._max_workers = max_workers
+        self._token_bucket = TokenBucket(rate=requests_per_second, sleep=sleep)
+        self._max_attempts = max_attempts
+        self._initial_backoff_in_seconds = initial_backoff_in_seconds
+        self._max_backoff_in_seconds = max_backoff_in_seconds
+        self._retryable_exceptions = retryable_exceptions
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def call(
+        self, summary: CleanupSummary, function: Callable[[], Any], num_calls: int = 1
+    ) -> Any:
+        """Calls a function that makes num_calls API calls, with rate limiting and retries."""
+        backoff_in_seconds = self._initial_backoff_in_seconds
+        for attempt in range(1, self._max_attempts + 1):
+            self._token_bucket.acquire(num_calls)
+            try:
+                return function()
+            except self._retryable_exceptions:
+                if attempt == self._max_attempts:
+                    raise
+
+                with self._lock:
+                    summary.num_retries += 1
+
+                self._sleep(random.uniform(0, backoff_in_seconds))
+                backoff_in_seconds = min(
+                    backoff_in_seconds * 2, self._max_backoff_in_seconds
+                )
+
+    def run_task(
+        self,
+        summary: CleanupSummary,
+        resource_name: str,
+        function: Callable[[], Any],
+        num_calls: int = 1,
+    ) -> bool:
+        """Runs a task that deletes a resource, and returns whether it succeeded."""
+        try:
+            self.call(summary, function, num_calls=num_calls)
+        except Exception as error:
+            with self._lock:
+                summary.num_failed += 1
+                summary.errors.append(f"{resource_name}: {error}")
+            print(f"Failed to delete '{summary.type_name}': {resource_name}: {error}")
+            return False
+
+        with self._lock:
+            summary.num_deleted += 1
+        return True
+
+    def run_teardown_task(self, summary: CleanupSummary, task: TeardownTask):
+        failed_dependencies = [
+            dependency.resource_name
+            for dependency in task.dependencies
+            if dependency.is_failed
+        ]
+        if failed_dependencies:
+            task.is_failed = True
+            with self._lock:
+                summary.num_skipped += 1
+            print(
+                f"Skipping '{task.resource_name}' due to failing to delete: {', '.join(failed_dependencies)}."
+            )
+            return
+
+        task.is_failed = not self.run_task(
+            summary=summary,
+            resource_name=task.resource_name,
+            function=task.run,
+            num_calls=task.num_calls,
+        )
+
+    def create_submit(
+        self, executor: concurrent.futures.Executor, is_dry_run: bool
+    ) -> Callable[[CleanupSummary, TeardownTask], None]:
+        """Creates a function that submits a teardown task to the executor.
+
+        The function blocks while too many tasks are waiting for a worker, so that pages are
+        only fetched as fast as resources are deleted. In dry run mode, it only prints the
+        task.
+        """
+        pending_tasks = threading.BoundedSemaphore(self._max_workers * 2)
+
+        def run(summary: CleanupSummary, task: TeardownTask):
+            try:
+                self.run_teardown_task(summary, task)
+            finally:
+                pending_tasks.release()
+
+        def submit(summary: CleanupSummary, task: TeardownTask):
+            if is_dry_run:
+                print(f"Will run: {task.description}")
+                return
+
+            pending_tasks.acquire()
+            executor.submit(run, summary, task)
+
+        return submit
+
+    def stream_deletable(
+        self,
+        manager: ResourceCleanupManager,
+        summary: CleanupSummary,
+        handle: Callable[[Any], None],
+    ):
+        """Lists the resources of a manager page by page, handling each deletable resource."""
+        print(f"Fetching {manager.type_name}'s...")
+
+        # Deletion of the previous pages continues while the next page is fetched
+        for resources in manager.list_pages(
+            fetch=lambda function: self.call(summary, function)
+        ):
+            summary.num_found += len(resources)
+            for resource in resources:
+                if not manager.is_deletable(resource):
+                    summary.num_skipped += 1
+                    continue
+
+                handle(resource)
+
+        print(f"Found {summary.num_found} {manager.type_name}'s")
+
+    def run_teardown(
+        self,
+        dataset_manager: ResourceCleanupManager,
+        endpoint_manager: EndpointResourceCleanupManager,
+        model_manager: ResourceCleanupManager,
+        is_dry_run: bool,
+    ) -> List[CleanupSummary]:
+        """Tears down resources in waves, which respect the dependencies between resources.
+
+        The endpoints are listed in full first, since they determine which models are still
+        deployed. The first wave deletes the endpoints, and deletes datasets and models that
+        aren't deployed as their pages are listed. Models that were deployed to the deleted
+        endpoints are held back for the second wave.
+
+        Returns:
+            The summaries of the datasets, endpoints and models, in that order.
+        """
+        dataset_summary = CleanupSummary(type_name=dataset_manager.type_name)
+        endpoint_summary = CleanupSummary(type_name=endpoint_manager.type_name)
+        model_summary = CleanupSummary(type_name=model_manager.type_name)
+        time_start = time.perf_counter()
+
+        print(f"Fetching {endpoint_manager.type_name}'s...")
+        plan = plan_endpoint_teardown(
+            endpoint_manager=endpoint_manager,
+            fetch=lambda function: self.call(endpoint_summary, function),
+        )
+        endpoint_summary.num_found = len(plan.endpoint_tasks)
+
+        second_wave = []
+
+        def handle_model(model: Any):
+            model_task = plan.create_model_task(model_manager, model)
+            if model_task is None:
+                model_summary.num_skipped += 1
+            elif model_task.dependencies:
+                second_wave.append(model_task)
+            else:
+                submit(model_summary, model_task)
+
+        print("Running wave 1...")
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._max_workers
+        ) as executor:
+            submit = self.create_submit(executor, is_dry_run)
+            for endpoint_task in plan.endpoint_tasks:
+                submit(endpoint_summary, endpoint_task)
+
+            self.stream_deletable(
+                manager=dataset_manager,
+                summary=dataset_summary,
+                handle=lambda dataset: submit(
+                    dataset_summary, create_delete_task(dataset_manager, dataset)
+                ),
+            )
+            self.stream_deletable(
+                manager=model_manager, summary=model_summary, handle=handle_model
+            )
+
+        if second_wave:
+            print("Running wave 2...")
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_workers
+            ) as executor:
+                submit = self.create_submit(executor, is_dry_run)
+                for model_task in second_wave:
+                    submit(model_summary, model_task)
+
+        summaries = [dataset_summary, endpoint_summary, model_summary]
+        for summary in summaries:
+            summary.duration_in_seconds = time.perf_counter() - time_start
+
+        return summaries
+
+
+def print_summaries(summaries: List[CleanupSummary]):
+    for summary in summaries:
+        print(
+            f"{summary.type_name}: found {summary.num_found}, deleted {summary.num_deleted}, "
+            f"skipped {summary.num_skipped}, failed {summary.num_failed}, "
+            f"retried {summary.num_retries} times in {summary.duration_in_seconds:.1f}s "
+            f"({summary.deletes_per_second:.1f} deletes/s)"
+        )
+        for error in summary.errors:
+            print(f"  {error}")
@@ -1,12 +1,15 @@
 import abc
 from google.cloud import aiplatform
-from typing import Any
+from typing import Any, Callable, Iterator, List
 from proto.datetime_helpers import DatetimeWithNanoseconds
-from google.cloud.aiplatform import base
+from google.cloud.aiplatform import base, initializer
 
 # If a resource was updated within this number of seconds, do not delete.
 RESOURCE_UPDATE_BUFFER_IN_SECONDS = 60 * 60 * 8
 
+# The number of resources to fetch per list request.
+LIST_PAGE_SIZE = 100
+
 
 class ResourceCleanupManager(abc.ABC):
     @property
@@ -18,6 +21,13 @@ class ResourceCleanupManager(abc.ABC):
     def list(self) -> Any:
         pass
 
+    def list_pages(
+        self, fetch: Callable[[Callable[[], Any]], Any] = lambda function: function()
+    ) -> Iterator[List[Any]]:
+        """Lists resources a page at a time, making each list request through fetch."""
+        # Managers that can't list page by page return all resources as one page
+        yield fetch(self.list)
+
     @abc.abstractmethod
     def resource_name(self, resource: Any) -> str:
         pass
@@ -60,6 +70,58 @@ class VertexAIResourceCleanupManager(ResourceCleanupManager):
     def list(self) -> Any:
         return self.vertex_ai_resource.list()
 
+    def list_pages(
+        self, fetch: Callable[[Callable[[], Any]], Any] = lambda function: function()
+    ) -> Iterator[List[Any]]:
+        empty_resource = self.vertex_ai_resource._empty_constructor()
+        list_method = getattr(empty_resource.api_client, empty_resource._list_method)
+
+        # List the least recently updated resources first, so that listing can stop at the
+        # first resource that was updated too recently to delete. Display names can't be
+        # filtered by prefix, so "perm" resources are still skipped by is_deletable.
+        list_request = {
+            "parent": initializer.global_config.common_location_path(
+                project=empty_resource.project, location=empty_resource.location
+            ),
+            "order_by": "update_time",
+            "page_size": LIST_PAGE_SIZE,
+        }
+
+        # The response field with the resources is named after the list method,
+        # for example list_models returns the models field.
+        resources_field = empty_resource._list_method[len("list_") :]
+
+        # Each page is only fetched once the previous page has been consumed. Pages are
+        # requested one at a time, rather than through the pager, so that fetch can retry
+        # the request of a single page. The pager returned by a list request exposes the
+        # fields of its first response, which is the requested page.
+        page_token = ""
+        while True:
+            page_request = dict(list_request, page_token=page_token)
+            page = fetch(lambda: list_method(request=page_request))
+            resources = []
+            for gapic_resource in getattr(page, resources_field):
+                resource = self.vertex_ai_resource._construct_sdk_resource_from_gapic(
+                    gapic_resource,
+                    project=empty_resource.project,
+                    location=empty_resource.location,
+                    credentials=empty_resource.credentials,
+                )
+                if (
+                    self.get_seconds_since_modification(resource)
+                    <= RESOURCE_UPDATE_BUFFER_IN_SECONDS
+                ):
+                    yield resources
+                    return
+
+                resources.append(resource)
+
+            yield resources
+
+            page_token = page.next_page_token
+            if not page_token:
+                return
+
     def resource_name(self, resource: Any) -> str:
         return resource.display_name
 
@@ -79,6 +141,14 @@ class DatasetResourceCleanupManager(VertexAIResourceCleanupManager):
 class EndpointResourceCleanupManager(VertexAIResourceCleanupManager):
     vertex_ai_resource = aiplatform.Endpoint
 
+    def deployed_model_names(self, resource: Any) -> List[str]:
+        # A deployed model can name a model version, as in "<model>@<version>", while
+        # models are listed by their resource name without a version
+        return [
+            deployed_model.model.split("@")[0]
+            for deployed_model in resource.gca_resource.deployed_models
+        ]
+
     def delete(self, resource):
         resource.delete(force=True)
 
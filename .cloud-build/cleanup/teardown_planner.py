@@ -0,0 +1,107 @@
+import collections
+import dataclasses
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from resource_cleanup_manager import (
+    EndpointResourceCleanupManager,
+    ResourceCleanupManager,
+)
+
+# Resources are torn down in waves. Every task in a wave is independent of the others in the
+# same wave, so a wave runs in parallel, and each wave starts once the previous one is done.
+#
+#   Wave 1: Endpoints, each of which undeploys all its models and is then deleted. Datasets,
+#           and models that aren't deployed.
+#   Wave 2: Models that were deployed to the endpoints of wave 1.
+#
+# Models that are deployed to an endpoint that isn't deleted are kept, since they can't be
+# deleted while deployed.
+#
+# Only the endpoints are planned before the teardown starts, since they determine which
+# models are still deployed. Datasets and models are planned as their pages are listed.
+
+
+@dataclasses.dataclass(eq=False)
+class TeardownTask:
+    type_name: str
+    resource_name: str
+    description: str
+    num_calls: int
+    run: Callable[[], None]
+    dependencies: List["TeardownTask"] = dataclasses.field(default_factory=list)
+    is_failed: bool = False
+
+
+def create_delete_task(manager: ResourceCleanupManager, resource: Any) -> TeardownTask:
+    resource_name = manager.resource_name(resource)
+    return TeardownTask(
+        type_name=manager.type_name,
+        resource_name=resource_name,
+        description=f"Delete '{manager.type_name}': {resource_name}",
+        num_calls=1,
+        run=lambda: manager.delete(resource),
+    )
+
+
+@dataclasses.dataclass
+class EndpointTeardownPlan:
+    endpoint_tasks: List[TeardownTask]
+    endpoint_tasks_by_model_name: Dict[str, List[TeardownTask]]
+    kept_model_names: Set[str]
+
+    def create_model_task(
+        self, model_manager: ResourceCleanupManager, model: Any
+    ) -> Optional[TeardownTask]:
+        """Creates the task that deletes a model, or returns None if the model is kept.
+
+        The task depends on the tasks of the endpoints that the model is deployed to, so it
+        belongs to the second wave if it has any dependencies.
+        """
+        if model.resource_name in self.kept_model_names:
+            print(
+                f"Skipping '{model_manager.resource_name(model)}' due to being deployed to an endpoint that is kept."
+            )
+            return None
+
+        model_task = create_delete_task(model_manager, model)
+        model_task.dependencies = self.endpoint_tasks_by_model_name.get(
+            model.resource_name, []
+        )
+        return model_task
+
+
+def plan_endpoint_teardown(
+    endpoint_manager: EndpointResourceCleanupManager,
+    fetch: Callable[[Callable[[], Any]], Any] = lambda function: function(),
+) -> EndpointTeardownPlan:
+    """Plans the teardown of the endpoints, making each list request through fetch."""
+    endpoint_tasks = []
+
+    # All endpoints are needed, including recent ones, to know which models are still in use
+    endpoint_tasks_by_model_name = collections.defaultdict(list)
+    kept_model_names = set()
+    for endpoint in fetch(endpoint_manager.list):
+        deployed_model_names = endpoint_manager.deployed_model_names(endpoint)
+        if not endpoint_manager.is_deletable(endpoint):
+            kept_model_names.update(deployed_model_names)
+            continue
+
+        # Undeploy all models of an endpoint in one task, as the endpoint's traffic split
+        # has to be updated one model at a time
+        endpoint_task = create_delete_task(endpoint_manager, endpoint)
+        endpoint_task.description = (
+            f"Undeploy {len(deployed_model_names)} models from and delete "
+            f"'{endpoint_manager.type_name}': {endpoint_task.resource_name}"
+        )
+        # One call to get the endpoint, one per undeploy and one to delete
+        endpoint_task.num_calls = len(deployed_model_names) + 2
+        endpoint_tasks.append(endpoint_task)
+
+        for deployed_model_name in deployed_model_names:
+            endpoint_tasks_by_model_name[deployed_model_name].append(endpoint_task)
+
+    return EndpointTeardownPlan(
+        endpoint_tasks=endpoint_tasks,
+        endpoint_tasks_by_model_name=dict(endpoint_tasks_by_model_name),
+        kept_model_names=kept_model_names,
+    )
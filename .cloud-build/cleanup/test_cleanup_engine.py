@@ -0,0 +1,312 @@
+import datetime
+import threading
+import types
+from typing import List, Optional
+
+from google.api_core import exceptions
+from proto.datetime_helpers import DatetimeWithNanoseconds
+
+from cleanup_engine import CleanupEngine, CleanupSummary, TokenBucket
+from resource_cleanup_manager import (
+    EndpointResourceCleanupManager,
+    VertexAIResourceCleanupManager,
+)
+from teardown_planner import plan_endpoint_teardown
+
+# An in-process fake of the aiplatform resource API, which records the calls made to it.
+
+
+class FakeResource:
+    def __init__(
+        self,
+        api,
+        display_name: str,
+        age_in_hours: float,
+        deployed_model_names: Optional[List[str]] = None,
+    ):
+        self._api = api
+        self.display_name = display_name
+        self.resource_name = f"projects/project/locations/us-central1/{display_name}"
+        self.gca_resource = types.SimpleNamespace(
+            deployed_models=[
+                types.SimpleNamespace(model=deployed_model_name)
+                for deployed_model_name in deployed_model_names or []
+            ]
+        )
+        self.update_time = DatetimeWithNanoseconds.now(
+            tz=datetime.timezone.utc
+        ) - datetime.timedelta(hours=age_in_hours)
+        self.num_delete_calls = 0
+
+    def delete(self, force: bool = False):
+        with self._api.lock:
+            if self._api.num_pages_fetched_at_first_delete is None:
+                self._api.num_pages_fetched_at_first_delete = (
+                    self._api.num_pages_fetched
+                )
+            self.num_delete_calls += 1
+            self._api.num_running += 1
+            self._api.max_running = max(self._api.max_running, self._api.num_running)
+
+        try:
+            if self.num_delete_calls <= self._api.transient_errors.get(
+                self.display_name, 0
+            ):
+                raise exceptions.ServiceUnavailable("try again")
+            if self.display_name in self._api.permanent_errors:
+                raise exceptions.PermissionDenied("not allowed")
+
+            with self._api.lock:
+                self._api.deleted.append(self.display_name)
+                self._api.all_deleted.append(self.display_name)
+        finally:
+            with self._api.lock:
+                self._api.num_running -= 1
+
+
+class FakePage:
+    def __init__(self, fake_resources: List[FakeResource], next_page_token: str):
+        self.fake_resources = fake_resources
+        self.next_page_token = next_page_token
+
+
+class FakeResourceApi:
+    """Fakes both the SDK resource class and the GAPIC client that it lists with."""
+
+    _resource_noun = "fakeResources"
+    _list_method = "list_fake_resources"
+    project = "project"
+    location = "us-central1"
+    credentials = None
+
+    def __init__(self, lock: Optional[threading.Lock] = None, all_deleted=None):
+        # APIs of different resource types can share a lock and record of all deletes
+        self.lock = lock or threading.Lock()
+        self.all_deleted = all_deleted if all_deleted is not None else []
+        self.resources: List[FakeResource] = []
+        self.deleted: List[str] = []
+        self.transient_errors = {}
+        self.permanent_errors = set()
+        self.num_running = 0
+        self.max_running = 0
+        self.num_pages_fetched = 0
+        self.num_list_errors = 0
+        self.num_pages_fetched_at_first_delete = None
+
+    @property
+    def api_client(self):
+        return self
+
+    def _empty_constructor(self):
+        return self
+
+    def list(self) -> List[FakeResource]:
+        return list(self.resources)
+
+    def _construct_sdk_resource_from_gapic(self, gapic_resource, **kwargs):
+        return gapic_resource
+
+    def list_fake_resources(self, request) -> FakePage:
+        assert request["parent"] == "projects/project/locations/us-central1"
+        assert request["order_by"] == "update_time"
+        if self.num_list_errors > 0:
+            self.num_list_errors -= 1
+            raise exceptions.ServiceUnavailable("try again")
+
+        self.num_pages_fetched += 1
+        resources = sorted(self.resources, key=lambda resource: resource.update_time)
+        start = int(request["page_token"] or 0)
+        end = start + request["page_size"]
+        return FakePage(
+            fake_resources=resources[start:end],
+            next_page_token=str(end) if end < len(resources) else "",
+        )
+
+
+def create_manager(
+    api: FakeResourceApi, manager_class=VertexAIResourceCleanupManager
+) -> VertexAIResourceCleanupManager:
+    class FakeResourceCleanupManager(manager_class):
+        vertex_ai_resource = api
+
+    return FakeResourceCleanupManager()
+
+
+def run_teardown(
+    engine: CleanupEngine,
+    dataset_api: Optional[FakeResourceApi] = None,
+    endpoint_api: Optional[FakeResourceApi] = None,
+    model_api: Optional[FakeResourceApi] = None,
+    is_dry_run: bool = False,
+) -> List[CleanupSummary]:
+    return engine.run_teardown(
+        dataset_manager=create_manager(dataset_api or FakeResourceApi()),
+        endpoint_manager=create_manager(
+            endpoint_api or FakeResourceApi(), EndpointResourceCleanupManager
+        ),
+        model_manager=create_manager(model_api or FakeResourceApi()),
+        is_dry_run=is_dry_run,
+    )
+
+
+def test_cleanup_engine_deletes_with_retries():
+    api = FakeResourceApi()
+    api.resources = [
+        FakeResource(api, f"resource-{index}", age_in_hours=24) for index in range(20)
+    ] + [
+        FakeResource(api, "perm-resource", age_in_hours=24),
+        FakeResource(api, "new-resource", age_in_hours=1),
+    ]
+    api.transient_errors = {"resource-3": 2}
+    api.permanent_errors = {"resource-7"}
+
+    engine = CleanupEngine(
+        max_workers=4, requests_per_second=1000, sleep=lambda seconds: None
+    )
+    [summary, _, _] = run_teardown(engine, dataset_api=api)
+
+    assert summary.type_name == "fakeResources"
+    # The recent resource ends the listing, so it isn't found
+    assert summary.num_found == 21
+    assert summary.num_skipped == 1
+    assert summary.num_deleted == 19
+    assert summary.num_failed == 1
+    assert summary.num_retries == 2
+    assert "resource-3" in api.deleted
+    assert "resource-7" not in api.deleted
+    assert "perm-resource" not in api.deleted
+    assert api.max_running <= 4
+
+
+def test_cleanup_engine_stops_listing_at_recent_resources():
+    api = FakeResourceApi()
+    api.resources = [
+        FakeResource(api, f"old-resource-{index}", age_in_hours=24)
+        for index in range(150)
+    ] + [
+        FakeResource(api, f"new-resource-{index}", age_in_hours=1)
+        for index in range(250)
+    ]
+
+    engine = CleanupEngine(requests_per_second=1000, sleep=lambda seconds: None)
+    [summary, _, _] = run_teardown(engine, dataset_api=api)
+
+    # The second page has the first recent resource, so later pages are never fetched
+    assert api.num_pages_fetched == 2
+    assert summary.num_found == 150
+    assert summary.num_deleted == 150
+    assert not any(name.startswith("new-resource") for name in api.deleted)
+
+
+def test_cleanup_engine_retries_list_requests():
+    api = FakeResourceApi()
+    api.resources = [
+        FakeResource(api, f"resource-{index}", age_in_hours=24) for index in range(150)
+    ]
+    api.num_list_errors = 2
+
+    engine = CleanupEngine(requests_per_second=1000, sleep=lambda seconds: None)
+    [summary, _, _] = run_teardown(engine, dataset_api=api)
+
+    assert api.num_pages_fetched == 2
+    assert summary.num_retries == 2
+    assert summary.num_deleted == 150
+
+
+def test_cleanup_engine_deletes_before_listing_more_pages():
+    api = FakeResourceApi()
+    api.resources = [
+        FakeResource(api, f"resource-{index}", age_in_hours=24) for index in range(250)
+    ]
+
+    engine = CleanupEngine(
+        max_workers=1, requests_per_second=1000, sleep=lambda seconds: None
+    )
+    [summary, _, _] = run_teardown(engine, dataset_api=api)
+
+    # Only a few deletes can wait for a worker, so deletion starts on the first page
+    assert api.num_pages_fetched_at_first_delete == 1
+    assert api.num_pages_fetched == 3
+    assert summary.num_deleted == 250
+
+
+def test_cleanup_engine_dry_run_deletes_nothing():
+    api = FakeResourceApi()
+    api.resources = [FakeResource(api, "resource", age_in_hours=24)]
+
+    engine = CleanupEngine(sleep=lambda seconds: None)
+    [summary, _, _] = run_teardown(engine, dataset_api=api, is_dry_run=True)
+
+    assert summary.num_deleted == 0
+    assert api.deleted == []
+
+
+def test_teardown_deletes_models_after_their_endpoints():
+    lock = threading.Lock()
+    all_deleted = []
+    dataset_api = FakeResourceApi(lock=lock, all_deleted=all_deleted)
+    endpoint_api = FakeResourceApi(lock=lock, all_deleted=all_deleted)
+    model_api = FakeResourceApi(lock=lock, all_deleted=all_deleted)
+
+    model_names = {}
+    for display_name in ["model-deployed", "model-kept", "model-unused"]:
+        model = FakeResource(model_api, display_name, age_in_hours=24)
+        model_api.resources.append(model)
+        model_names[display_name] = model.resource_name
+
+    dataset_api.resources = [FakeResource(dataset_api, "dataset", age_in_hours=24)]
+    endpoint_api.resources = [
+        FakeResource(
+            endpoint_api,
+            "endpoint",
+            age_in_hours=24,
+            # Deployed models can name a version of the model
+            deployed_model_names=[model_names["model-deployed"] + "@2"],
+        ),
+        FakeResource(
+            endpoint_api,
+            "perm-endpoint",
+            age_in_hours=24,
+            deployed_model_names=[model_names["model-kept"]],
+        ),
+    ]
+
+    model_api.num_list_errors = 1
+
+    plan = plan_endpoint_teardown(
+        create_manager(endpoint_api, EndpointResourceCleanupManager)
+    )
+    assert [task.resource_name for task in plan.endpoint_tasks] == ["endpoint"]
+    assert plan.endpoint_tasks[0].num_calls == 3
+
+    engine = CleanupEngine(requests_per_second=1000, sleep=lambda seconds: None)
+    [dataset_summary, endpoint_summary, model_summary] = run_teardown(
+        engine, dataset_api=dataset_api, endpoint_api=endpoint_api, model_api=model_api
+    )
+
+    assert sorted(all_deleted) == [
+        "dataset",
+        "endpoint",
+        "model-deployed",
+        "model-unused",
+    ]
+    assert all_deleted.index("endpoint") < all_deleted.index("model-deployed")
+    assert dataset_summary.num_deleted == 1
+    assert endpoint_summary.num_deleted == 1
+    assert model_summary.num_deleted == 2
+    assert model_summary.num_skipped == 1
+    assert model_summary.num_retries == 1
+
+
+def test_token_bucket_limits_rate():
+    now = [0.0]
+
+    def sleep(seconds: float):
+        now[0] += seconds
+
+    token_bucket = TokenBucket(rate=10, capacity=5, clock=lambda: now[0], sleep=sleep)
+    for _ in range(25):
+        token_bucket.acquire()
+
+    # The first 5 calls are made at once, then 10 calls per second
+    assert abs(now[0] - 2.0) < 1e-6
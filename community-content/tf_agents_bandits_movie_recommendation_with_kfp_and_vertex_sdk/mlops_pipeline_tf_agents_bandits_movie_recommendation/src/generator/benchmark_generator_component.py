@@ -0,0 +1,110 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the file formats of the Generator component.
+
+Runs the Generator component locally once per `bigquery_tmp_file` format, with
+the BigQuery client mocked out, and reports the time taken to encode the
+replay buffer into the file and the size of the file.
+
+Example:
+  python3 -m src.generator.benchmark_generator_component \
+    --raw_data_path=u.data --driver_steps=100
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict
+from unittest import mock
+
+from src.generator import generator_component
+from tf_agents.drivers import dynamic_step_driver
+
+FORMATS = ("json", "parquet")
+
+
+def benchmark_format(args: argparse.Namespace,
+                     bigquery_tmp_file_format: str) -> Dict[str, float]:
+  """Runs the Generator component with one file format.
+
+  Args:
+    args: Parsed command line arguments.
+    bigquery_tmp_file_format: Format of the file loaded into BigQuery.
+
+  Returns:
+    A dict of the encode time in seconds and the file size in bytes.
+  """
+  timestamps = {}
+  run_driver = dynamic_step_driver.DynamicStepDriver.run
+
+  def run_driver_and_record_time(driver, *run_args, **run_kwargs):
+    result = run_driver(driver, *run_args, **run_kwargs)
+    timestamps["encode_start"] = time.perf_counter()
+    return result
+
+  def load_table_from_file(*unused_args, **unused_kwargs):
+    timestamps["encode_end"] = time.perf_counter()
+    return mock.MagicMock()
+
+  tmp_fd, bigquery_tmp_file = tempfile.mkstemp()
+  os.close(tmp_fd)
+  try:
+    with mock.patch.object(dynamic_step_driver.DynamicStepDriver, "run",
+                           run_driver_and_record_time), mock.patch(
+                               "google.cloud.bigquery.Client") as mock_client:
+      mock_client.return_value.load_table_from_file.side_effect = (
+          load_table_from_file)
+      generator_component.generate_movielens_dataset_for_bigquery(
+          project_id="project-id",
+          raw_data_path=args.raw_data_path,
+          batch_size=args.batch_size,
+          rank_k=args.rank_k,
+          num_actions=args.num_actions,
+          driver_steps=args.driver_steps,
+          bigquery_tmp_file=bigquery_tmp_file,
+          bigquery_dataset_id="project-id.movielens_dataset",
+          bigquery_location="us",
+          bigquery_table_id="project-id.movielens_dataset.training_dataset",
+          bigquery_tmp_file_format=bigquery_tmp_file_format)
+    file_size = os.path.getsize(bigquery_tmp_file)
+  finally:
+    os.remove(bigquery_tmp_file)
+
+  return {
+      "encode_time": timestamps["encode_end"] - timestamps["encode_start"],
+      "file_size": file_size,
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--raw_data_path", type=str, required=True,
+      help="Path to MovieLens 100K's \"u.data\" file.")
+  parser.add_argument("--batch_size", type=int, default=8)
+  parser.add_argument("--rank_k", type=int, default=20)
+  parser.add_argument("--num_actions", type=int, default=20)
+  parser.add_argument("--driver_steps", type=int, default=100)
+  args = parser.parse_args()
+
+  print(f"{'format':<10}{'encode time (s)':>18}{'file size (MB)':>18}")
+  for bigquery_tmp_file_format in FORMATS:
+    result = benchmark_format(args, bigquery_tmp_file_format)
+    print(f"{bigquery_tmp_file_format:<10}{result['encode_time']:>18.2f}"
+          f"{result['file_size'] / 1024 / 1024:>18.2f}")
+
+
+if __name__ == "__main__":
+  main()
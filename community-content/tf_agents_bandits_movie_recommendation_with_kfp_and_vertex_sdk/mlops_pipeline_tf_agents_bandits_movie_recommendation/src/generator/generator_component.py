@@ -26,7 +26,10 @@ def generate_movielens_dataset_for_bigquery(
     bigquery_tmp_file: str,
     bigquery_dataset_id: str,
     bigquery_location: str,
-    bigquery_table_id: str
+    bigquery_table_id: str,
+    bigquery_tmp_file_format: str = "json",
+    num_simulation_workers: int = 1,
+    environment_cache_dir: str = ""
 ) -> NamedTuple("Outputs", [
     ("bigquery_dataset_id", str),
     ("bigquery_location", str),
@@ -37,8 +40,9 @@ def generate_movielens_dataset_for_bigquery(
   Serves as the Generator pipeline component:
   1. Generates `trajectories.Trajectory` data by applying a random policy on
     MovieLens simulation environment.
-  2. Converts `trajectories.Trajectory` data to JSON format.
-  3. Loads JSON-formatted data into BigQuery.
+  2. Converts `trajectories.Trajectory` data to newline-delimited JSON or to
+    Parquet.
+  3. Loads the converted data into BigQuery.
 
   This function is to be built into a Kubeflow Pipelines (KFP) component. As a
   result, this function must be entirely self-contained. This means that the
@@ -54,12 +58,23 @@ def generate_movielens_dataset_for_bigquery(
       the observation dimension.
     num_actions: Number of actions (movie items) to choose from.
     driver_steps: Number of steps to run per batch.
-    bigquery_tmp_file: Path to a JSON file containing the training dataset.
+    bigquery_tmp_file: Path to a file containing the training dataset.
     bigquery_dataset_id: A string of the BigQuery dataset ID in the format of
       "project.dataset".
     bigquery_location: A string of the BigQuery dataset location.
     bigquery_table_id: A string of the BigQuery table ID in the format of
       "project.dataset.table".
+    bigquery_tmp_file_format: Format of `bigquery_tmp_file`, either "json" for
+      newline-delimited JSON or "parquet". Parquet is written directly from the
+      trajectory tensors in row groups, which is faster to encode and smaller
+      than JSON for large datasets.
+    num_simulation_workers: Number of worker processes to run the simulation
+      in. Each worker steps its own copy of the environment with its own seed
+      for a share of `driver_steps`, and their trajectories are merged.
+    environment_cache_dir: Local or Cloud Storage path to the directory holding
+      cached MovieLens environments, shared with the Logger and Simulator. The
+      environment's matrix factorization is loaded from it instead of being
+      computed from `raw_data_path` when possible. Not used if empty.
 
   Returns:
     A NamedTuple of (`bigquery_dataset_id`, `bigquery_location`,
@@ -67,18 +82,209 @@ def generate_movielens_dataset_for_bigquery(
   """
   # pylint: disable=g-import-not-at-top
   import collections
+  import hashlib
+  import io
   import json
-  from typing import Any, Dict
+  import multiprocessing
+  import os
+  import random
+  from typing import Any, Dict, List, Optional
+  import uuid
 
   from google.cloud import bigquery
+  import numpy as np
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  import tensorflow as tf
 
   from tf_agents import replay_buffers
   from tf_agents import trajectories
   from tf_agents.bandits.agents.examples.v2 import trainer
+  from tf_agents.bandits.environments import bandit_py_environment
   from tf_agents.bandits.environments import movielens_py_environment
   from tf_agents.drivers import dynamic_step_driver
   from tf_agents.environments import tf_py_environment
+  from tf_agents.policies import random_py_policy
   from tf_agents.policies import random_tf_policy
+  from tf_agents.specs import array_spec
+  from tf_agents.trajectories import time_step as ts
+
+  # Number of driver steps converted at a time when writing the dataset file;
+  # also the number of rows in each Parquet row group.
+  write_chunk_size = 1024
+
+  # Arrow schema of the Parquet file, matching the BigQuery table schema.
+  parquet_schema = pa.schema([
+      ("step_type", pa.list_(pa.int64())),
+      ("observation",
+       pa.list_(pa.struct([("observation_batch", pa.list_(pa.float64()))]))),
+      ("action", pa.list_(pa.int64())),
+      ("policy_info", pa.list_(pa.float64())),
+      ("next_step_type", pa.list_(pa.int64())),
+      ("reward", pa.list_(pa.float64())),
+      ("discount", pa.list_(pa.float64())),
+  ])
+
+  class CachedMovieLensPyEnvironment(
+      movielens_py_environment.MovieLensPyEnvironment):
+    """A MovieLens environment built from cached matrix factorization results.
+
+    Behaves as `movielens_py_environment.MovieLensPyEnvironment`, without
+    loading the data file or computing the matrix factorization.
+    """
+
+    def __init__(self,
+                 u_hat: np.ndarray,
+                 v_hat: np.ndarray,
+                 rank_k: int,
+                 batch_size: int):  # pylint: disable=super-init-not-called
+      """Initializes the environment from the user and movie factor matrices.
+
+      Args:
+        u_hat: User factor matrix, of shape [num_users, rank].
+        v_hat: Movie factor matrix, of shape [rank, num_movies].
+        rank_k: Rank for matrix factorization in the MovieLens environment; also
+          the observation dimension.
+        batch_size: Batch size of environment generated quantities eg. rewards.
+      """
+      self._num_actions = v_hat.shape[1]
+      self._batch_size = batch_size
+      self._context_dim = rank_k
+      self._effective_num_users = u_hat.shape[0]
+      self._u_hat = u_hat
+      self._v_hat = v_hat
+      self._approx_ratings_matrix = np.matmul(u_hat, v_hat)
+
+      self._current_users = np.zeros(batch_size)
+      self._previous_users = np.zeros(batch_size)
+
+      self._action_spec = array_spec.BoundedArraySpec(
+          shape=(),
+          dtype=np.int32,
+          minimum=0,
+          maximum=self._num_actions - 1,
+          name="action")
+      observation_spec = array_spec.ArraySpec(
+          shape=(self._context_dim,), dtype=np.float64, name="observation")
+      self._time_step_spec = ts.time_step_spec(observation_spec)
+      self._observation = np.zeros((self._batch_size, self._context_dim))
+
+      self._optimal_action_table = np.argmax(
+          self._approx_ratings_matrix, axis=1)
+      self._optimal_reward_table = np.max(
+          self._approx_ratings_matrix, axis=1)
+
+      bandit_py_environment.BanditPyEnvironment.__init__(
+          self, observation_spec, self._action_spec, name="movielens")
+
+  def get_environment_cache_dir(
+      environment_cache_dir: str,
+      raw_data_path: str,
+      rank_k: int,
+      num_actions: int) -> str:
+    """Gets the directory of the cached environment for the given parameters.
+
+    The cache is keyed by a fingerprint of the data file, made of its path, size
+    and modification time, so that looking up the cache doesn't read the file.
+
+    Args:
+      environment_cache_dir: Path to the directory holding cached environments.
+      raw_data_path: Path to MovieLens 100K's "u.data" file.
+      rank_k: Rank for matrix factorization in the MovieLens environment.
+      num_actions: Number of actions (movie items) to choose from.
+
+    Returns:
+      Path to the directory of the cached environment.
+    """
+    stat = tf.io.gfile.stat(raw_data_path)
+    key = (f"{raw_data_path}:{stat.length}:{stat.mtime_nsec}:{rank_k}:"
+           f"{num_actions}")
+    key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(environment_cache_dir, f"movielens-{key_hash}")
+
+  def save_array(path: str, array: np.ndarray) -> None:
+    """Saves `array` as a .npy file, which is replaced atomically.
+
+    Args:
+      path: Local or Cloud Storage path of the file.
+      array: Array to save.
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    with tf.io.gfile.GFile(tmp_path, "wb") as f:
+      f.write(buffer.getvalue())
+    tf.io.gfile.rename(tmp_path, path, overwrite=True)
+
+  def load_array(path: str) -> np.ndarray:
+    """Loads an array from a .npy file, memory-mapping local files.
+
+    Args:
+      path: Local or Cloud Storage path of the file.
+
+    Returns:
+      The array in the file.
+    """
+    if "://" not in path:
+      return np.load(path, mmap_mode="r")
+    with tf.io.gfile.GFile(path, "rb") as f:
+      return np.load(io.BytesIO(f.read()))
+
+  def load_movielens_environment(
+      raw_data_path: str,
+      rank_k: int,
+      batch_size: int,
+      num_actions: int,
+      environment_cache_dir: Optional[str]
+  ) -> movielens_py_environment.MovieLensPyEnvironment:
+    """Loads the MovieLens simulation environment, from the cache if possible.
+
+    Without a cache directory, the environment is built from the data file.
+    With one, the user and movie factor matrices are loaded from the cache, or
+    saved to it after building the environment the first time.
+
+    Args:
+      raw_data_path: Path to MovieLens 100K's "u.data" file.
+      rank_k: Rank for matrix factorization in the MovieLens environment; also
+        the observation dimension.
+      batch_size: Batch size of environment generated quantities eg. rewards.
+      num_actions: Number of actions (movie items) to choose from.
+      environment_cache_dir: Local or Cloud Storage path to the directory
+        holding cached environments, shared by the Generator, Logger and
+        Simulator.
+
+    Returns:
+      A MovieLens simulation environment.
+    """
+    if not environment_cache_dir:
+      return movielens_py_environment.MovieLensPyEnvironment(
+          raw_data_path,
+          rank_k,
+          batch_size,
+          num_movies=num_actions,
+          csv_delimiter="\t")
+
+    cache_dir = get_environment_cache_dir(environment_cache_dir, raw_data_path,
+                                          rank_k, num_actions)
+    u_hat_path = os.path.join(cache_dir, "u_hat.npy")
+    v_hat_path = os.path.join(cache_dir, "v_hat.npy")
+    if tf.io.gfile.exists(u_hat_path) and tf.io.gfile.exists(v_hat_path):
+      return CachedMovieLensPyEnvironment(
+          u_hat=load_array(u_hat_path),
+          v_hat=load_array(v_hat_path),
+          rank_k=rank_k,
+          batch_size=batch_size)
+
+    env = movielens_py_environment.MovieLensPyEnvironment(
+        raw_data_path,
+        rank_k,
+        batch_size,
+        num_movies=num_actions,
+        csv_delimiter="\t")
+    tf.io.gfile.makedirs(cache_dir)
+    save_array(v_hat_path, env._v_hat)  # pylint: disable=protected-access
+    save_array(u_hat_path, env._u_hat)  # pylint: disable=protected-access
+    return env
 
   def generate_simulation_data(
       raw_data_path: str,
@@ -102,13 +308,13 @@ def generate_movielens_dataset_for_bigquery(
     Returns:
       A replay buffer holding randomly generated`trajectories.Trajectory` data.
     """
-    # Create MovieLens simulation environment.
-    env = movielens_py_environment.MovieLensPyEnvironment(
-        raw_data_path,
-        rank_k,
-        batch_size,
-        num_movies=num_actions,
-        csv_delimiter="\t")
+    # Load MovieLens simulation environment.
+    env = load_movielens_environment(
+        raw_data_path=raw_data_path,
+        rank_k=rank_k,
+        batch_size=batch_size,
+        num_actions=num_actions,
+        environment_cache_dir=environment_cache_dir)
     environment = tf_py_environment.TFPyEnvironment(env)
 
     # Define random policy for collecting data.
@@ -132,69 +338,281 @@ def generate_movielens_dataset_for_bigquery(
 
     return replay_buffer
 
-  def build_dict_from_trajectory(
-      trajectory: trajectories.Trajectory) -> Dict[str, Any]:
-    """Builds a dict from `trajectory` data.
+  def generate_simulation_data_in_parallel(
+      raw_data_path: str,
+      batch_size: int,
+      rank_k: int,
+      num_actions: int,
+      driver_steps: int,
+      num_workers: int) -> trajectories.Trajectory:
+    """Generates `trajectories.Trajectory` data in parallel worker processes.
+
+    Constructs a MovieLens simulation environment, and forks `num_workers`
+    processes that each apply a random policy to their copy of it, with their
+    own seed. The workers step the Python environment and policy directly, so
+    that no TensorFlow runtime is used after forking.
+
+    Args:
+      raw_data_path: Path to MovieLens 100K's "u.data" file.
+      batch_size: Batch size of environment generated quantities eg. rewards.
+      rank_k: Rank for matrix factorization in the MovieLens environment; also
+        the observation dimension.
+      num_actions: Number of actions (movie items) to choose from.
+      driver_steps: Number of steps to run per batch, across all workers.
+      num_workers: Number of worker processes.
+
+    Returns:
+      A `trajectories.Trajectory` object whose arrays have the shape
+      [driver_steps, batch_size, ...], holding the steps of each worker in
+      turn.
+    """
+    # Load MovieLens simulation environment, which workers inherit on fork.
+    env = load_movielens_environment(
+        raw_data_path=raw_data_path,
+        rank_k=rank_k,
+        batch_size=batch_size,
+        num_actions=num_actions,
+        environment_cache_dir=environment_cache_dir)
+
+    def run_worker(worker_driver_steps: int, seed: int,
+                   connection: Any) -> None:
+      """Runs the simulation for `worker_driver_steps` and sends the result."""
+      try:
+        # The environment samples users with the global random generators.
+        random.seed(seed)
+        np.random.seed(seed)
+        random_policy = random_py_policy.RandomPyPolicy(
+            time_step_spec=env.time_step_spec(),
+            action_spec=env.action_spec(),
+            seed=seed)
+
+        # Reset before every step, as `tf_py_environment.TFPyEnvironment` does
+        # after each LAST time step of the bandit environment.
+        steps = []
+        for _ in range(worker_driver_steps):
+          time_step = env.reset()
+          action_step = random_policy.action(time_step)
+          next_time_step = env.step(action_step.action)
+          steps.append(
+              trajectories.trajectory.from_transition(
+                  time_step, action_step, next_time_step))
+
+        connection.send(
+            tf.nest.map_structure(lambda *values: np.stack(values), *steps))
+      except Exception as e:  # pylint: disable=broad-except
+        connection.send(e)
+      finally:
+        connection.close()
+
+    context = multiprocessing.get_context("fork")
+    seeds = np.random.SeedSequence().generate_state(num_workers).tolist()
+    workers = []
+    for worker_index in range(num_workers):
+      # Spread the steps evenly, the first workers taking any remainder.
+      worker_driver_steps = (driver_steps // num_workers +
+                             int(worker_index < driver_steps % num_workers))
+      receiver, sender = context.Pipe(duplex=False)
+      process = context.Process(
+          target=run_worker, args=(worker_driver_steps, seeds[worker_index],
+                                   sender))
+      process.start()
+      sender.close()
+      workers.append((process, receiver))
+
+    # Receive before joining, as workers block until their results are read.
+    worker_trajectories = []
+    for process, receiver in workers:
+      result = receiver.recv()
+      process.join()
+      if isinstance(result, Exception):
+        raise result
+      worker_trajectories.append(result)
+
+    return tf.nest.map_structure(lambda *values: np.concatenate(values),
+                                 *worker_trajectories)
+
+  def gather_replay_buffer(
+      replay_buffer: replay_buffers.TFUniformReplayBuffer
+  ) -> trajectories.Trajectory:
+    """Gathers all `trajectories.Trajectory` data in `replay_buffer` at once.
+
+    Every frame in the replay buffer is gathered exactly once, in the order it
+    was added, as NumPy arrays.
+
+    Args:
+      replay_buffer: A `replay_buffers.TFUniformReplayBuffer` holding
+        `trajectories.Trajectory` objects.
+
+    Returns:
+      A `trajectories.Trajectory` object whose arrays have the shape
+      [driver_steps, batch_size, ...], i.e. one example per driver step holding
+      the frames of the whole environment batch.
+    """
+    trajectory = replay_buffer.gather_all()
+
+    def to_step_major(tensor: tf.Tensor) -> np.ndarray:
+      # The replay buffer stores [batch_size, driver_steps, ...].
+      return np.swapaxes(tensor.numpy(), 0, 1)
+
+    return tf.nest.map_structure(to_step_major, trajectory)
+
+  def slice_trajectory(
+      trajectory: trajectories.Trajectory,
+      start: int,
+      end: int) -> trajectories.Trajectory:
+    """Slices the examples [`start`, `end`) out of `trajectory`."""
+    return tf.nest.map_structure(lambda values: values[start:end], trajectory)
+
+  def build_dicts_from_trajectory(
+      trajectory: trajectories.Trajectory) -> List[Dict[str, Any]]:
+    """Builds a dict per example from `trajectory` data.
 
     Args:
-      trajectory: A `trajectories.Trajectory` object.
+      trajectory: A `trajectories.Trajectory` object whose arrays have the shape
+        [num_examples, batch_size, ...].
 
     Returns:
-      A dict holding the same data as `trajectory`.
+      A list of dicts, each holding the same data as one example of
+      `trajectory`.
     """
-    trajectory_dict = {
-        "step_type": trajectory.step_type.numpy().tolist(),
+    columns = {
+        "step_type": trajectory.step_type.tolist(),
+        "observation": trajectory.observation.tolist(),
+        "action": trajectory.action.tolist(),
+        "next_step_type": trajectory.next_step_type.tolist(),
+        "reward": trajectory.reward.tolist(),
+        "discount": trajectory.discount.tolist(),
+    }
+    return [{
+        "step_type": columns["step_type"][index],
         "observation": [{
             "observation_batch": batch
-        } for batch in trajectory.observation.numpy().tolist()],
-        "action": trajectory.action.numpy().tolist(),
+        } for batch in columns["observation"][index]],
+        "action": columns["action"][index],
         "policy_info": trajectory.policy_info,
-        "next_step_type": trajectory.next_step_type.numpy().tolist(),
-        "reward": trajectory.reward.numpy().tolist(),
-        "discount": trajectory.discount.numpy().tolist(),
-    }
-    return trajectory_dict
+        "next_step_type": columns["next_step_type"][index],
+        "reward": columns["reward"][index],
+        "discount": columns["discount"][index],
+    } for index in range(len(columns["step_type"]))]
 
-  def write_replay_buffer_to_file(
-      replay_buffer: replay_buffers.TFUniformReplayBuffer,
-      batch_size: int,
+  def build_list_array(values: np.ndarray, value_type: pa.DataType) -> pa.Array:
+    """Builds an Arrow list array from the rows of `values`.
+
+    Args:
+      values: An array of shape [num_rows, list_length].
+      value_type: Arrow type of the list elements.
+
+    Returns:
+      An Arrow array with a list of `list_length` elements per row.
+    """
+    num_rows, list_length = values.shape
+    offsets = np.arange(num_rows + 1, dtype=np.int32) * list_length
+    return pa.ListArray.from_arrays(
+        offsets, pa.array(values.reshape(-1), type=value_type))
+
+  def build_record_batch_from_trajectory(
+      trajectory: trajectories.Trajectory) -> pa.RecordBatch:
+    """Builds an Arrow record batch from `trajectory` data.
+
+    The record batch has the same nested schema as the JSON rows built by
+    `build_dicts_from_trajectory`, with one row per example.
+
+    Args:
+      trajectory: A `trajectories.Trajectory` object whose arrays have the shape
+        [num_examples, batch_size, ...].
+
+    Returns:
+      An Arrow record batch holding the same data as `trajectory`.
+    """
+    observation = trajectory.observation
+    num_examples, batch_size, observation_dim = observation.shape
+
+    observation_batches = build_list_array(
+        observation.reshape(num_examples * batch_size, observation_dim),
+        pa.float64())
+    observations = pa.ListArray.from_arrays(
+        np.arange(num_examples + 1, dtype=np.int32) * batch_size,
+        pa.StructArray.from_arrays([observation_batches],
+                                   names=["observation_batch"]))
+
+    # `policy_info` is empty for the random policy, as in the JSON rows.
+    policy_info = pa.ListArray.from_arrays(
+        np.zeros(num_examples + 1, dtype=np.int32), pa.array([], pa.float64()))
+
+    return pa.RecordBatch.from_arrays([
+        build_list_array(trajectory.step_type, pa.int64()),
+        observations,
+        build_list_array(trajectory.action, pa.int64()),
+        policy_info,
+        build_list_array(trajectory.next_step_type, pa.int64()),
+        build_list_array(trajectory.reward, pa.float64()),
+        build_list_array(trajectory.discount, pa.float64()),
+    ], schema=parquet_schema)
+
+  def write_trajectory_to_file(
+      trajectory: trajectories.Trajectory,
       dataset_file: str) -> None:
-    """Writes replay buffer data to a file, each JSON in one line.
+    """Writes trajectory data to a file, each JSON in one line.
 
-    Each `trajectories.Trajectory` object in `replay_buffer` will be written as
-    one line to the `dataset_file` in JSON format. I.e., the `dataset_file`
-    would be a newline-delimited JSON file.
+    Each driver step in `trajectory` will be written as one line to the
+    `dataset_file` in JSON format. I.e., the `dataset_file` would be a
+    newline-delimited JSON file. Steps are converted from arrays to Python
+    lists `write_chunk_size` at a time.
 
     Args:
-      replay_buffer: A `replay_buffers.TFUniformReplayBuffer` holding
-        `trajectories.Trajectory` objects.
-      batch_size: Batch size of environment generated quantities eg. rewards.
+      trajectory: A `trajectories.Trajectory` object whose arrays have the shape
+        [driver_steps, batch_size, ...].
       dataset_file: File path. Will be overwritten if already exists.
     """
-    dataset = replay_buffer.as_dataset(sample_batch_size=batch_size)
-    dataset_size = replay_buffer.num_frames().numpy()
+    num_examples = trajectory.step_type.shape[0]
 
     with open(dataset_file, "w") as f:
-      for example in dataset.take(count=dataset_size):
-        traj_dict = build_dict_from_trajectory(example[0])
-        f.write(json.dumps(traj_dict) + "\n")
+      for start in range(0, num_examples, write_chunk_size):
+        traj_dicts = build_dicts_from_trajectory(
+            slice_trajectory(trajectory, start, start + write_chunk_size))
+        f.write("".join(
+            json.dumps(traj_dict) + "\n" for traj_dict in traj_dicts))
+
+  def write_trajectory_to_parquet_file(
+      trajectory: trajectories.Trajectory,
+      dataset_file: str) -> None:
+    """Writes trajectory data to a Parquet file.
+
+    Holds the same rows as `write_trajectory_to_file`, with each chunk of
+    `write_chunk_size` steps converted from arrays to Arrow arrays as one row
+    group.
+
+    Args:
+      trajectory: A `trajectories.Trajectory` object whose arrays have the shape
+        [driver_steps, batch_size, ...].
+      dataset_file: File path. Will be overwritten if already exists.
+    """
+    num_examples = trajectory.step_type.shape[0]
+
+    with pq.ParquetWriter(dataset_file, parquet_schema) as writer:
+      for start in range(0, num_examples, write_chunk_size):
+        record_batch = build_record_batch_from_trajectory(
+            slice_trajectory(trajectory, start, start + write_chunk_size))
+        writer.write_table(pa.Table.from_batches([record_batch]))
 
   def load_dataset_into_bigquery(
       project_id: str,
       dataset_file: str,
+      dataset_file_format: str,
       bigquery_dataset_id: str,
       bigquery_location: str,
       bigquery_table_id: str) -> None:
     """Loads training dataset into BigQuery table.
 
     Loads training dataset of `trajectories.Trajectory` in newline delimited
-    JSON into a BigQuery dataset and table, using a BigQuery client.
+    JSON or Parquet into a BigQuery dataset and table, using a BigQuery client.
 
     Args:
       project_id: GCP project ID. This is required because otherwise the
         BigQuery client will use the ID of the tenant GCP project created as a
         result of KFP, which doesn't have proper access to BigQuery.
-      dataset_file: Path to a JSON file containing the training dataset.
+      dataset_file: Path to a file containing the training dataset.
+      dataset_file_format: Format of `dataset_file`, "json" or "parquet".
       bigquery_dataset_id: A string of the BigQuery dataset ID in the format of
         "project.dataset".
       bigquery_location: A string of the BigQuery dataset location.
@@ -232,6 +650,12 @@ def generate_movielens_dataset_for_bigquery(
         ],
         source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
     )
+    if dataset_file_format == "parquet":
+      job_config.source_format = bigquery.SourceFormat.PARQUET
+      # Load Parquet lists as REPEATED fields rather than nested records.
+      parquet_options = bigquery.ParquetOptions()
+      parquet_options.enable_list_inference = True
+      job_config.parquet_options = parquet_options
 
     with open(dataset_file, "rb") as source_file:
       load_job = client.load_table_from_file(
@@ -239,19 +663,44 @@ def generate_movielens_dataset_for_bigquery(
 
     load_job.result()  # Wait for the job to complete.
 
-  replay_buffer = generate_simulation_data(
-      raw_data_path=raw_data_path,
-      batch_size=batch_size,
-      rank_k=rank_k,
-      num_actions=num_actions,
-      driver_steps=driver_steps)
-
-  write_replay_buffer_to_file(
-      replay_buffer=replay_buffer,
-      batch_size=batch_size,
-      dataset_file=bigquery_tmp_file)
-
-  load_dataset_into_bigquery(project_id, bigquery_tmp_file, bigquery_dataset_id,
+  if bigquery_tmp_file_format not in ("json", "parquet"):
+    raise ValueError(
+        "`bigquery_tmp_file_format` must be \"json\" or \"parquet\", got: "
+        f"{bigquery_tmp_file_format}")
+
+  if not isinstance(num_simulation_workers, int) or num_simulation_workers < 1:
+    raise ValueError(
+        "`num_simulation_workers` must be a positive integer, got: "
+        f"{num_simulation_workers}")
+
+  # Invalid `driver_steps` are left for the TensorFlow driver to reject.
+  if (num_simulation_workers > 1 and isinstance(driver_steps, int) and
+      driver_steps > 0):
+    trajectory = generate_simulation_data_in_parallel(
+        raw_data_path=raw_data_path,
+        batch_size=batch_size,
+        rank_k=rank_k,
+        num_actions=num_actions,
+        driver_steps=driver_steps,
+        num_workers=min(num_simulation_workers, driver_steps))
+  else:
+    replay_buffer = generate_simulation_data(
+        raw_data_path=raw_data_path,
+        batch_size=batch_size,
+        rank_k=rank_k,
+        num_actions=num_actions,
+        driver_steps=driver_steps)
+    trajectory = gather_replay_buffer(replay_buffer)
+
+  if bigquery_tmp_file_format == "parquet":
+    write_trajectory_to_parquet_file(
+        trajectory=trajectory, dataset_file=bigquery_tmp_file)
+  else:
+    write_trajectory_to_file(
+        trajectory=trajectory, dataset_file=bigquery_tmp_file)
+
+  load_dataset_into_bigquery(project_id, bigquery_tmp_file,
+                             bigquery_tmp_file_format, bigquery_dataset_id,
                              bigquery_location, bigquery_table_id)
 
   outputs = collections.namedtuple(
@@ -269,7 +718,8 @@ if __name__ == "__main__":
     base_image="tensorflow/tensorflow:2.5.0",
     output_component_file="component.yaml",
     packages_to_install=[
-      "google-cloud-bigquery==2.20.0",
+      "google-cloud-bigquery==2.26.0",
+      "pyarrow==4.0.1",
       "tensorflow==2.5.0",
       "tf-agents==0.8.0",
     ],
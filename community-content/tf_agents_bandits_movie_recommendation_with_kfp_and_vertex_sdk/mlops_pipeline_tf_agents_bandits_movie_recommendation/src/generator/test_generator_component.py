@@ -14,10 +14,14 @@
 
 """The unit testing module for the Generator component."""
 import os
+import shutil
 import tempfile
 import unittest
 from unittest import mock
 
+from google.cloud import bigquery
+import numpy as np
+import pyarrow.parquet as pq
 from src.generator import generator_component
 import tensorflow as tf
 from tf_agents.bandits.environments import movielens_py_environment
@@ -204,6 +208,92 @@ class TestGeneratorComponent(unittest.TestCase):
       newline_count = sum(1 for trajectory_json in f)
     self.assertEqual(newline_count, self.mock_json_dumps.call_count)
 
+  def test_write_each_driver_step_once(self):
+    """Tests the component writes one Trajectory JSON per driver step."""
+    generator_component.generate_movielens_dataset_for_bigquery(
+        project_id=PROJECT_ID,
+        raw_data_path=RAW_DATA_PATH,
+        batch_size=BATCH_SIZE,
+        rank_k=RANK_K,
+        num_actions=NUM_ACTIONS,
+        driver_steps=DRIVER_STEPS,
+        bigquery_tmp_file=self.bigquery_tmp_file,
+        bigquery_dataset_id=BIGQUERY_DATASET_ID,
+        bigquery_location=BIGQUERY_LOCATION,
+        bigquery_table_id=BIGQUERY_TABLE_ID)
+
+    self.assertEqual(self.mock_json_dumps.call_count, DRIVER_STEPS)
+    traj_dict = self.mock_json_dumps.call_args_list[0][0][0]
+    self.assertEqual(len(traj_dict["step_type"]), BATCH_SIZE)
+    self.assertEqual(len(traj_dict["observation"]), BATCH_SIZE)
+
+  def test_parallel_simulation_merge_worker_trajectories(self):
+    """Tests the component merges the driver steps of parallel workers."""
+    generator_component.generate_movielens_dataset_for_bigquery(
+        project_id=PROJECT_ID,
+        raw_data_path=RAW_DATA_PATH,
+        batch_size=BATCH_SIZE,
+        rank_k=RANK_K,
+        num_actions=NUM_ACTIONS,
+        driver_steps=DRIVER_STEPS,
+        bigquery_tmp_file=self.bigquery_tmp_file,
+        bigquery_dataset_id=BIGQUERY_DATASET_ID,
+        bigquery_location=BIGQUERY_LOCATION,
+        bigquery_table_id=BIGQUERY_TABLE_ID,
+        num_simulation_workers=DRIVER_STEPS)
+
+    self.mock_env.MovieLensPyEnvironment.assert_called_once()
+    self.assertEqual(self.mock_json_dumps.call_count, DRIVER_STEPS)
+
+    # Each worker samples its own users, with its own seed.
+    traj_dicts = [args[0] for args, _ in self.mock_json_dumps.call_args_list]
+    self.assertEqual(len(traj_dicts[0]["observation"]), BATCH_SIZE)
+    self.assertNotEqual(traj_dicts[0]["observation"],
+                        traj_dicts[1]["observation"])
+
+  def test_given_zero_simulation_workers_generate_raise_exception(self):
+    """Tests the component raises an exception given zero simulation workers.
+    """
+    with self.assertRaises(ValueError):
+      generator_component.generate_movielens_dataset_for_bigquery(
+          project_id=PROJECT_ID,
+          raw_data_path=RAW_DATA_PATH,
+          batch_size=BATCH_SIZE,
+          rank_k=RANK_K,
+          num_actions=NUM_ACTIONS,
+          driver_steps=DRIVER_STEPS,
+          bigquery_tmp_file=self.bigquery_tmp_file,
+          bigquery_dataset_id=BIGQUERY_DATASET_ID,
+          bigquery_location=BIGQUERY_LOCATION,
+          bigquery_table_id=BIGQUERY_TABLE_ID,
+          num_simulation_workers=0)
+
+  def test_given_environment_cache_dir_save_factorization(self):
+    """Tests the component saves the environment's factorization to the cache.
+    """
+    environment_cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, environment_cache_dir)
+
+    generator_component.generate_movielens_dataset_for_bigquery(
+        project_id=PROJECT_ID,
+        raw_data_path=RAW_DATA_PATH,
+        batch_size=BATCH_SIZE,
+        rank_k=RANK_K,
+        num_actions=NUM_ACTIONS,
+        driver_steps=DRIVER_STEPS,
+        bigquery_tmp_file=self.bigquery_tmp_file,
+        bigquery_dataset_id=BIGQUERY_DATASET_ID,
+        bigquery_location=BIGQUERY_LOCATION,
+        bigquery_table_id=BIGQUERY_TABLE_ID,
+        environment_cache_dir=environment_cache_dir)
+
+    [cache_dir] = os.listdir(environment_cache_dir)
+    u_hat = np.load(os.path.join(environment_cache_dir, cache_dir, "u_hat.npy"))
+    np.testing.assert_allclose(u_hat, self.env._u_hat)
+    self.assertTrue(
+        os.path.exists(
+            os.path.join(environment_cache_dir, cache_dir, "v_hat.npy")))
+
   def test_query_dataset_with_num_trajectory_elements(self):
     """Tests the component queries with a schema with `NUM_TRAJECTORY_ELEMENTS`.
     """
@@ -222,6 +312,68 @@ class TestGeneratorComponent(unittest.TestCase):
     _, kwargs = self.mock_load_job_config.call_args
     self.assertEqual(len(kwargs["schema"]), NUM_TRAJECTORY_ELEMENTS)
 
+  def test_parquet_format_write_row_per_driver_step(self):
+    """Tests the component writes one Parquet row per driver step."""
+    generator_component.generate_movielens_dataset_for_bigquery(
+        project_id=PROJECT_ID,
+        raw_data_path=RAW_DATA_PATH,
+        batch_size=BATCH_SIZE,
+        rank_k=RANK_K,
+        num_actions=NUM_ACTIONS,
+        driver_steps=DRIVER_STEPS,
+        bigquery_tmp_file=self.bigquery_tmp_file,
+        bigquery_dataset_id=BIGQUERY_DATASET_ID,
+        bigquery_location=BIGQUERY_LOCATION,
+        bigquery_table_id=BIGQUERY_TABLE_ID,
+        bigquery_tmp_file_format="parquet")
+
+    self.mock_json_dumps.assert_not_called()
+
+    table = pq.read_table(self.bigquery_tmp_file)
+    self.assertEqual(len(table.schema), NUM_TRAJECTORY_ELEMENTS)
+    self.assertEqual(table.num_rows, DRIVER_STEPS)
+
+    row = table.slice(0, 1).to_pylist()[0]
+    self.assertEqual(len(row["step_type"]), BATCH_SIZE)
+    self.assertEqual(len(row["observation"]), BATCH_SIZE)
+    self.assertEqual(len(row["observation"][0]["observation_batch"]), RANK_K)
+    self.assertEqual(row["policy_info"], [])
+
+  def test_parquet_format_load_dataset_as_parquet(self):
+    """Tests the component loads Parquet into BigQuery with list inference."""
+    generator_component.generate_movielens_dataset_for_bigquery(
+        project_id=PROJECT_ID,
+        raw_data_path=RAW_DATA_PATH,
+        batch_size=BATCH_SIZE,
+        rank_k=RANK_K,
+        num_actions=NUM_ACTIONS,
+        driver_steps=DRIVER_STEPS,
+        bigquery_tmp_file=self.bigquery_tmp_file,
+        bigquery_dataset_id=BIGQUERY_DATASET_ID,
+        bigquery_location=BIGQUERY_LOCATION,
+        bigquery_table_id=BIGQUERY_TABLE_ID,
+        bigquery_tmp_file_format="parquet")
+
+    job_config = self.mock_load_job_config.return_value
+    self.assertEqual(job_config.source_format, bigquery.SourceFormat.PARQUET)
+    self.assertTrue(job_config.parquet_options.enable_list_inference)
+
+  def test_given_unknown_format_generate_raise_exception(self):
+    """Tests the component raises an exception for an unknown file format."""
+    with self.assertRaises(ValueError):
+      generator_component.generate_movielens_dataset_for_bigquery(
+          project_id=PROJECT_ID,
+          raw_data_path=RAW_DATA_PATH,
+          batch_size=BATCH_SIZE,
+          rank_k=RANK_K,
+          num_actions=NUM_ACTIONS,
+          driver_steps=DRIVER_STEPS,
+          bigquery_tmp_file=self.bigquery_tmp_file,
+          bigquery_dataset_id=BIGQUERY_DATASET_ID,
+          bigquery_location=BIGQUERY_LOCATION,
+          bigquery_table_id=BIGQUERY_TABLE_ID,
+          bigquery_tmp_file_format="csv")
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,98 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the cold start of the MovieLens environment with its cache.
+
+Measures the time the Logger, Generator and Simulator take to get a MovieLens
+simulation environment: built from the data file, built and saved to an empty
+cache, and loaded from the cache.
+
+Example:
+  python3 -m src.logger.benchmark_environment_cache \
+    --raw_data_path=u.data --environment_cache_dir=/tmp/environment-cache
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from src.logger import main
+import tensorflow as tf
+
+
+def time_calls(function: Callable[[], None], num_runs: int) -> List[float]:
+  """Times `num_runs` calls of `function`.
+
+  Args:
+    function: Function to call.
+    num_runs: Number of times to call `function`.
+
+  Returns:
+    The duration of each call in milliseconds.
+  """
+  durations = []
+  for _ in range(num_runs):
+    start = time.perf_counter()
+    function()
+    durations.append((time.perf_counter() - start) * 1000)
+  return durations
+
+
+def run_benchmark() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--raw_data_path", type=str, required=True,
+      help="Path to MovieLens 100K's \"u.data\" file.")
+  parser.add_argument(
+      "--environment_cache_dir", type=str, required=True,
+      help="Path to a directory for the cache. Its contents are deleted.")
+  parser.add_argument("--rank_k", type=int, default=20)
+  parser.add_argument("--batch_size", type=int, default=8)
+  parser.add_argument("--num_actions", type=int, default=20)
+  parser.add_argument("--num_runs", type=int, default=5)
+  args = parser.parse_args()
+
+  def load_environment(environment_cache_dir: str) -> None:
+    main.load_movielens_environment(
+        raw_data_path=args.raw_data_path,
+        rank_k=args.rank_k,
+        batch_size=args.batch_size,
+        num_actions=args.num_actions,
+        environment_cache_dir=environment_cache_dir)
+
+  def clear_cache() -> None:
+    if tf.io.gfile.exists(args.environment_cache_dir):
+      tf.io.gfile.rmtree(args.environment_cache_dir)
+
+  def build_and_save_environment() -> None:
+    clear_cache()
+    load_environment(args.environment_cache_dir)
+
+  results = {
+      "without cache": time_calls(lambda: load_environment(None),
+                                  args.num_runs),
+      "cache miss": time_calls(build_and_save_environment, args.num_runs),
+      "cache hit": time_calls(lambda: load_environment(
+          args.environment_cache_dir), args.num_runs),
+  }
+  clear_cache()
+
+  print(f"{'mode':<16}{'median (ms)':>14}{'max (ms)':>14}")
+  for mode, durations in results.items():
+    print(f"{mode:<16}{statistics.median(durations):>14.1f}"
+          f"{max(durations):>14.1f}")
+
+
+if __name__ == "__main__":
+  run_benchmark()
@@ -13,18 +13,33 @@
 # limitations under the License.
 
 """The Logger component for logging prediction inputs and results."""
+import atexit
 import base64
+import collections
 import dataclasses
+import functools
+import hashlib
+import io
 import json
+import logging
 import os
 import tempfile
-from typing import Any, Dict, List
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import uuid
 
 from google.cloud import bigquery
+import numpy as np
 import tensorflow as tf
 from tf_agents import trajectories
+from tf_agents.bandits.environments import bandit_py_environment
 from tf_agents.bandits.environments import movielens_py_environment
 from tf_agents.environments import tf_py_environment
+from tf_agents.specs import array_spec
+from tf_agents.trajectories import time_step as ts
+
+BIGQUERY_SINK_LOAD = "load"
+BIGQUERY_SINK_STREAMING = "streaming"
 
 
 @dataclasses.dataclass
@@ -45,6 +60,15 @@ class EnvVars:
     bigquery_location: A string of the BigQuery dataset region.
     bigquery_table_id: A string of the BigQuery table ID as
       `project_id.dataset_id.table_id`.
+    environment_cache_dir: A string of the path to the directory holding
+      cached MovieLens environments, or None to not use the cache.
+    bigquery_sink: A string of how trajectory data is appended to BigQuery:
+      "load" to run a load job per invocation, or "streaming" to buffer rows
+      across invocations and stream them in.
+    streaming_max_buffered_rows: An integer of the number of buffered rows
+      that triggers a flush of the streaming sink.
+    streaming_flush_interval_secs: A float of the longest time in seconds that
+      a row stays in the buffer of the streaming sink.
   """
   project_id: str
   raw_data_path: str
@@ -55,6 +79,10 @@ class EnvVars:
   bigquery_dataset_id: str
   bigquery_location: str
   bigquery_table_id: str
+  environment_cache_dir: Optional[str]
+  bigquery_sink: str
+  streaming_max_buffered_rows: int
+  streaming_flush_interval_secs: float
 
 
 def get_env_vars() -> EnvVars:
@@ -72,96 +100,302 @@ def get_env_vars() -> EnvVars:
       bigquery_tmp_file=os.getenv("BIGQUERY_TMP_FILE"),
       bigquery_dataset_id=os.getenv("BIGQUERY_DATASET_ID"),
       bigquery_location=os.getenv("BIGQUERY_LOCATION"),
-      bigquery_table_id=os.getenv("BIGQUERY_TABLE_ID"))
+      bigquery_table_id=os.getenv("BIGQUERY_TABLE_ID"),
+      environment_cache_dir=os.getenv("ENVIRONMENT_CACHE_DIR"),
+      bigquery_sink=os.getenv("BIGQUERY_SINK") or BIGQUERY_SINK_LOAD,
+      streaming_max_buffered_rows=int(
+          os.getenv("STREAMING_MAX_BUFFERED_ROWS") or 500),
+      streaming_flush_interval_secs=float(
+          os.getenv("STREAMING_FLUSH_INTERVAL_SECS") or 5))
+
 
+class CachedMovieLensPyEnvironment(
+    movielens_py_environment.MovieLensPyEnvironment):
+  """A MovieLens environment built from cached matrix factorization results.
+
+  Behaves as `movielens_py_environment.MovieLensPyEnvironment`, without loading
+  the data file or computing the matrix factorization.
+  """
 
-def replace_observation_in_time_step(
-    original_time_step: trajectories.TimeStep,
-    observation: tf.Tensor) -> trajectories.TimeStep:
-  """Returns a `trajectories.TimeStep` with the observation field replaced.
+  def __init__(self,
+               u_hat: np.ndarray,
+               v_hat: np.ndarray,
+               rank_k: int,
+               batch_size: int):  # pylint: disable=super-init-not-called
+    """Initializes the environment from the user and movie factor matrices.
+
+    Args:
+      u_hat: User factor matrix, of shape [num_users, rank].
+      v_hat: Movie factor matrix, of shape [rank, num_movies].
+      rank_k: Rank for matrix factorization in the MovieLens environment; also
+        the observation dimension.
+      batch_size: Batch size of environment generated quantities eg. rewards.
+    """
+    self._num_actions = v_hat.shape[1]
+    self._batch_size = batch_size
+    self._context_dim = rank_k
+    self._effective_num_users = u_hat.shape[0]
+    self._u_hat = u_hat
+    self._v_hat = v_hat
+    self._approx_ratings_matrix = np.matmul(u_hat, v_hat)
+
+    self._current_users = np.zeros(batch_size)
+    self._previous_users = np.zeros(batch_size)
+
+    self._action_spec = array_spec.BoundedArraySpec(
+        shape=(),
+        dtype=np.int32,
+        minimum=0,
+        maximum=self._num_actions - 1,
+        name="action")
+    observation_spec = array_spec.ArraySpec(
+        shape=(self._context_dim,), dtype=np.float64, name="observation")
+    self._time_step_spec = ts.time_step_spec(observation_spec)
+    self._observation = np.zeros((self._batch_size, self._context_dim))
+
+    self._optimal_action_table = np.argmax(
+        self._approx_ratings_matrix, axis=1)
+    self._optimal_reward_table = np.max(
+        self._approx_ratings_matrix, axis=1)
+
+    bandit_py_environment.BanditPyEnvironment.__init__(
+        self, observation_spec, self._action_spec, name="movielens")
+
+
+def get_environment_cache_dir(
+    environment_cache_dir: str,
+    raw_data_path: str,
+    rank_k: int,
+    num_actions: int) -> str:
+  """Gets the directory of the cached environment for the given parameters.
+
+  The cache is keyed by a fingerprint of the data file, made of its path, size
+  and modification time, so that looking up the cache doesn't read the file.
 
   Args:
-    original_time_step: The original `trajectories.TimeStep` in which the
-      `observation` will be filled in.
-    observation: A single, batched observation.
+    environment_cache_dir: Path to the directory holding cached environments.
+    raw_data_path: Path to MovieLens 100K's "u.data" file.
+    rank_k: Rank for matrix factorization in the MovieLens environment.
+    num_actions: Number of actions (movie items) to choose from.
 
   Returns:
-    A `trajectories.TimeStep` with `observation` filled into
-    `original_time_step`.
+    Path to the directory of the cached environment.
   """
-  return trajectories.TimeStep(
-      step_type=original_time_step[0],
-      reward=original_time_step[1],
-      discount=original_time_step[2],
-      observation=observation)
+  stat = tf.io.gfile.stat(raw_data_path)
+  key = (f"{raw_data_path}:{stat.length}:{stat.mtime_nsec}:{rank_k}:"
+         f"{num_actions}")
+  key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+  return os.path.join(environment_cache_dir, f"movielens-{key_hash}")
 
 
-def get_trajectory_from_environment(
-    environment: tf_py_environment.TFPyEnvironment,
-    observation: List[List[float]],
-    predicted_action: int) -> trajectories.Trajectory:
-  """Gets trajectory data from `environment` based on observation and action.
+def save_array(path: str, array: np.ndarray) -> None:
+  """Saves `array` as a .npy file, which is replaced atomically.
 
-  Aligns `environment` observation to `observation` so that its feedback align
-  with `observation`. The `trajectories.Trajectory` object contains time step
-  information before and after applying `predicted_action` and feedback in the
-  form of a reward.
+  Args:
+    path: Local or Cloud Storage path of the file.
+    array: Array to save.
+  """
+  buffer = io.BytesIO()
+  np.save(buffer, array)
+  tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+  with tf.io.gfile.GFile(tmp_path, "wb") as f:
+    f.write(buffer.getvalue())
+  tf.io.gfile.rename(tmp_path, path, overwrite=True)
 
-  In production, this function can be replaced to actually pull feedback from
-  some real-world environment.
+
+def load_array(path: str) -> np.ndarray:
+  """Loads an array from a .npy file, memory-mapping local files.
 
   Args:
-    environment: A TF-Agents environment that holds observations, apply actions
-      and returns rewards.
-    observation: A single, batched observation.
-    predicted_action: A predicted action corresponding to the observation.
+    path: Local or Cloud Storage path of the file.
+
+  Returns:
+    The array in the file.
+  """
+  if "://" not in path:
+    return np.load(path, mmap_mode="r")
+  with tf.io.gfile.GFile(path, "rb") as f:
+    return np.load(io.BytesIO(f.read()))
+
+
+def load_movielens_environment(
+    raw_data_path: str,
+    rank_k: int,
+    batch_size: int,
+    num_actions: int,
+    environment_cache_dir: Optional[str]
+) -> movielens_py_environment.MovieLensPyEnvironment:
+  """Loads the MovieLens simulation environment, from the cache if possible.
+
+  Without a cache directory, the environment is built from the data file. With
+  one, the user and movie factor matrices are loaded from the cache, or saved to
+  it after building the environment the first time.
+
+  Args:
+    raw_data_path: Path to MovieLens 100K's "u.data" file.
+    rank_k: Rank for matrix factorization in the MovieLens environment; also
+      the observation dimension.
+    batch_size: Batch size of environment generated quantities eg. rewards.
+    num_actions: Number of actions (movie items) to choose from.
+    environment_cache_dir: Local or Cloud Storage path to the directory holding
+      cached environments, shared by the Generator, Logger and Simulator.
 
   Returns:
-    A dict holding the same data as `trajectory`.
+    A MovieLens simulation environment.
   """
-  environment.reset()
+  if not environment_cache_dir:
+    return movielens_py_environment.MovieLensPyEnvironment(
+        raw_data_path,
+        rank_k,
+        batch_size,
+        num_movies=num_actions,
+        csv_delimiter="\t")
+
+  cache_dir = get_environment_cache_dir(environment_cache_dir, raw_data_path,
+                                        rank_k, num_actions)
+  u_hat_path = os.path.join(cache_dir, "u_hat.npy")
+  v_hat_path = os.path.join(cache_dir, "v_hat.npy")
+  if tf.io.gfile.exists(u_hat_path) and tf.io.gfile.exists(v_hat_path):
+    return CachedMovieLensPyEnvironment(
+        u_hat=load_array(u_hat_path),
+        v_hat=load_array(v_hat_path),
+        rank_k=rank_k,
+        batch_size=batch_size)
 
-  # Align environment to observation.
-  original_time_step = environment.current_time_step()
-  time_step = replace_observation_in_time_step(original_time_step, observation)
-  environment._time_step = time_step  # pylint: disable=protected-access
+  env = movielens_py_environment.MovieLensPyEnvironment(
+      raw_data_path,
+      rank_k,
+      batch_size,
+      num_movies=num_actions,
+      csv_delimiter="\t")
+  tf.io.gfile.makedirs(cache_dir)
+  save_array(v_hat_path, env._v_hat)  # pylint: disable=protected-access
+  save_array(u_hat_path, env._u_hat)  # pylint: disable=protected-access
+  return env
 
-  # Apply predicted action to environment.
-  environment.step(action=predicted_action)
 
-  # Get next time step.
-  next_time_step = environment.current_time_step()
+def get_trajectories_from_environment(
+    environment: tf_py_environment.TFPyEnvironment,
+    observations: np.ndarray,
+    predicted_actions: np.ndarray) -> trajectories.Trajectory:
+  """Gets trajectory data from `environment` for a batch of observations.
+
+  Computes the feedback for every (observation, predicted action) pair at once,
+  instead of stepping `environment` once per observation. In the MovieLens
+  environment an observation is a user's row of the user factor matrix, so the
+  reward of recommending a movie is the dot product of the observation and the
+  movie's column of the movie factor matrix, i.e. the observed user's
+  approximate rating of the movie. `environment` is only read, not stepped.
+
+  Note: this intentionally changes the rewards of logged trajectories. Before,
+  the Logger reset `environment` for every observation, which sampled new
+  users, so rewards were ratings of users other than the observed ones.
+  Consumers of the trajectory data shouldn't compare rewards logged before and
+  after this change.
 
-  # Get trajectory as an encapsulation of all feedback from the environment.
-  trajectory = trajectories.from_transition(
-      time_step=time_step,
-      action_step=trajectories.PolicyStep(action=predicted_action),
-      next_time_step=next_time_step)
-  return trajectory
+  In production, this function can be replaced to actually pull feedback from
+  some real-world environment.
 
+  Args:
+    environment: A TF-Agents MovieLens environment holding the movie factor
+      matrix.
+    observations: Observations of shape [num_observations, batch_size, rank_k].
+    predicted_actions: Predicted actions corresponding to the observations, of
+      shape [num_observations, batch_size].
 
-def build_dict_from_trajectory(
-    trajectory: trajectories.Trajectory) -> Dict[str, Any]:
-  """Builds a dict from `trajectory` data.
+  Returns:
+    A `trajectories.Trajectory` object whose arrays have the shape
+    [num_observations, batch_size, ...].
+  """
+  v_hat = environment.pyenv._v_hat  # pylint: disable=protected-access
+  # `v_hat[:, predicted_actions]` has the shape [rank_k, num_observations,
+  # batch_size].
+  rewards = np.einsum("nbk,knb->nb", observations,
+                      v_hat[:, predicted_actions])
+
+  return trajectories.Trajectory(
+      step_type=np.full(
+          predicted_actions.shape, trajectories.StepType.FIRST,
+          dtype=np.int32),
+      observation=observations,
+      action=predicted_actions,
+      policy_info=(),
+      next_step_type=np.full(
+          predicted_actions.shape, trajectories.StepType.LAST,
+          dtype=np.int32),
+      reward=rewards.astype(np.float32),
+      discount=np.zeros(predicted_actions.shape, dtype=np.float32))
+
+
+def build_dicts_from_trajectory(
+    trajectory: trajectories.Trajectory) -> List[Dict[str, Any]]:
+  """Builds a dict per observation from `trajectory` data.
 
   Args:
-    trajectory: A `trajectories.Trajectory` object.
+    trajectory: A `trajectories.Trajectory` object whose arrays have the shape
+      [num_observations, batch_size, ...].
 
   Returns:
-    A dict holding the same data as `trajectory`.
+    A list of dicts, each holding the same data as one observation of
+    `trajectory`.
   """
-  trajectory_dict = {
-      "step_type": trajectory.step_type.numpy().tolist(),
+  columns = {
+      "step_type": trajectory.step_type.tolist(),
+      "observation": trajectory.observation.tolist(),
+      "action": trajectory.action.tolist(),
+      "next_step_type": trajectory.next_step_type.tolist(),
+      "reward": trajectory.reward.tolist(),
+      "discount": trajectory.discount.tolist(),
+  }
+  return [{
+      "step_type": columns["step_type"][index],
       "observation": [{
           "observation_batch": batch
-      } for batch in trajectory.observation.numpy().tolist()],
-      "action": trajectory.action.numpy().tolist(),
+      } for batch in columns["observation"][index]],
+      "action": columns["action"][index],
       "policy_info": trajectory.policy_info,
-      "next_step_type": trajectory.next_step_type.numpy().tolist(),
-      "reward": trajectory.reward.numpy().tolist(),
-      "discount": trajectory.discount.numpy().tolist(),
-  }
-  return trajectory_dict
+      "next_step_type": columns["next_step_type"][index],
+      "reward": columns["reward"][index],
+      "discount": columns["discount"][index],
+  } for index in range(len(columns["step_type"]))]
+
+
+def build_trajectory_rows(
+    environment: tf_py_environment.TFPyEnvironment,
+    observations: List[Dict[str, List[List[float]]]],
+    predicted_actions: List[Dict[str, List[float]]]) -> List[Dict[str, Any]]:
+  """Builds trajectory data rows for observations and predicted actions.
+
+  Args:
+    environment: A TF-Agents environment that holds observations, apply actions
+      and returns rewards.
+    observations: List of `{"observation": <observation>}` in the prediction
+      request.
+    predicted_actions: List of `{"predicted_action": <predicted_action>}`
+      corresponding to the observations.
+
+  Returns:
+    A list of dicts, each holding the trajectory data of one observation.
+  """
+  # A message can aggregate prediction requests of different batch sizes, so
+  # observations are processed as one batch per batch size.
+  indices_by_batch_size = collections.defaultdict(list)
+  for index, observation in enumerate(observations):
+    indices_by_batch_size[len(observation["observation"])].append(index)
+
+  rows = [None] * len(observations)
+  for indices in indices_by_batch_size.values():
+    trajectory = get_trajectories_from_environment(
+        environment=environment,
+        observations=np.array(
+            [observations[index]["observation"] for index in indices],
+            dtype=np.float32),
+        predicted_actions=np.array([
+            predicted_actions[index]["predicted_action"] for index in indices
+        ], dtype=np.int32))
+    for index, row in zip(indices, build_dicts_from_trajectory(trajectory)):
+      rows[index] = row
+  return rows
 
 
 def write_trajectories_to_file(
@@ -171,9 +405,9 @@ def write_trajectories_to_file(
     predicted_actions: List[Dict[str, List[float]]]) -> None:
   """Writes trajectory data to a file, each JSON in one line.
 
-  Gets `trajectories.Trajectory` objects that encapsulate environment
-  feedback eg. rewards based on `observations` and `predicted_actions`.
-  Each `trajectories.Trajectory` object gets written as one line to
+  Gets `trajectories.Trajectory` data that encapsulate environment feedback eg.
+  rewards based on `observations` and `predicted_actions`, for all of them at
+  once. The data of each observation gets written as one line to
   `dataset_file` in JSON format. I.e., the `dataset_file` would be a
   newline-delimited JSON file.
 
@@ -187,36 +421,53 @@ def write_trajectories_to_file(
       corresponding to the observations.
   """
   with open(dataset_file, "w") as f:
-    for observation, predicted_action in zip(observations, predicted_actions):
-      trajectory = get_trajectory_from_environment(
-          environment=environment,
-          observation=tf.constant(observation["observation"]),
-          predicted_action=tf.constant(predicted_action["predicted_action"]))
-      trajectory_dict = build_dict_from_trajectory(trajectory)
+    for trajectory_dict in build_trajectory_rows(
+        environment=environment,
+        observations=observations,
+        predicted_actions=predicted_actions):
       f.write(json.dumps(trajectory_dict) + "\n")
 
 
-def append_dataset_to_bigquery(
+def get_trajectory_schema() -> List[bigquery.SchemaField]:
+  """Gets the BigQuery schema of trajectory data.
+
+  Returns:
+    A list of `bigquery.SchemaField` matching `build_dicts_from_trajectory`.
+  """
+  return [
+      bigquery.SchemaField("step_type", "INT64", mode="REPEATED"),
+      bigquery.SchemaField(
+          "observation",
+          "RECORD",
+          mode="REPEATED",
+          fields=[
+              bigquery.SchemaField("observation_batch", "FLOAT64",
+                                   "REPEATED")
+          ]),
+      bigquery.SchemaField("action", "INT64", mode="REPEATED"),
+      bigquery.SchemaField("policy_info", "FLOAT64", mode="REPEATED"),
+      bigquery.SchemaField("next_step_type", "INT64", mode="REPEATED"),
+      bigquery.SchemaField("reward", "FLOAT64", mode="REPEATED"),
+      bigquery.SchemaField("discount", "FLOAT64", mode="REPEATED"),
+  ]
+
+
+def create_bigquery_client(
     project_id: str,
-    dataset_file: str,
     bigquery_dataset_id: str,
-    bigquery_location: str,
-    bigquery_table_id: str) -> None:
-  """Appends training dataset to BigQuery table.
-
-  Appends training dataset of `trajectories.Trajectory` in newline delimited
-  JSON to a BigQuery dataset and table, using a BigQuery client.
+    bigquery_location: str) -> bigquery.Client:
+  """Creates a BigQuery client, and the BigQuery dataset if it doesn't exist.
 
   Args:
     project_id: GCP project ID. This is required because otherwise the
       BigQuery client will use the ID of the tenant GCP project created as a
       result of KFP, which doesn't have proper access to BigQuery.
-    dataset_file: Path to a JSON file containing the training dataset.
     bigquery_dataset_id: A string of the BigQuery dataset ID in the format of
       "project.dataset".
     bigquery_location: A string of the BigQuery dataset location.
-    bigquery_table_id: A string of the BigQuery table ID in the format of
-      "project.dataset.table".
+
+  Returns:
+    A BigQuery client for `project_id`.
   """
   # Construct a BigQuery client object.
   client = bigquery.Client(project=project_id)
@@ -228,26 +479,43 @@ def append_dataset_to_bigquery(
   dataset.location = bigquery_location
 
   # Create the dataset, or get the dataset if it exists.
-  dataset = client.create_dataset(dataset, exists_ok=True, timeout=30)
+  client.create_dataset(dataset, exists_ok=True, timeout=30)
+
+  return client
+
+
+def append_dataset_to_bigquery(
+    project_id: str,
+    dataset_file: str,
+    bigquery_dataset_id: str,
+    bigquery_location: str,
+    bigquery_table_id: str,
+    client: Optional[bigquery.Client] = None) -> None:
+  """Appends training dataset to BigQuery table.
+
+  Appends training dataset of `trajectories.Trajectory` in newline delimited
+  JSON to a BigQuery dataset and table, using a BigQuery client.
+
+  Args:
+    project_id: GCP project ID. This is required because otherwise the
+      BigQuery client will use the ID of the tenant GCP project created as a
+      result of KFP, which doesn't have proper access to BigQuery.
+    dataset_file: Path to a JSON file containing the training dataset.
+    bigquery_dataset_id: A string of the BigQuery dataset ID in the format of
+      "project.dataset".
+    bigquery_location: A string of the BigQuery dataset location.
+    bigquery_table_id: A string of the BigQuery table ID in the format of
+      "project.dataset.table".
+    client: A BigQuery client from `create_bigquery_client`, for which the
+      dataset already exists. A new client is created if not given.
+  """
+  if client is None:
+    client = create_bigquery_client(project_id, bigquery_dataset_id,
+                                    bigquery_location)
 
   job_config = bigquery.LoadJobConfig(
       write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-      schema=[
-          bigquery.SchemaField("step_type", "INT64", mode="REPEATED"),
-          bigquery.SchemaField(
-              "observation",
-              "RECORD",
-              mode="REPEATED",
-              fields=[
-                  bigquery.SchemaField("observation_batch", "FLOAT64",
-                                       "REPEATED")
-              ]),
-          bigquery.SchemaField("action", "INT64", mode="REPEATED"),
-          bigquery.SchemaField("policy_info", "FLOAT64", mode="REPEATED"),
-          bigquery.SchemaField("next_step_type", "INT64", mode="REPEATED"),
-          bigquery.SchemaField("reward", "FLOAT64", mode="REPEATED"),
-          bigquery.SchemaField("discount", "FLOAT64", mode="REPEATED"),
-      ],
+      schema=get_trajectory_schema(),
       source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
   )
 
@@ -258,11 +526,294 @@ def append_dataset_to_bigquery(
   load_job.result()  # Wait for the job to complete.
 
 
+class StreamingSink:
+  """Streams trajectory data rows into a BigQuery table in batches.
+
+  Rows appended by consecutive invocations are held in a bounded buffer and
+  written with one streaming insert per batch, instead of one load job per
+  invocation. The buffer is flushed as soon as it holds `max_buffered_rows`
+  rows, and otherwise by a timer `flush_interval_secs` after its first row was
+  appended.
+
+  Rows that fail to be written are put back in the buffer, and retried by the
+  next flush. Up to `max_retained_rows` rows are kept, and the oldest ones
+  beyond that are dropped, so that a long BigQuery outage can't exhaust the
+  instance's memory.
+
+  Rows still buffered when the instance shuts down are flushed at exit. Rows
+  of an instance that is killed before then are lost, which is the price of
+  batching across invocations.
+  """
+
+  def __init__(
+      self,
+      write_rows: Callable[[List[Dict[str, Any]]], Sequence[Any]],
+      max_buffered_rows: int,
+      flush_interval_secs: float,
+      max_rows_per_request: int = 500,
+      max_retained_rows: Optional[int] = None) -> None:
+    """Initializes the streaming sink.
+
+    Args:
+      write_rows: Function that streams a list of rows into the table, and
+        returns a list of errors, eg. `insert_rows_json` of a BigQuery client
+        with the table ID bound.
+      max_buffered_rows: Number of buffered rows that triggers a flush.
+      flush_interval_secs: Longest time in seconds that a row stays buffered.
+      max_rows_per_request: Maximum number of rows per call of `write_rows`.
+      max_retained_rows: Maximum number of rows kept in the buffer after a
+        failed write. Defaults to 10 times `max_buffered_rows`.
+
+    Raises:
+      ValueError: if `max_buffered_rows` or `max_rows_per_request` is less
+        than 1.
+    """
+    if max_buffered_rows < 1 or max_rows_per_request < 1:
+      raise ValueError(
+          "`max_buffered_rows` and `max_rows_per_request` must be at least 1.")
+    self._write_rows = write_rows
+    self._max_buffered_rows = max_buffered_rows
+    self._flush_interval_secs = flush_interval_secs
+    self._max_rows_per_request = max_rows_per_request
+    self._max_retained_rows = max_retained_rows or 10 * max_buffered_rows
+    self._rows = []
+    self._lock = threading.Lock()
+    self._timer = None
+
+  def append(self, rows: List[Dict[str, Any]]) -> None:
+    """Appends rows to the buffer, flushing it if it is full.
+
+    A failure of the flush triggered by these rows is logged, and the rows are
+    kept in the buffer to be retried.
+
+    Args:
+      rows: Trajectory data rows, eg. from `build_trajectory_rows`.
+    """
+    with self._lock:
+      self._rows.extend(rows)
+      if len(self._rows) >= self._max_buffered_rows:
+        rows_to_write = self._take_rows()
+      else:
+        rows_to_write = []
+        self._start_timer()
+    try:
+      self._write(rows_to_write)
+    except RuntimeError:
+      logging.exception("Failed to flush the streaming sink.")
+
+  def flush(self) -> None:
+    """Writes all buffered rows to the table.
+
+    Rows that fail to be written are kept in the buffer to be retried.
+
+    Raises:
+      RuntimeError: if writing any row fails.
+    """
+    with self._lock:
+      rows_to_write = self._take_rows()
+    self._write(rows_to_write)
+
+  def _take_rows(self) -> List[Dict[str, Any]]:
+    """Empties the buffer and stops the flush timer; needs `_lock` held."""
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    rows, self._rows = self._rows, []
+    return rows
+
+  def _start_timer(self) -> None:
+    """Starts the flush timer for buffered rows; needs `_lock` held."""
+    if self._rows and self._timer is None:
+      self._timer = threading.Timer(self._flush_interval_secs,
+                                    self._flush_on_timer)
+      self._timer.daemon = True
+      self._timer.start()
+
+  def _write(self, rows: List[Dict[str, Any]]) -> None:
+    """Writes rows to the table in requests of bounded size.
+
+    Rows that fail to be written are put back in the buffer.
+
+    Raises:
+      RuntimeError: if writing any row fails.
+    """
+    failed_rows = []
+    errors = []
+    for start in range(0, len(rows), self._max_rows_per_request):
+      request_rows = rows[start:start + self._max_rows_per_request]
+      try:
+        row_errors = self._write_rows(request_rows)
+      except Exception as e:  # pylint: disable=broad-except
+        # Neither this request nor the following ones wrote their rows.
+        failed_rows.extend(rows[start:])
+        errors.append(e)
+        break
+      # BigQuery reports errors by the index of the row in the request.
+      failed_rows.extend(
+          request_rows[row_error["index"]] for row_error in row_errors)
+      errors.extend(row_errors)
+    if errors:
+      self._retain(failed_rows)
+      raise RuntimeError(f"Failed to stream rows into BigQuery: {errors}")
+
+  def _retain(self, rows: List[Dict[str, Any]]) -> None:
+    """Puts rows that failed to be written back in front of the buffer."""
+    with self._lock:
+      self._rows = rows + self._rows
+      num_dropped_rows = len(self._rows) - self._max_retained_rows
+      if num_dropped_rows > 0:
+        self._rows = self._rows[num_dropped_rows:]
+        logging.error(
+            "Dropped %d rows of the streaming sink after failed writes.",
+            num_dropped_rows)
+      self._start_timer()
+
+  def _flush_on_timer(self) -> None:
+    try:
+      self.flush()
+    except Exception:  # pylint: disable=broad-except
+      logging.exception("Failed to flush the streaming sink on its timer.")
+
+
+def create_streaming_sink(
+    client: bigquery.Client,
+    bigquery_table_id: str,
+    max_buffered_rows: int,
+    flush_interval_secs: float) -> StreamingSink:
+  """Creates a streaming sink into a BigQuery table, creating the table too.
+
+  Args:
+    client: A BigQuery client, for which the BigQuery dataset exists.
+    bigquery_table_id: A string of the BigQuery table ID in the format of
+      "project.dataset.table".
+    max_buffered_rows: Number of buffered rows that triggers a flush.
+    flush_interval_secs: Longest time in seconds that a row stays buffered.
+
+  Returns:
+    A `StreamingSink` into `bigquery_table_id`.
+  """
+  # Streaming inserts need the table to exist already.
+  table = bigquery.Table(bigquery_table_id, schema=get_trajectory_schema())
+  client.create_table(table, exists_ok=True)
+
+  return StreamingSink(
+      write_rows=functools.partial(client.insert_rows_json, bigquery_table_id),
+      max_buffered_rows=max_buffered_rows,
+      flush_interval_secs=flush_interval_secs)
+
+
+@dataclasses.dataclass
+class WarmState:
+  """State reused across invocations of a warm Cloud Functions instance.
+
+  Attributes:
+    env_vars: The environment variables that the state was built with.
+    environment: The MovieLens simulation environment.
+    client: A BigQuery client, for which the BigQuery dataset exists.
+    sink: A streaming sink into the BigQuery table, or None if trajectory data
+      is appended with load jobs.
+  """
+  env_vars: EnvVars
+  environment: tf_py_environment.TFPyEnvironment
+  client: bigquery.Client
+  sink: Optional[StreamingSink] = None
+
+
+_warm_state: Optional[WarmState] = None
+_warm_state_lock = threading.Lock()
+
+
+def get_warm_state(env_vars: EnvVars) -> WarmState:
+  """Gets the warm state of this instance, building it if needed.
+
+  The state is built on the first invocation, and rebuilt whenever the
+  environment variables differ from the ones it was built with.
+
+  Args:
+    env_vars: The environment variables of the current invocation.
+
+  Returns:
+    A `WarmState` built with `env_vars`.
+
+  Raises:
+    ValueError: if `env_vars.bigquery_sink` is not a known sink.
+  """
+  global _warm_state
+  if env_vars.bigquery_sink not in (BIGQUERY_SINK_LOAD,
+                                    BIGQUERY_SINK_STREAMING):
+    raise ValueError(
+        f"`bigquery_sink` must be \"{BIGQUERY_SINK_LOAD}\" or "
+        f"\"{BIGQUERY_SINK_STREAMING}\", got \"{env_vars.bigquery_sink}\".")
+
+  with _warm_state_lock:
+    if _warm_state is None or _warm_state.env_vars != env_vars:
+      close_warm_state_sink()
+
+      # Load MovieLens simulation environment.
+      env = load_movielens_environment(
+          raw_data_path=env_vars.raw_data_path,
+          rank_k=env_vars.rank_k,
+          batch_size=env_vars.batch_size,
+          num_actions=env_vars.num_actions,
+          environment_cache_dir=env_vars.environment_cache_dir)
+
+      client = create_bigquery_client(
+          project_id=env_vars.project_id,
+          bigquery_dataset_id=env_vars.bigquery_dataset_id,
+          bigquery_location=env_vars.bigquery_location)
+
+      sink = None
+      if env_vars.bigquery_sink == BIGQUERY_SINK_STREAMING:
+        sink = create_streaming_sink(
+            client=client,
+            bigquery_table_id=env_vars.bigquery_table_id,
+            max_buffered_rows=env_vars.streaming_max_buffered_rows,
+            flush_interval_secs=env_vars.streaming_flush_interval_secs)
+
+      _warm_state = WarmState(
+          env_vars=env_vars,
+          environment=tf_py_environment.TFPyEnvironment(env),
+          client=client,
+          sink=sink)
+    return _warm_state
+
+
+def close_warm_state_sink() -> None:
+  """Flushes the streaming sink of the warm state, if there is one.
+
+  A failed flush is logged rather than raised, so that the warm state can still
+  be rebuilt or dropped.
+  """
+  if _warm_state is not None and _warm_state.sink is not None:
+    try:
+      _warm_state.sink.flush()
+    except RuntimeError:
+      logging.exception("Failed to flush the streaming sink on closing it.")
+
+
+def reset_warm_state() -> None:
+  """Drops the warm state, so that the next invocation builds it again.
+
+  Rows buffered by the streaming sink are flushed first.
+  """
+  global _warm_state
+  with _warm_state_lock:
+    close_warm_state_sink()
+    _warm_state = None
+
+
+# Flush rows buffered by the streaming sink when the instance shuts down.
+atexit.register(reset_warm_state)
+
+
 def log_prediction_to_bigquery(event: Dict[str, Any], context) -> None:  # pylint: disable=unused-argument
   """Logs prediction inputs and results to BigQuery.
 
   Queries the MovieLens simulation environment for rewards and other info based
   on observations and predicted actions, and logs trajectory data to BigQuery.
+  With the "load" sink, the data of each invocation is appended by a load job;
+  with the "streaming" sink, it is buffered across invocations and streamed
+  into the table in batches.
 
   Serves as the Logger and the entrypoint of Cloud Functions. The Logger closes
   the feedback loop from prediction results to training data, and allows
@@ -289,19 +840,22 @@ def log_prediction_to_bigquery(event: Dict[str, Any], context) -> None:  # pylin
   observations = data["observations"]
   predicted_actions = data["predicted_actions"]
 
-  # Create MovieLens simulation environment.
-  env = movielens_py_environment.MovieLensPyEnvironment(
-      env_vars.raw_data_path,
-      env_vars.rank_k,
-      env_vars.batch_size,
-      num_movies=env_vars.num_actions,
-      csv_delimiter="\t")
-  environment = tf_py_environment.TFPyEnvironment(env)
+  # Reuse the environment and BigQuery client of previous invocations.
+  warm_state = get_warm_state(env_vars)
+
+  if warm_state.sink is not None:
+    # Get environment feedback, and buffer trajectory data for streaming.
+    rows = build_trajectory_rows(
+        environment=warm_state.environment,
+        observations=observations,
+        predicted_actions=predicted_actions)
+    warm_state.sink.append(rows)
+    return
 
   # Get environment feedback and write trajectory data.
   write_trajectories_to_file(
       dataset_file=dataset_file,
-      environment=environment,
+      environment=warm_state.environment,
       observations=observations,
       predicted_actions=predicted_actions)
 
@@ -311,4 +865,5 @@ def log_prediction_to_bigquery(event: Dict[str, Any], context) -> None:  # pylin
       dataset_file=dataset_file,
       bigquery_dataset_id=env_vars.bigquery_dataset_id,
       bigquery_location=env_vars.bigquery_location,
-      bigquery_table_id=env_vars.bigquery_table_id)
+      bigquery_table_id=env_vars.bigquery_table_id,
+      client=warm_state.client)
@@ -16,7 +16,10 @@
 import base64
 import json
 import os
+import random
+import shutil
 import tempfile
+import threading
 import unittest
 from unittest import mock
 
@@ -24,6 +27,7 @@ from google.cloud import bigquery
 
 import numpy as np
 from src.logger import main
+from tf_agents.environments import tf_py_environment
 
 
 # Paths and configurations
@@ -57,6 +61,10 @@ ENV_VARS = {
     "BIGQUERY_DATASET_ID": BIGQUERY_DATASET_ID,
     "BIGQUERY_LOCATION": BIGQUERY_LOCATION,
     "BIGQUERY_TABLE_ID": BIGQUERY_TABLE_ID,
+    "ENVIRONMENT_CACHE_DIR": "",
+    "BIGQUERY_SINK": "load",
+    "STREAMING_MAX_BUFFERED_ROWS": "500",
+    "STREAMING_FLUSH_INTERVAL_SECS": "5",
 }
 
 OBSERVATION = np.zeros((int(BATCH_SIZE), int(RANK_K))).tolist()
@@ -100,6 +108,8 @@ class TestLogger(unittest.TestCase):
 
   def setUp(self):
     super().setUp()
+    main.reset_warm_state()
+    self.addCleanup(main.reset_warm_state)
 
     self.mock_os_getenv = mock.patch("os.getenv").start()
 
@@ -164,7 +174,8 @@ class TestLogger(unittest.TestCase):
         dataset_file=DATASET_FILE,
         bigquery_dataset_id=BIGQUERY_DATASET_ID,
         bigquery_location=BIGQUERY_LOCATION,
-        bigquery_table_id=BIGQUERY_TABLE_ID)
+        bigquery_table_id=BIGQUERY_TABLE_ID,
+        client=self.mock_client.return_value)
 
     patcher_write_trajectories.stop()
     patcher_append_dataset.stop()
@@ -190,6 +201,117 @@ class TestLogger(unittest.TestCase):
     patcher_write_trajectories.stop()
     patcher_append_dataset.stop()
 
+  def test_given_streaming_sink_log_stream_rows_across_invocations(self):
+    """Tests `log` buffers rows across invocations with the streaming sink."""
+    env_vars = dict(ENV_VARS)
+    env_vars["BIGQUERY_SINK"] = "streaming"
+    env_vars["STREAMING_MAX_BUFFERED_ROWS"] = str(2 * NUM_OBSERVATIONS)
+    self.mock_os_getenv.side_effect = build_side_effect_function(env_vars)
+    rows = [{"reward": [float(index)]} for index in range(NUM_OBSERVATIONS)]
+    mock_build_rows = mock.patch(
+        "src.logger.main.build_trajectory_rows").start()
+    mock_build_rows.return_value = rows
+    mock_append_dataset = mock.patch(
+        "src.logger.main.append_dataset_to_bigquery").start()
+    mock_insert_rows = self.mock_client.return_value.insert_rows_json
+    mock_insert_rows.return_value = []
+
+    main.log_prediction_to_bigquery(EVENT, None)
+    mock_insert_rows.assert_not_called()
+    main.log_prediction_to_bigquery(EVENT, None)
+
+    # The second invocation fills the buffer, which is flushed at once.
+    mock_insert_rows.assert_called_once_with(BIGQUERY_TABLE_ID, rows + rows)
+    self.mock_client.return_value.create_table.assert_called_once()
+    mock_build_rows.assert_called_with(
+        environment=self.mock_env,
+        observations=OBSERVATIONS,
+        predicted_actions=PREDICTED_ACTIONS)
+    mock_append_dataset.assert_not_called()
+
+  def test_given_unknown_sink_log_raise_exception(self):
+    """Tests `log` raises an exception for an unknown BigQuery sink."""
+    env_vars = dict(ENV_VARS)
+    env_vars["BIGQUERY_SINK"] = "unknown"
+    self.mock_os_getenv.side_effect = build_side_effect_function(env_vars)
+
+    with self.assertRaises(ValueError):
+      main.log_prediction_to_bigquery(EVENT, None)
+
+  def test_log_reuse_warm_state_across_invocations(self):
+    """Tests `log` builds the environment and BigQuery client only once."""
+    self.mock_os_getenv.side_effect = build_side_effect_function(ENV_VARS)
+    patcher_write_trajectories = mock.patch(
+        "src.logger.main.write_trajectories_to_file")
+    mock_write_trajectories = patcher_write_trajectories.start()
+    patcher_append_dataset = mock.patch(
+        "src.logger.main.append_dataset_to_bigquery")
+    mock_append_dataset = patcher_append_dataset.start()
+
+    main.log_prediction_to_bigquery(EVENT, None)
+    main.log_prediction_to_bigquery(EVENT, None)
+
+    self.mock_movielens_env.assert_called_once()
+    self.mock_client.assert_called_once_with(project=PROJECT_ID)
+    self.mock_client.return_value.create_dataset.assert_called_once()
+    self.assertEqual(mock_write_trajectories.call_count, 2)
+    self.assertEqual(mock_append_dataset.call_count, 2)
+    for _, kwargs in mock_append_dataset.call_args_list:
+      self.assertIs(kwargs["client"], self.mock_client.return_value)
+
+    patcher_write_trajectories.stop()
+    patcher_append_dataset.stop()
+
+  def test_log_rebuild_warm_state_after_env_vars_change(self):
+    """Tests `log` rebuilds the warm state when environment variables change."""
+    env_vars = ENV_VARS.copy()
+    self.mock_os_getenv.side_effect = build_side_effect_function(env_vars)
+    patcher_write_trajectories = mock.patch(
+        "src.logger.main.write_trajectories_to_file")
+    patcher_write_trajectories.start()
+    patcher_append_dataset = mock.patch(
+        "src.logger.main.append_dataset_to_bigquery")
+    patcher_append_dataset.start()
+
+    main.log_prediction_to_bigquery(EVENT, None)
+    env_vars["RANK_K"] = "10"
+    main.log_prediction_to_bigquery(EVENT, None)
+
+    self.assertEqual(self.mock_movielens_env.call_count, 2)
+    self.mock_movielens_env.assert_called_with(
+        RAW_DATA_PATH,
+        10,
+        int(BATCH_SIZE),
+        num_movies=int(NUM_ACTIONS),
+        csv_delimiter="\t")
+    self.assertEqual(self.mock_client.call_count, 2)
+
+    patcher_write_trajectories.stop()
+    patcher_append_dataset.stop()
+
+  def test_given_failed_sink_flush_log_rebuild_warm_state(self):
+    """Tests `log` rebuilds the warm state even if flushing its sink fails."""
+    env_vars = dict(ENV_VARS)
+    env_vars["BIGQUERY_SINK"] = "streaming"
+    self.mock_os_getenv.side_effect = build_side_effect_function(env_vars)
+    mock_build_rows = mock.patch(
+        "src.logger.main.build_trajectory_rows").start()
+    mock_build_rows.return_value = [{"reward": [0.0]}]
+    mock_insert_rows = self.mock_client.return_value.insert_rows_json
+    mock_insert_rows.return_value = [{"index": 0, "errors": ["invalid"]}]
+
+    main.log_prediction_to_bigquery(EVENT, None)
+    env_vars["RANK_K"] = "10"
+    with self.assertLogs(level="ERROR"):
+      main.log_prediction_to_bigquery(EVENT, None)
+
+    self.assertEqual(self.mock_movielens_env.call_count, 2)
+
+    # Flushing at shutdown fails the same way, and still drops the warm state.
+    with self.assertLogs(level="ERROR"):
+      main.reset_warm_state()
+    self.assertIsNone(main._warm_state)
+
   def test_given_float_batch_size_log_raise_exception(self):
     """Tests given a float as `BATCH_SIZE` `log` raises an exception."""
     env_vars = ENV_VARS.copy()
@@ -249,12 +371,12 @@ class TestLogger(unittest.TestCase):
 
   def test_write_trajectories_to_file_correctly_unpacks_number_of_data(self):
     """Tests the Logger correctly unpacks observations and prediction actions."""
-    patcher_get_trajectory = mock.patch(
-        "src.logger.main.get_trajectory_from_environment")
-    mock_get_trajectory = patcher_get_trajectory.start()
-    patcher_build_dict = mock.patch(
-        "src.logger.main.build_dict_from_trajectory")
-    mock_build_dict = patcher_build_dict.start()
+    patcher_get_trajectories = mock.patch(
+        "src.logger.main.get_trajectories_from_environment")
+    mock_get_trajectories = patcher_get_trajectories.start()
+    patcher_build_dicts = mock.patch(
+        "src.logger.main.build_dicts_from_trajectory")
+    mock_build_dicts = patcher_build_dicts.start()
 
     main.write_trajectories_to_file(
         dataset_file=self.bigquery_tmp_file,
@@ -262,20 +384,28 @@ class TestLogger(unittest.TestCase):
         observations=OBSERVATIONS,
         predicted_actions=PREDICTED_ACTIONS)
 
-    self.assertEqual(mock_get_trajectory.call_count, NUM_OBSERVATIONS)
-    self.assertEqual(mock_build_dict.call_count, NUM_OBSERVATIONS)
+    # All observations are processed in one batched call.
+    mock_get_trajectories.assert_called_once()
+    kwargs = mock_get_trajectories.call_args[1]
+    self.assertEqual(kwargs["observations"].shape,
+                     (NUM_OBSERVATIONS, int(BATCH_SIZE), int(RANK_K)))
+    self.assertEqual(kwargs["predicted_actions"].shape,
+                     (NUM_OBSERVATIONS, int(BATCH_SIZE)))
+    mock_build_dicts.assert_called_once_with(
+        mock_get_trajectories.return_value)
 
-    patcher_get_trajectory.stop()
-    patcher_build_dict.stop()
+    patcher_get_trajectories.stop()
+    patcher_build_dicts.stop()
 
   def test_write_trajectories_to_file_write_newline_per_json_dump(self):
     """Tests the Logger writes a newline after each Trajectory JSON."""
-    patcher_get_trajectory = mock.patch(
-        "src.logger.main.get_trajectory_from_environment")
-    patcher_get_trajectory.start()
-    patcher_build_dict = mock.patch(
-        "src.logger.main.build_dict_from_trajectory")
-    patcher_build_dict.start()
+    patcher_get_trajectories = mock.patch(
+        "src.logger.main.get_trajectories_from_environment")
+    patcher_get_trajectories.start()
+    patcher_build_dicts = mock.patch(
+        "src.logger.main.build_dicts_from_trajectory")
+    mock_build_dicts = patcher_build_dicts.start()
+    mock_build_dicts.return_value = [{} for _ in range(NUM_OBSERVATIONS)]
 
     main.write_trajectories_to_file(
         dataset_file=self.bigquery_tmp_file,
@@ -285,10 +415,11 @@ class TestLogger(unittest.TestCase):
 
     with open(self.bigquery_tmp_file, "r") as f:
       newline_count = sum(1 for trajectory_json in f)
+    self.assertEqual(newline_count, NUM_OBSERVATIONS)
     self.assertEqual(newline_count, self.mock_json_dumps.call_count)
 
-    patcher_get_trajectory.stop()
-    patcher_build_dict.stop()
+    patcher_get_trajectories.stop()
+    patcher_build_dicts.stop()
 
   def test_append_to_dataset_to_bigquery_fetch_correct_data(self):
     """Tests `append_dataset_to_bigquery` fetches the correct data."""
@@ -330,5 +461,236 @@ class TestLogger(unittest.TestCase):
     self.assertEqual(len(kwargs["schema"]), NUM_TRAJECTORY_ELEMENTS)
 
 
+class FakeBigQueryWriter:
+  """A local fake of streaming inserts into a BigQuery table."""
+
+  def __init__(self, errors=None, num_failed_requests=0):
+    self.requests = []
+    self.errors = errors or []
+    self.num_failed_requests = num_failed_requests
+    self.written = threading.Event()
+
+  def __call__(self, rows):
+    self.requests.append(list(rows))
+    if len(self.requests) <= self.num_failed_requests:
+      raise ConnectionError("BigQuery is unavailable.")
+    self.written.set()
+    return self.errors
+
+
+class TestStreamingSink(unittest.TestCase):
+  """Test class for the streaming sink of the Logger."""
+
+  def test_flush_when_buffer_is_full(self):
+    """Tests the sink writes rows once the buffer is full, in bounded requests.
+    """
+    writer = FakeBigQueryWriter()
+    sink = main.StreamingSink(
+        write_rows=writer,
+        max_buffered_rows=5,
+        flush_interval_secs=60,
+        max_rows_per_request=2)
+
+    sink.append([{"row": 0}, {"row": 1}])
+    self.assertEqual(writer.requests, [])
+    sink.append([{"row": 2}, {"row": 3}, {"row": 4}])
+
+    self.assertEqual(writer.requests, [
+        [{"row": 0}, {"row": 1}],
+        [{"row": 2}, {"row": 3}],
+        [{"row": 4}],
+    ])
+
+  def test_flush_on_timer(self):
+    """Tests the sink writes buffered rows after the flush interval."""
+    writer = FakeBigQueryWriter()
+    sink = main.StreamingSink(
+        write_rows=writer, max_buffered_rows=100, flush_interval_secs=0.01)
+
+    sink.append([{"row": 0}])
+
+    self.assertTrue(writer.written.wait(timeout=10))
+    self.assertEqual(writer.requests, [[{"row": 0}]])
+
+  def test_flush_write_nothing_for_empty_buffer(self):
+    """Tests flushing an empty buffer doesn't write to the table."""
+    writer = FakeBigQueryWriter()
+    sink = main.StreamingSink(
+        write_rows=writer, max_buffered_rows=100, flush_interval_secs=60)
+
+    sink.append([{"row": 0}])
+    sink.flush()
+    sink.flush()
+
+    self.assertEqual(writer.requests, [[{"row": 0}]])
+
+  def test_given_insert_errors_flush_raise_exception(self):
+    """Tests the sink raises an exception for errors reported by BigQuery."""
+    writer = FakeBigQueryWriter(errors=[{"index": 0, "errors": ["invalid"]}])
+    sink = main.StreamingSink(
+        write_rows=writer, max_buffered_rows=100, flush_interval_secs=60)
+
+    sink.append([{"row": 0}])
+
+    with self.assertRaises(RuntimeError):
+      sink.flush()
+
+  def test_given_failed_request_keep_rows_for_next_flush(self):
+    """Tests rows of a failed request are written by the next flush."""
+    writer = FakeBigQueryWriter(num_failed_requests=1)
+    sink = main.StreamingSink(
+        write_rows=writer, max_buffered_rows=100, flush_interval_secs=60)
+
+    sink.append([{"row": 0}, {"row": 1}])
+    with self.assertRaises(RuntimeError):
+      sink.flush()
+    sink.append([{"row": 2}])
+    sink.flush()
+
+    self.assertEqual(writer.requests[-1],
+                     [{"row": 0}, {"row": 1}, {"row": 2}])
+
+  def test_given_failed_request_on_timer_retry_on_timer(self):
+    """Tests a failed flush on the timer is retried on the timer."""
+    writer = FakeBigQueryWriter(num_failed_requests=1)
+    sink = main.StreamingSink(
+        write_rows=writer, max_buffered_rows=100, flush_interval_secs=0.01)
+
+    sink.append([{"row": 0}])
+
+    self.assertTrue(writer.written.wait(timeout=10))
+    self.assertEqual(writer.requests, [[{"row": 0}], [{"row": 0}]])
+
+  def test_given_failed_request_keep_at_most_max_retained_rows(self):
+    """Tests only the newest `max_retained_rows` rows are kept."""
+    writer = FakeBigQueryWriter(num_failed_requests=1)
+    sink = main.StreamingSink(
+        write_rows=writer, max_buffered_rows=3, flush_interval_secs=60,
+        max_retained_rows=2)
+
+    sink.append([{"row": 0}, {"row": 1}, {"row": 2}])
+    sink.flush()
+
+    self.assertEqual(writer.requests[-1], [{"row": 1}, {"row": 2}])
+
+  def test_given_invalid_max_buffered_rows_raise_exception(self):
+    """Tests the sink raises an exception for a non-positive buffer size."""
+    with self.assertRaises(ValueError):
+      main.StreamingSink(
+          write_rows=FakeBigQueryWriter(),
+          max_buffered_rows=0,
+          flush_interval_secs=60)
+
+
+class TestEnvironmentCache(unittest.TestCase):
+  """Test class for the cache of MovieLens environments."""
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    self.environment_cache_dir = os.path.join(self.tmp_dir, "cache")
+
+    # Write a small dataset in the format of MovieLens 100K's "u.data".
+    self.raw_data_path = os.path.join(self.tmp_dir, "u.data")
+    rng = np.random.default_rng(seed=0)
+    with open(self.raw_data_path, "w") as f:
+      for user in range(1, 51):
+        for item in rng.choice(np.arange(1, 41), size=25, replace=False):
+          f.write(f"{user}\t{item}\t{rng.integers(1, 6)}\t0\n")
+
+  def load_environment(self):
+    return main.load_movielens_environment(
+        raw_data_path=self.raw_data_path,
+        rank_k=int(RANK_K),
+        batch_size=int(BATCH_SIZE),
+        num_actions=int(NUM_ACTIONS),
+        environment_cache_dir=self.environment_cache_dir)
+
+  def test_load_environment_from_cache_after_first_load(self):
+    """Tests the environment is built once and then loaded from the cache."""
+    env = self.load_environment()
+    cached_env = self.load_environment()
+
+    self.assertNotIsInstance(env, main.CachedMovieLensPyEnvironment)
+    self.assertIsInstance(cached_env, main.CachedMovieLensPyEnvironment)
+    np.testing.assert_allclose(cached_env._u_hat, env._u_hat)
+    np.testing.assert_allclose(cached_env._approx_ratings_matrix,
+                               env._approx_ratings_matrix)
+    self.assertEqual(cached_env.time_step_spec(), env.time_step_spec())
+    self.assertEqual(cached_env.action_spec(), env.action_spec())
+
+  def test_cached_environment_give_same_rewards(self):
+    """Tests the cached environment gives the same rewards for the same users.
+    """
+    env = self.load_environment()
+    cached_env = self.load_environment()
+    action = np.arange(int(BATCH_SIZE), dtype=np.int32)
+
+    random.seed(0)
+    env.reset()
+    rewards = env.step(action).reward
+    random.seed(0)
+    cached_env.reset()
+    cached_rewards = cached_env.step(action).reward
+
+    np.testing.assert_allclose(cached_rewards, rewards)
+
+  def test_batched_trajectories_give_environment_rewards(self):
+    """Tests batched trajectories hold the rewards of the observed users."""
+    env = self.load_environment()
+    users = np.array([[0, 1, 2, 3, 4, 5, 6, 7], [8, 9, 10, 11, 12, 13, 14, 15]])
+    actions = np.array([np.arange(int(BATCH_SIZE)),
+                        np.arange(int(BATCH_SIZE))[::-1]], dtype=np.int32)
+
+    trajectory = main.get_trajectories_from_environment(
+        environment=tf_py_environment.TFPyEnvironment(env),
+        observations=env._u_hat[users].astype(np.float32),
+        predicted_actions=actions)
+    trajectory_dicts = main.build_dicts_from_trajectory(trajectory)
+
+    np.testing.assert_allclose(
+        trajectory.reward, env._approx_ratings_matrix[users, actions],
+        rtol=1e-5, atol=1e-5)
+    self.assertEqual(len(trajectory_dicts), len(users))
+    self.assertEqual(
+        set(trajectory_dicts[0].keys()),
+        {"step_type", "observation", "action", "policy_info",
+         "next_step_type", "reward", "discount"})
+    self.assertEqual(len(trajectory_dicts[0]["observation"]), int(BATCH_SIZE))
+    self.assertEqual(trajectory_dicts[0]["action"], actions[0].tolist())
+
+  def test_build_trajectory_rows_for_mixed_batch_sizes(self):
+    """Tests rows keep their order when observations differ in batch size."""
+    env = self.load_environment()
+    batch_sizes = [int(BATCH_SIZE), 2, int(BATCH_SIZE)]
+    observations = [{
+        "observation": env._u_hat[:batch_size].tolist()
+    } for batch_size in batch_sizes]
+    predicted_actions = [{
+        "predicted_action": [0] * batch_size
+    } for batch_size in batch_sizes]
+
+    rows = main.build_trajectory_rows(
+        environment=tf_py_environment.TFPyEnvironment(env),
+        observations=observations,
+        predicted_actions=predicted_actions)
+
+    self.assertEqual([len(row["action"]) for row in rows], batch_sizes)
+    np.testing.assert_allclose(
+        rows[1]["reward"], env._approx_ratings_matrix[:2, 0],
+        rtol=1e-5, atol=1e-5)
+
+  def test_rebuild_environment_after_data_file_changes(self):
+    """Tests the cache isn't used after the data file changes."""
+    self.load_environment()
+    with open(self.raw_data_path, "a") as f:
+      f.write("51\t1\t5\t0\n")
+
+    env = self.load_environment()
+
+    self.assertNotIsInstance(env, main.CachedMovieLensPyEnvironment)
+
+
 if __name__ == "__main__":
   unittest.main()
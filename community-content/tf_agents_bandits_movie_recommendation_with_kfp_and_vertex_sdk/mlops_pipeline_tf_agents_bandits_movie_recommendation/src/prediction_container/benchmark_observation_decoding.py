@@ -0,0 +1,99 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks decoding observations of prediction requests.
+
+Measures the time the prediction server takes to parse a request body and
+decode its observation into a float32 array, for observations sent as nested
+lists and as packed buffers, over a range of batch sizes and `rank_k`.
+
+Example:
+  python3 -m src.prediction_container.benchmark_observation_decoding \
+    --shapes=8x20,256x128,1024x512
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Callable, List, Tuple
+
+os.environ.setdefault("AIP_HEALTH_ROUTE", "/health")
+os.environ.setdefault("AIP_PREDICT_ROUTE", "/predict")
+
+import numpy as np  # pylint: disable=g-import-not-at-top
+from src.prediction_container import main
+
+
+def time_calls(function: Callable[[], None], num_runs: int) -> List[float]:
+  """Times `num_runs` calls of `function`.
+
+  Args:
+    function: Function to call.
+    num_runs: Number of times to call `function`.
+
+  Returns:
+    The duration of each call in milliseconds.
+  """
+  durations = []
+  for _ in range(num_runs):
+    start = time.perf_counter()
+    function()
+    durations.append((time.perf_counter() - start) * 1000)
+  return durations
+
+
+def parse_shapes(shapes: str) -> List[Tuple[int, int]]:
+  """Parses shapes like "8x20,256x128" into (batch_size, rank_k) tuples."""
+  return [
+      tuple(int(size) for size in shape.split("x"))
+      for shape in shapes.split(",")
+  ]
+
+
+def run_benchmark() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--shapes", type=str, default="8x20,64x128,256x512,1024x1024",
+      help="Comma-separated observation shapes as <batch_size>x<rank_k>.")
+  parser.add_argument("--num_runs", type=int, default=20)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(seed=0)
+  print(f"{'shape':<12}{'encoding':<10}{'body (KB)':>12}"
+        f"{'median (ms)':>14}{'max (ms)':>12}")
+  for batch_size, rank_k in parse_shapes(args.shapes):
+    observation = rng.random((batch_size, rank_k), dtype=np.float32)
+    bodies = {
+        "list": json.dumps({"instances": [{
+            "observation": observation.tolist()
+        }]}),
+        "b64": json.dumps({"instances": [{
+            "observation": main.encode_observation(observation)
+        }]}),
+    }
+    for encoding, body in bodies.items():
+
+      def decode(body=body):
+        for instance in json.loads(body)["instances"]:
+          main.decode_observation(instance["observation"])
+
+      durations = time_calls(decode, args.num_runs)
+      print(f"{f'{batch_size}x{rank_k}':<12}{encoding:<10}"
+            f"{len(body) / 1024:>12.1f}{statistics.median(durations):>14.2f}"
+            f"{max(durations):>12.2f}")
+
+
+if __name__ == "__main__":
+  run_benchmark()
@@ -0,0 +1,177 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load-tests the prediction server with and without the policy batcher.
+
+Sends prediction requests from concurrent clients to the FastAPI app of the
+prediction server in-process, and reports the p50 and p99 latency and the
+throughput with request batching on and off. The Logger is not called.
+
+Policy inference runs in a pool of `--num_workers` threads, as in the
+server.
+
+Uses the trained policy in `--policy_dir` if given, and otherwise saves and
+loads an untrained LinUCB policy with the MovieLens specs.
+
+Example:
+  python3 -m src.prediction_container.benchmark_policy_batcher \
+    --concurrency=32 --num_requests=2000
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+os.environ.setdefault("AIP_HEALTH_ROUTE", "/health")
+os.environ.setdefault("AIP_PREDICT_ROUTE", "/predict")
+
+import httpx  # pylint: disable=g-import-not-at-top
+import numpy as np
+from src.prediction_container import main
+import tensorflow as tf
+from tf_agents.bandits.agents import lin_ucb_agent
+from tf_agents.policies import policy_saver
+from tf_agents.specs import tensor_spec
+from tf_agents.trajectories import time_step as ts
+
+
+def load_policy(args: argparse.Namespace):
+  """Loads the trained policy, or saves and loads an untrained LinUCB policy.
+
+  Args:
+    args: Parsed command line arguments.
+
+  Returns:
+    A policy loaded with `tf.saved_model.load`, as in the prediction server.
+  """
+  if args.policy_dir:
+    return tf.saved_model.load(args.policy_dir)
+  observation_spec = tensor_spec.TensorSpec(
+      shape=(args.rank_k,), dtype=tf.float32)
+  action_spec = tensor_spec.BoundedTensorSpec(
+      shape=(), dtype=tf.int32, minimum=0, maximum=args.num_actions - 1)
+  agent = lin_ucb_agent.LinearUCBAgent(
+      time_step_spec=ts.time_step_spec(observation_spec),
+      action_spec=action_spec)
+  policy_dir = tempfile.mkdtemp()
+  policy_saver.PolicySaver(agent.policy).save(policy_dir)
+  return tf.saved_model.load(policy_dir)
+
+
+async def run_load_test(args: argparse.Namespace,
+                        batching: bool) -> Dict[str, float]:
+  """Sends `num_requests` prediction requests from `concurrency` clients.
+
+  Args:
+    args: Parsed command line arguments.
+    batching: Whether the policy batcher is on.
+
+  Returns:
+    A dict of the p50 and p99 latency in milliseconds and the requests per
+    second.
+  """
+  main.app_vars["logger_aggregator"] = main.LoggerMessageAggregator(
+      send=lambda observations, predicted_actions: None,
+      max_batch_size=10000,
+      max_latency_secs=60)
+  main.app_vars["policy_batcher"] = None
+  main.app_vars["executor"] = concurrent.futures.ThreadPoolExecutor(
+      max_workers=args.num_workers)
+  if batching:
+    trained_policy = main.app_vars["trained_policy"]
+    main.app_vars["policy_batcher"] = main.PolicyBatcher(
+        predict_actions=lambda observations: main._predict_actions(  # pylint: disable=protected-access
+            trained_policy, observations, main.app_vars["batch_size_buckets"]),
+        max_batch_size=args.max_batch_size,
+        max_latency_secs=args.max_batch_latency_secs,
+        executor=main.app_vars["executor"],
+        max_concurrent_batches=args.num_workers)
+    main.app_vars["policy_batcher"].start()
+
+  rng = np.random.default_rng(seed=0)
+  body = {
+      "instances": [{
+          "observation": rng.random((args.batch_size, args.rank_k)).tolist()
+      } for _ in range(args.instances_per_request)]
+  }
+  latencies = []
+  num_remaining = [args.num_requests]
+
+  async def run_client(client: httpx.AsyncClient) -> None:
+    while num_remaining[0] > 0:
+      num_remaining[0] -= 1
+      start = time.perf_counter()
+      response = await client.post(os.environ["AIP_PREDICT_ROUTE"], json=body)
+      response.raise_for_status()
+      latencies.append((time.perf_counter() - start) * 1000)
+
+  transport = httpx.ASGITransport(app=main.app)
+  async with httpx.AsyncClient(
+      transport=transport, base_url="http://prediction-server") as client:
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[run_client(client) for _ in range(args.concurrency)])
+    duration = time.perf_counter() - start
+
+  if main.app_vars["policy_batcher"] is not None:
+    await main.app_vars["policy_batcher"].stop()
+  main.app_vars["executor"].shutdown(wait=True)
+  return {
+      "p50": float(np.percentile(latencies, 50)),
+      "p99": float(np.percentile(latencies, 99)),
+      "qps": len(latencies) / duration,
+  }
+
+
+def run_benchmark() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--policy_dir", type=str, default="",
+      help="Path to a trained policy saved by the Trainer.")
+  parser.add_argument("--rank_k", type=int, default=20)
+  parser.add_argument("--num_actions", type=int, default=20)
+  parser.add_argument("--batch_size", type=int, default=8)
+  parser.add_argument("--instances_per_request", type=int, default=1)
+  parser.add_argument("--concurrency", type=int, default=32)
+  parser.add_argument("--num_requests", type=int, default=2000)
+  parser.add_argument("--max_batch_size", type=int, default=256)
+  parser.add_argument("--max_batch_latency_secs", type=float, default=0.005)
+  parser.add_argument("--num_workers", type=int, default=4)
+  args = parser.parse_args()
+
+  main.app_vars["trained_policy"] = load_policy(args)
+  main.app_vars["batch_size_buckets"] = main._get_batch_size_buckets()  # pylint: disable=protected-access
+  main._warm_up_policy(main.app_vars["trained_policy"],  # pylint: disable=protected-access
+                       main.app_vars["batch_size_buckets"])
+
+  results: Dict[str, List[float]] = {}
+  for batching in (False, True):
+    # Warm up the policy before measuring.
+    warm_up_args = argparse.Namespace(**vars(args))
+    warm_up_args.num_requests = args.concurrency
+    asyncio.run(run_load_test(warm_up_args, batching))
+    results["on" if batching else "off"] = asyncio.run(
+        run_load_test(args, batching))
+
+  print(f"{'batching':<10}{'p50 (ms)':>12}{'p99 (ms)':>12}{'QPS':>12}")
+  for mode, result in results.items():
+    print(f"{mode:<10}{result['p50']:>12.1f}{result['p99']:>12.1f}"
+          f"{result['qps']:>12.1f}")
+
+
+if __name__ == "__main__":
+  run_benchmark()
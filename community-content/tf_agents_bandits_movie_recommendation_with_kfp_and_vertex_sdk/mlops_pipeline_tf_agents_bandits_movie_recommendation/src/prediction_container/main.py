@@ -13,33 +13,527 @@
 # limitations under the License.
 
 """Prediction server that uses a trained policy to give predicted actions."""
+import asyncio
+import base64
+import concurrent.futures
+import functools
 import json
+import logging
 import os
-from typing import Dict, List
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
 
 import fastapi
 
 from google.cloud import pubsub_v1
 
+import numpy as np
 import tensorflow as tf
 import tf_agents
 from tf_agents import policies
 
 
 app = fastapi.FastAPI()
-app_vars = {"trained_policy": None}
+app_vars = {
+    "trained_policy": None,
+    "logger_aggregator": None,
+    "policy_batcher": None,
+    "executor": None,
+    "publisher": None,
+    "batch_size_buckets": [],
+    "ready": False,
+}
+_publisher_lock = threading.Lock()
+
+# An observation in a prediction request: a nested list of floats, or a packed
+# buffer from `encode_observation`.
+Observation = Union[List[List[float]], Dict[str, Any]]
+
+
+def decode_observation(observation: Observation) -> np.ndarray:
+  """Decodes an observation of a prediction request.
+
+  An observation is either a nested list of shape [batch_size, rank_k], or a
+  packed buffer `{"b64": <values>, "shape": [batch_size, rank_k]}`, where
+  `<values>` are base64 encoded little-endian float32 values in row-major
+  order. A packed buffer is wrapped by `np.frombuffer`, without converting its
+  values one by one.
+
+  Args:
+    observation: An observation of a prediction request.
+
+  Returns:
+    A float32 array of shape [batch_size, rank_k], read-only for a packed
+    buffer.
+
+  Raises:
+    ValueError: if a packed buffer doesn't hold `shape` float32 values.
+  """
+  if isinstance(observation, dict):
+    values = np.frombuffer(base64.b64decode(observation["b64"]), dtype="<f4")
+    return values.reshape(observation["shape"])
+  return np.asarray(observation, dtype=np.float32)
+
+
+def encode_observation(observation: np.ndarray) -> Dict[str, Any]:
+  """Encodes an observation as a packed buffer for prediction requests.
+
+  Args:
+    observation: An observation of shape [batch_size, rank_k].
+
+  Returns:
+    A dict `{"b64": <values>, "shape": [batch_size, rank_k]}` that
+    `decode_observation` decodes.
+  """
+  observation = np.ascontiguousarray(observation, dtype="<f4")
+  return {
+      "b64": base64.b64encode(observation.tobytes()).decode("ascii"),
+      "shape": list(observation.shape),
+  }
+
+
+class LoggerMessageAggregator:
+  """Aggregates prediction inputs and results into batched Logger messages.
+
+  Observations and predicted actions of consecutive prediction requests are
+  held in a buffer, and sent to the Logger in one message per batch instead of
+  one message per request. The buffer is sent as soon as it holds
+  `max_batch_size` observations, and otherwise by a timer `max_latency_secs`
+  after its first observation was added.
+  """
+
+  def __init__(
+      self,
+      send: Callable[[List[Dict[str, List[List[float]]]],
+                      List[Dict[str, List[float]]]], None],
+      max_batch_size: int,
+      max_latency_secs: float) -> None:
+    """Initializes the aggregator.
+
+    Args:
+      send: Function that sends one message with a list of observations and
+        the list of corresponding predicted actions to the Logger.
+      max_batch_size: Number of buffered observations that triggers a send.
+      max_latency_secs: Longest time in seconds that an observation stays
+        buffered.
+
+    Raises:
+      ValueError: if `max_batch_size` is less than 1.
+    """
+    if max_batch_size < 1:
+      raise ValueError("`max_batch_size` must be at least 1.")
+    self._send = send
+    self._max_batch_size = max_batch_size
+    self._max_latency_secs = max_latency_secs
+    self._observations = []
+    self._predicted_actions = []
+    self._lock = threading.Lock()
+    self._timer = None
+
+  def add(
+      self,
+      observations: List[Dict[str, List[List[float]]]],
+      predicted_actions: List[Dict[str, List[float]]]) -> None:
+    """Adds prediction inputs and results, sending the batch if it is full.
+
+    Args:
+      observations: List of `{"observation": <observation>}` in the prediction
+        request.
+      predicted_actions: List of `{"predicted_action": <predicted_action>}`
+        corresponding to the observations.
+    """
+    with self._lock:
+      self._observations.extend(observations)
+      self._predicted_actions.extend(predicted_actions)
+      if len(self._observations) >= self._max_batch_size:
+        batch = self._take_batch()
+      else:
+        batch = None
+        if self._observations and self._timer is None:
+          self._timer = threading.Timer(self._max_latency_secs,
+                                        self._flush_on_timer)
+          self._timer.daemon = True
+          self._timer.start()
+    if batch is not None:
+      self._send(*batch)
+
+  def flush(self) -> None:
+    """Sends all buffered prediction inputs and results to the Logger."""
+    with self._lock:
+      batch = self._take_batch()
+    if batch[0]:
+      self._send(*batch)
+
+  def _take_batch(self):
+    """Empties the buffer and stops the timer; needs `_lock` held."""
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    batch = (self._observations, self._predicted_actions)
+    self._observations, self._predicted_actions = [], []
+    return batch
+
+  def _flush_on_timer(self) -> None:
+    try:
+      self.flush()
+    except Exception:  # pylint: disable=broad-except
+      logging.exception("Failed to send a batched message to the Logger.")
+
+
+class PolicyBatcher:
+  """Coalesces observations of concurrent requests into batched policy calls.
+
+  Observations submitted by concurrent prediction requests are queued, merged
+  along the batch dimension, and passed to the policy in one call. The
+  predicted actions are then split back to the requests. A batch is run as
+  soon as it holds `max_batch_size` rows, or once `max_latency_secs` passed
+  since its first observation was queued. The observations of one request are
+  never split across batches, so a batch can exceed `max_batch_size` by the
+  rows of its last request.
+
+  Bandit policies act on each row of a batch independently, so merging the
+  observations doesn't change the predicted actions.
+
+  Batches run in `executor`, off the event loop, with up to
+  `max_concurrent_batches` of them at once. While all of them are busy,
+  observations keep queueing and form the next, larger batch.
+  """
+
+  def __init__(
+      self,
+      predict_actions: Callable[[np.ndarray], np.ndarray],
+      max_batch_size: int,
+      max_latency_secs: float,
+      executor: Optional[concurrent.futures.Executor] = None,
+      max_concurrent_batches: int = 1,
+      observation_dim: Optional[int] = None) -> None:
+    """Initializes the batcher.
+
+    Args:
+      predict_actions: Function that maps observations of shape
+        [batch_size, rank_k] to predicted actions of shape [batch_size].
+      max_batch_size: Number of queued observation rows that triggers a batch.
+      max_latency_secs: Longest time in seconds that an observation waits for
+        other observations to batch with.
+      executor: Executor to run `predict_actions` in. The default executor of
+        the event loop is used if not given.
+      max_concurrent_batches: Maximum number of batches running at once.
+      observation_dim: Number of columns, i.e. `rank_k`, that observations
+        must have. Observations of other widths are rejected before they're
+        queued, so that they can't fail the batch they would be merged into.
+        Not checked if not given.
+
+    Raises:
+      ValueError: if `max_batch_size` or `max_concurrent_batches` is less
+        than 1.
+    """
+    if max_batch_size < 1 or max_concurrent_batches < 1:
+      raise ValueError(
+          "`max_batch_size` and `max_concurrent_batches` must be at least 1.")
+    self._predict_actions = predict_actions
+    self._max_batch_size = max_batch_size
+    self._max_latency_secs = max_latency_secs
+    self._executor = executor
+    self._max_concurrent_batches = max_concurrent_batches
+    self._observation_dim = observation_dim
+    self._pending = []
+    self._num_pending_rows = 0
+    self._has_pending = None
+    self._batch_slots = None
+    self._batch_tasks = set()
+    self._task = None
+
+  def start(self) -> None:
+    """Starts running batches on the current event loop."""
+    self._has_pending = asyncio.Event()
+    self._batch_slots = asyncio.Semaphore(self._max_concurrent_batches)
+    self._task = asyncio.ensure_future(self._run())
+
+  async def stop(self) -> None:
+    """Stops running batches, after the running ones finish."""
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+    if self._batch_tasks:
+      await asyncio.gather(*self._batch_tasks)
+
+  async def predict(self, observation: Observation) -> List[int]:
+    """Gets predicted actions for one observation, in a batch with others.
+
+    Args:
+      observation: An observation of shape [batch_size, rank_k], as a nested
+        list or a packed buffer.
+
+    Returns:
+      A list of the predicted actions for the rows of `observation`.
+
+    Raises:
+      ValueError: if `observation` isn't a matrix, or doesn't have
+        `observation_dim` columns.
+    """
+    observation = decode_observation(observation)
+    if observation.ndim != 2:
+      raise ValueError(
+          f"An observation must have 2 dimensions, got {observation.ndim}.")
+    if (self._observation_dim is not None and
+        observation.shape[1] != self._observation_dim):
+      raise ValueError(
+          f"An observation must have {self._observation_dim} columns, got "
+          f"{observation.shape[1]}.")
+    future = asyncio.get_event_loop().create_future()
+    self._pending.append((observation, future))
+    self._num_pending_rows += len(observation)
+    self._has_pending.set()
+    return await future
+
+  async def _run(self) -> None:
+    """Gathers queued observations into batches, and runs them."""
+    loop = asyncio.get_event_loop()
+    while True:
+      await self._has_pending.wait()
+      # Wait for a free slot first, so that observations arriving meanwhile
+      # join this batch.
+      await self._batch_slots.acquire()
+      deadline = loop.time() + self._max_latency_secs
+      while self._num_pending_rows < self._max_batch_size:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        self._has_pending.clear()
+        try:
+          await asyncio.wait_for(self._has_pending.wait(), timeout)
+        except asyncio.TimeoutError:
+          break
+      task = asyncio.ensure_future(self._run_batch(self._take_batch()))
+      self._batch_tasks.add(task)
+      task.add_done_callback(self._batch_tasks.discard)
+
+  def _take_batch(self):
+    """Takes queued requests up to `max_batch_size` rows."""
+    num_rows = 0
+    num_requests = 0
+    for observation, _ in self._pending:
+      if num_rows >= self._max_batch_size:
+        break
+      num_rows += len(observation)
+      num_requests += 1
+    batch = self._pending[:num_requests]
+    self._pending = self._pending[num_requests:]
+    self._num_pending_rows -= num_rows
+    if self._pending:
+      self._has_pending.set()
+    else:
+      self._has_pending.clear()
+    return batch
+
+  async def _run_batch(self, batch) -> None:
+    """Runs one policy call for `batch`, and scatters the predicted actions."""
+    try:
+      actions = await asyncio.get_event_loop().run_in_executor(
+          self._executor, self._predict_actions,
+          np.concatenate([observation for observation, _ in batch]))
+    except Exception as e:  # pylint: disable=broad-except
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+    finally:
+      self._batch_slots.release()
+
+    start = 0
+    for observation, future in batch:
+      end = start + len(observation)
+      if not future.done():
+        future.set_result(actions[start:end].tolist())
+      start = end
+
+
+def _predict_actions(
+    trained_policy: policies.TFPolicy,
+    observations: np.ndarray,
+    batch_size_buckets: Sequence[int] = ()) -> np.ndarray:
+  """Queries the trained policy for the predicted actions of observations.
+
+  The policy traces its `action` function again for every new batch size it
+  sees, which takes much longer than running it. With `batch_size_buckets`,
+  observations are padded with zeros to the smallest bucket that fits, and
+  split into chunks of the largest bucket, so that the policy only sees the
+  batch sizes it was warmed up with.
+
+  Args:
+    trained_policy: Trained policy to generate predictions.
+    observations: Observations of shape [batch_size, rank_k].
+    batch_size_buckets: Ascending batch sizes to pad observations to. Not
+      padded if empty.
+
+  Returns:
+    Predicted actions of shape [batch_size].
+  """
+  observations = np.asarray(observations, dtype=np.float32)
+  if not batch_size_buckets:
+    # Reconstruct TimeStep. Rewards default to 0.
+    time_step = tf_agents.trajectories.restart(
+        observation=observations,
+        batch_size=tf.convert_to_tensor([len(observations)]))
+    return trained_policy.action(time_step).action.numpy()
+
+  max_bucket = batch_size_buckets[-1]
+  actions = []
+  for start in range(0, len(observations), max_bucket):
+    chunk = observations[start:start + max_bucket]
+    bucket = next(
+        bucket for bucket in batch_size_buckets if bucket >= len(chunk))
+    padded_chunk = np.zeros((bucket,) + chunk.shape[1:], dtype=np.float32)
+    padded_chunk[:len(chunk)] = chunk
+    actions.append(
+        _predict_actions(trained_policy, padded_chunk)[:len(chunk)])
+  return np.concatenate(actions)
+
+
+def _get_batch_size_buckets() -> List[int]:
+  """Gets the batch sizes to pad to from `PREDICTION_BATCH_SIZE_BUCKETS`.
+
+  Returns:
+    A sorted list of batch sizes, or an empty list to not pad.
+  """
+  buckets = os.environ.get("PREDICTION_BATCH_SIZE_BUCKETS",
+                           "1,2,4,8,16,32,64,128,256")
+  return sorted(int(bucket) for bucket in buckets.split(",") if bucket)
+
+
+def _get_observation_dim(trained_policy: policies.TFPolicy) -> int:
+  """Gets the observation dimension from the `action` signature of a policy.
+
+  Args:
+    trained_policy: Trained policy saved by `PolicySaver`.
+
+  Returns:
+    The size of the last observation dimension, i.e. `rank_k`.
+  """
+  action_signature = trained_policy.signatures["action"]
+  _, input_specs = action_signature.structured_input_signature
+  [observation_spec] = [
+      spec for name, spec in input_specs.items()
+      if name.endswith("observation")
+  ]
+  return observation_spec.shape[-1]
+
+
+def _warm_up_policy(
+    trained_policy: policies.TFPolicy,
+    batch_size_buckets: Sequence[int]) -> None:
+  """Runs the policy once for every batch size bucket.
+
+  Traces the policy's `action` function for each bucket ahead of the first
+  requests, so that they don't pay for it.
+
+  Args:
+    trained_policy: Trained policy saved by `PolicySaver`.
+    batch_size_buckets: Batch sizes that observations are padded to.
+  """
+  observation_dim = _get_observation_dim(trained_policy)
+  for bucket in batch_size_buckets:
+    _predict_actions(trained_policy,
+                     np.zeros((bucket, observation_dim), dtype=np.float32))
+
+
+def _send_to_logger(
+    observations: List[Dict[str, List[List[float]]]],
+    predicted_actions: List[Dict[str, List[float]]]) -> None:
+  """Sends observations and predicted actions to the Logger's Pub/Sub topic.
+
+  Args:
+    observations: List of `{"observation": <observation>}`.
+    predicted_actions: List of `{"predicted_action": <predicted_action>}`
+      corresponding to the observations.
+  """
+  _message_logger_via_pubsub(
+      project_id=os.environ["PROJECT_ID"],
+      logger_pubsub_topic=os.environ["LOGGER_PUBSUB_TOPIC"],
+      observations=observations,
+      predicted_actions=predicted_actions)
+
+
+def _get_num_workers() -> int:
+  """Gets the number of threads that run policy inference."""
+  return int(os.environ.get("PREDICTION_NUM_WORKERS", "4"))
 
 
 def _startup_event() -> None:
-  """Loads the trained policy at startup."""
+  """Loads the trained policy and creates the Logger aggregator at startup.
+
+  Also creates the thread pool that runs policy inference off the event loop,
+  with `PREDICTION_NUM_WORKERS` threads, and the Pub/Sub client.
+  """
   app_vars["trained_policy"] = tf.saved_model.load(
       os.environ["AIP_STORAGE_URI"])
+  app_vars["batch_size_buckets"] = _get_batch_size_buckets()
+  app_vars["executor"] = concurrent.futures.ThreadPoolExecutor(
+      max_workers=_get_num_workers())
+  app_vars["logger_aggregator"] = LoggerMessageAggregator(
+      send=_send_to_logger,
+      max_batch_size=int(os.environ.get("LOGGER_MAX_BATCH_SIZE", "100")),
+      max_latency_secs=float(
+          os.environ.get("LOGGER_MAX_BATCH_LATENCY_SECS", "1")))
+  _get_publisher()
+
+
+def _start_policy_batcher() -> None:
+  """Starts the policy batcher, unless `PREDICTION_MAX_BATCH_SIZE` is 0."""
+  max_batch_size = int(os.environ.get("PREDICTION_MAX_BATCH_SIZE", "256"))
+  if max_batch_size > 0:
+    trained_policy = app_vars["trained_policy"]
+    batch_size_buckets = app_vars["batch_size_buckets"]
+    app_vars["policy_batcher"] = PolicyBatcher(
+        predict_actions=lambda observations: _predict_actions(
+            trained_policy, observations, batch_size_buckets),
+        max_batch_size=max_batch_size,
+        max_latency_secs=float(
+            os.environ.get("PREDICTION_MAX_BATCH_LATENCY_SECS", "0.005")),
+        executor=app_vars["executor"],
+        max_concurrent_batches=_get_num_workers(),
+        observation_dim=_get_observation_dim(trained_policy))
+    app_vars["policy_batcher"].start()
+
+
+def _warm_up() -> None:
+  """Warms up the trained policy, and then reports the server as ready."""
+  if app_vars["batch_size_buckets"]:
+    _warm_up_policy(app_vars["trained_policy"], app_vars["batch_size_buckets"])
+  app_vars["ready"] = True
 
 
 @app.on_event("startup")
 async def startup_event() -> None:
-  """Loads the trained policy at startup."""
+  """Loads and warms up the trained policy, and starts the policy batcher."""
   _startup_event()
+  _start_policy_batcher()
+  await asyncio.get_event_loop().run_in_executor(app_vars["executor"],
+                                                 _warm_up)
+
+
+def _shutdown_event() -> None:
+  """Sends the prediction inputs and results still buffered to the Logger.
+
+  Waits for the messages being published, and stops the thread pool.
+  """
+  if app_vars["logger_aggregator"] is not None:
+    app_vars["logger_aggregator"].flush()
+  _stop_publisher()
+  if app_vars["executor"] is not None:
+    app_vars["executor"].shutdown(wait=True)
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+  """Stops the policy batcher, and flushes Logger messages at shutdown."""
+  if app_vars["policy_batcher"] is not None:
+    await app_vars["policy_batcher"].stop()
+  _shutdown_event()
 
 
 def _health() -> Dict[str, str]:
@@ -52,12 +546,19 @@ def _health() -> Dict[str, str]:
 
 
 @app.get(os.environ["AIP_HEALTH_ROUTE"], status_code=200)
-def health() -> Dict[str, str]:
+def health(response: fastapi.Response) -> Dict[str, str]:
   """Handles server health check requests.
 
+  Responds with status 503 until the trained policy is warmed up.
+
+  Args:
+    response: Response to the health check request.
+
   Returns:
     An empty dict.
   """
+  if not app_vars["ready"]:
+    response.status_code = 503
   return _health()
 
 
@@ -69,7 +570,8 @@ def _message_logger_via_pubsub(
   """Send a message to the Pub/Sub topic which triggers the Logger.
 
   Package observations and the corresponding predicted actions in a message JSON
-  and send to Pub/Sub topic.
+  and send to Pub/Sub topic. The message is sent in the background by the
+  Pub/Sub client of this process.
 
   Args:
     project_id: GCP project ID.
@@ -86,20 +588,98 @@ def _message_logger_via_pubsub(
   })
   message_bytes = message_json.encode("utf-8")
 
-  # Instantiate a Pub/Sub client.
-  publisher = pubsub_v1.PublisherClient()
-
-  # Get the Logger's Pub/Sub topic.
-  topic_path = publisher.topic_path(project_id, logger_pubsub_topic)
+  # Reuse the Pub/Sub client of this process.
+  publisher = _get_publisher()
+  topic_path = _get_topic_path(project_id, logger_pubsub_topic)
 
-  # Send message.
+  # Send message without waiting for it to be sent. The client batches it with
+  # other messages, and blocks here if too many messages are in flight.
   publish_future = publisher.publish(topic_path, data=message_bytes)
-  publish_future.result()
+  publish_future.add_done_callback(_on_publish_done)
+
+
+def _create_publisher() -> pubsub_v1.PublisherClient:
+  """Creates a Pub/Sub client with batch settings and flow control.
+
+  Messages are sent in batches of up to `LOGGER_PUBLISH_MAX_MESSAGES` messages
+  and `LOGGER_PUBLISH_MAX_BYTES` bytes, waiting at most
+  `LOGGER_PUBLISH_MAX_LATENCY_SECS` for a batch to fill up. Publishing blocks
+  while `LOGGER_MAX_IN_FLIGHT_PUBLISHES` messages or
+  `LOGGER_MAX_IN_FLIGHT_BYTES` bytes are not sent yet, which bounds the memory
+  held by unsent messages.
+
+  Returns:
+    A Pub/Sub publisher client.
+  """
+  batch_settings = pubsub_v1.types.BatchSettings(
+      max_messages=int(os.environ.get("LOGGER_PUBLISH_MAX_MESSAGES", "100")),
+      max_bytes=int(os.environ.get("LOGGER_PUBLISH_MAX_BYTES", "1000000")),
+      max_latency=float(
+          os.environ.get("LOGGER_PUBLISH_MAX_LATENCY_SECS", "0.01")))
+  flow_control = pubsub_v1.types.PublishFlowControl(
+      message_limit=int(
+          os.environ.get("LOGGER_MAX_IN_FLIGHT_PUBLISHES", "100")),
+      byte_limit=int(
+          os.environ.get("LOGGER_MAX_IN_FLIGHT_BYTES", "100000000")),
+      limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK)
+  return pubsub_v1.PublisherClient(
+      batch_settings=batch_settings,
+      publisher_options=pubsub_v1.types.PublisherOptions(
+          flow_control=flow_control))
+
+
+def _get_publisher() -> pubsub_v1.PublisherClient:
+  """Gets the Pub/Sub client of this process, creating it on first use.
+
+  Returns:
+    A Pub/Sub publisher client.
+  """
+  with _publisher_lock:
+    if app_vars["publisher"] is None:
+      app_vars["publisher"] = _create_publisher()
+    return app_vars["publisher"]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_topic_path(project_id: str, logger_pubsub_topic: str) -> str:
+  """Gets the path of the Logger's Pub/Sub topic.
+
+  Args:
+    project_id: GCP project ID.
+    logger_pubsub_topic: Name of Pub/Sub topic that triggers the Logger.
+
+  Returns:
+    The topic path as `projects/<project_id>/topics/<logger_pubsub_topic>`.
+  """
+  return pubsub_v1.PublisherClient.topic_path(project_id, logger_pubsub_topic)
+
+
+def _stop_publisher() -> None:
+  """Sends all messages not sent yet, and stops the Pub/Sub client."""
+  with _publisher_lock:
+    if app_vars["publisher"] is not None:
+      app_vars["publisher"].stop()
+      app_vars["publisher"] = None
+
+
+def _on_publish_done(publish_future) -> None:
+  """Logs a failed publish.
+
+  Args:
+    publish_future: The future of the published message.
+  """
+  try:
+    publish_future.result()
+  except Exception:  # pylint: disable=broad-except
+    logging.exception("Failed to publish a message to the Logger.")
 
 
 def _predict(
-    instances: List[Dict[str, List[List[float]]]],
-    trained_policy: policies.TFPolicy) -> Dict[str, List[Dict[str, List[int]]]]:
+    instances: List[Dict[str, Observation]],
+    trained_policy: policies.TFPolicy,
+    logger_aggregator: Optional[LoggerMessageAggregator] = None,
+    batch_size_buckets: Sequence[int] = ()
+) -> Dict[str, List[Dict[str, List[int]]]]:
   """Gets predictions for the observations in `instances`; triggers the Logger.
 
   Unpacks observations in `instances` and queries the trained policy for
@@ -110,32 +690,95 @@ def _predict(
     instances: List of `{"observation": <observation>}` for which to generate
       predictions.
     trained_policy: Trained policy to generate predictions.
+    logger_aggregator: Aggregator that batches Logger messages across
+      requests. If not given, a message is sent for this request at once.
+    batch_size_buckets: Ascending batch sizes to pad observations to.
 
   Returns:
     A dict with the key "predictions" mapping to a list of predicted actions
     corresponding to each observation in the prediction request.
   """
-  predictions = []
   predicted_actions = []
-  for index, instance in enumerate(instances):
-    # Unpack observation and reconstruct TimeStep. Rewards default to 0.
-    batch_size = len(instance["observation"])
-    time_step = tf_agents.trajectories.restart(
-        observation=instance["observation"],
-        batch_size=tf.convert_to_tensor([batch_size]))
-    policy_step = trained_policy.action(time_step)
+  for instance in instances:
+    predicted_actions.append(
+        _predict_actions(trained_policy,
+                         decode_observation(instance["observation"]),
+                         batch_size_buckets).tolist())
 
-    predicted_action = policy_step.action.numpy().tolist()
-    predictions.append(
-        {f"PolicyStep {index}": predicted_action})
-    predicted_actions.append({"predicted_action": predicted_action})
+  return _build_predictions_and_log(instances, predicted_actions,
+                                    logger_aggregator)
 
-  # Trigger the Logger to log prediction inputs and results.
-  _message_logger_via_pubsub(
-      project_id=os.environ["PROJECT_ID"],
-      logger_pubsub_topic=os.environ["LOGGER_PUBSUB_TOPIC"],
-      observations=instances,
-      predicted_actions=predicted_actions)
+
+async def _predict_with_batcher(
+    instances: List[Dict[str, Observation]],
+    policy_batcher: PolicyBatcher,
+    logger_aggregator: Optional[LoggerMessageAggregator] = None,
+    executor: Optional[concurrent.futures.Executor] = None
+) -> Dict[str, List[Dict[str, List[int]]]]:
+  """Gets predictions for `instances` in batches with concurrent requests.
+
+  Args:
+    instances: List of `{"observation": <observation>}` for which to generate
+      predictions.
+    policy_batcher: Batcher that queries the trained policy for observations
+      of concurrent requests at once.
+    logger_aggregator: Aggregator that batches Logger messages across
+      requests. If not given, a message is sent for this request at once.
+    executor: Executor to trigger the Logger in, off the event loop. The
+      default executor of the event loop is used if not given.
+
+  Returns:
+    A dict with the key "predictions" mapping to a list of predicted actions
+    corresponding to each observation in the prediction request.
+  """
+  predicted_actions = await asyncio.gather(*[
+      policy_batcher.predict(instance["observation"]) for instance in instances
+  ])
+  return await asyncio.get_event_loop().run_in_executor(
+      executor, _build_predictions_and_log, instances, predicted_actions,
+      logger_aggregator)
+
+
+def _build_predictions_and_log(
+    instances: List[Dict[str, Observation]],
+    predicted_actions: List[List[int]],
+    logger_aggregator: Optional[LoggerMessageAggregator] = None
+) -> Dict[str, List[Dict[str, List[int]]]]:
+  """Builds the prediction response, and triggers the Logger.
+
+  Args:
+    instances: List of `{"observation": <observation>}` in the prediction
+      request.
+    predicted_actions: List of the predicted actions of each observation.
+    logger_aggregator: Aggregator that batches Logger messages across
+      requests. If not given, a message is sent for this request at once.
+
+  Returns:
+    A dict with the key "predictions" mapping to a list of predicted actions
+    corresponding to each observation in the prediction request.
+  """
+  predictions = [{
+      f"PolicyStep {index}": predicted_action
+  } for index, predicted_action in enumerate(predicted_actions)]
+
+  # Trigger the Logger to log prediction inputs and results. The Logger takes
+  # observations as nested lists.
+  logger_observations = [
+      {"observation": decode_observation(instance["observation"]).tolist()}
+      if isinstance(instance["observation"], dict) else instance
+      for instance in instances
+  ]
+  logger_predicted_actions = [{
+      "predicted_action": predicted_action
+  } for predicted_action in predicted_actions]
+  if logger_aggregator is not None:
+    logger_aggregator.add(
+        observations=logger_observations,
+        predicted_actions=logger_predicted_actions)
+  else:
+    _send_to_logger(
+        observations=logger_observations,
+        predicted_actions=logger_predicted_actions)
   return {"predictions": predictions}
 
 
@@ -156,4 +799,11 @@ async def predict(
   """
   body = await request.json()
   instances = body["instances"]
-  return _predict(instances, app_vars["trained_policy"])
+  if app_vars["policy_batcher"] is not None:
+    return await _predict_with_batcher(instances, app_vars["policy_batcher"],
+                                       app_vars["logger_aggregator"],
+                                       app_vars["executor"])
+  # Run inference in the thread pool, to keep serving other requests.
+  return await asyncio.get_event_loop().run_in_executor(
+      app_vars["executor"], _predict, instances, app_vars["trained_policy"],
+      app_vars["logger_aggregator"], app_vars["batch_size_buckets"])
@@ -13,12 +13,18 @@
 # limitations under the License.
 
 """The unit testing module for the prediction container with FastAPI."""
+import asyncio
+import concurrent.futures
 import json
 import os
+import threading
+import time
+import types
 import unittest
 from unittest import mock
 
 import numpy as np
+import tensorflow as tf
 
 os.environ["AIP_HEALTH_ROUTE"] = "/health"
 os.environ["AIP_PREDICT_ROUTE"] = "/predict"
@@ -71,6 +77,10 @@ class TestPredictionContainer(unittest.TestCase):
     self.mock_pubsub_client = mock.patch(
         "google.cloud.pubsub_v1.PublisherClient").start()
     self.mock_pubsub_client.return_value = self.mock_publisher
+    # Create a Pub/Sub client with the mock in each test.
+    mock.patch.dict(main.app_vars, {"publisher": None}).start()
+    main._get_topic_path.cache_clear()
+    self.addCleanup(main._get_topic_path.cache_clear)
 
   def tearDown(self):
     super().tearDown()
@@ -88,6 +98,19 @@ class TestPredictionContainer(unittest.TestCase):
 
     self.assertEqual(health_output, {})
 
+  def test_health_report_not_ready_before_warm_up(self):
+    """Tests health checks fail until the trained policy is warmed up."""
+    mock.patch.dict(main.app_vars, {"ready": False}).start()
+    mock_response = mock.MagicMock()
+
+    main.health(mock_response)
+    self.assertEqual(mock_response.status_code, 503)
+
+    mock_response = mock.MagicMock(status_code=200)
+    main.app_vars["ready"] = True
+    main.health(mock_response)
+    self.assertEqual(mock_response.status_code, 200)
+
   def test__predict_create_time_step_from_trajectories_for_each_observation(
       self):
     """Tests _predict creates a time step for each observation."""
@@ -134,6 +157,32 @@ class TestPredictionContainer(unittest.TestCase):
 
     mock_message_logger.stop()
 
+  def test__predict_add_to_logger_aggregator_if_given(self):
+    """Tests _predict hands Logger data to the aggregator if one is given."""
+    mock_message_logger = mock.patch(
+        "src.prediction_container.main._message_logger_via_pubsub").start()
+    mock_aggregator = mock.MagicMock()
+
+    main._predict(REQUEST_INSTANCES, self.mock_trained_policy,
+                  mock_aggregator)
+
+    mock_aggregator.add.assert_called_once()
+    self.assertEqual(mock_aggregator.add.call_args[1]["observations"],
+                     REQUEST_INSTANCES)
+    mock_message_logger.assert_not_called()
+
+    mock_message_logger.stop()
+
+  def test__shutdown_event_flush_logger_aggregator(self):
+    """Tests _shutdown_event sends the messages still buffered."""
+    mock_aggregator = mock.MagicMock()
+    mock.patch.dict(main.app_vars,
+                    {"logger_aggregator": mock_aggregator}).start()
+
+    main._shutdown_event()
+
+    mock_aggregator.flush.assert_called_once()
+
   def test__message_logger_via_pubsub_convert_data_to_bytes_correctly(self):
     """Tests _message_logger_via_pubsub convert data to bytes correctly."""
     main._message_logger_via_pubsub(
@@ -151,6 +200,345 @@ class TestPredictionContainer(unittest.TestCase):
         "predicted_actions": PREDICTED_ACTIONS,
     })
 
+  def test__message_logger_via_pubsub_not_wait_for_publish(self):
+    """Tests _message_logger_via_pubsub returns before the message is sent."""
+    publish_future = concurrent.futures.Future()
+    self.mock_publisher.publish.return_value = publish_future
+
+    main._message_logger_via_pubsub(
+        project_id=PROJECT_ID,
+        logger_pubsub_topic=LOGGER_PUBSUB_TOPIC,
+        observations=REQUEST_INSTANCES,
+        predicted_actions=PREDICTED_ACTIONS)
+
+    self.assertFalse(publish_future.done())
+    with self.assertLogs(level="ERROR"):
+      publish_future.set_exception(RuntimeError("publish error"))
+
+  def test__message_logger_via_pubsub_reuse_publisher(self):
+    """Tests the Pub/Sub client and topic path are created once."""
+    for _ in range(3):
+      main._message_logger_via_pubsub(
+          project_id=PROJECT_ID,
+          logger_pubsub_topic=LOGGER_PUBSUB_TOPIC,
+          observations=REQUEST_INSTANCES,
+          predicted_actions=PREDICTED_ACTIONS)
+
+    self.mock_pubsub_client.assert_called_once()
+    self.mock_pubsub_client.topic_path.assert_called_once_with(
+        PROJECT_ID, LOGGER_PUBSUB_TOPIC)
+    self.assertEqual(self.mock_publisher.publish.call_count, 3)
+
+  def test__create_publisher_with_batch_settings_and_flow_control(self):
+    """Tests the Pub/Sub client batches messages and blocks when saturated."""
+    main._create_publisher()
+
+    _, kwargs = self.mock_pubsub_client.call_args
+    self.assertEqual(kwargs["batch_settings"].max_messages, 100)
+    flow_control = kwargs["publisher_options"].flow_control
+    self.assertEqual(flow_control.message_limit, 100)
+    self.assertEqual(flow_control.limit_exceeded_behavior,
+                     main.pubsub_v1.types.LimitExceededBehavior.BLOCK)
+
+  def test__shutdown_event_stop_publisher(self):
+    """Tests _shutdown_event sends the messages not sent yet."""
+    main._get_publisher()
+
+    main._shutdown_event()
+
+    self.mock_publisher.stop.assert_called_once()
+    self.assertIsNone(main.app_vars["publisher"])
+
+
+class FakeSavedPolicy:
+  """A fake of a policy saved by `PolicySaver`, predicting row argmaxes."""
+
+  def __init__(self):
+    self.batch_sizes = []
+    self.signatures = {
+        "action":
+            types.SimpleNamespace(structured_input_signature=((), {
+                "arg_0_observation":
+                    tf.TensorSpec(shape=(None, RANK_K), dtype=tf.float32),
+                "arg_0_step_type":
+                    tf.TensorSpec(shape=(None,), dtype=tf.int32),
+            }))
+    }
+
+  def action(self, time_step):
+    self.batch_sizes.append(int(time_step.observation.shape[0]))
+    return types.SimpleNamespace(
+        action=tf.argmax(time_step.observation, axis=1, output_type=tf.int32))
+
+
+class TestPolicyWarmUp(unittest.TestCase):
+  """Test class for padded policy calls and the policy warm-up."""
+
+  def test__predict_actions_pad_to_smallest_fitting_bucket(self):
+    """Tests observations are padded to a bucket, and the padding dropped."""
+    policy = FakeSavedPolicy()
+    observations = np.eye(RANK_K)[[1, 2, 3, 4, 5]]
+
+    actions = main._predict_actions(policy, observations, [1, 4, 8])
+
+    self.assertEqual(policy.batch_sizes, [8])
+    self.assertEqual(actions.tolist(), [1, 2, 3, 4, 5])
+
+  def test__predict_actions_split_into_largest_buckets(self):
+    """Tests observations beyond the largest bucket are split into chunks."""
+    policy = FakeSavedPolicy()
+    observations = np.eye(RANK_K)[list(range(10))]
+
+    actions = main._predict_actions(policy, observations, [1, 4])
+
+    self.assertEqual(policy.batch_sizes, [4, 4, 4])
+    self.assertEqual(actions.tolist(), list(range(10)))
+
+  def test__warm_up_policy_run_every_bucket(self):
+    """Tests the warm-up runs the policy once per bucket."""
+    policy = FakeSavedPolicy()
+
+    main._warm_up_policy(policy, [1, 2, 4])
+
+    self.assertEqual(policy.batch_sizes, [1, 2, 4])
+
+  def test__get_batch_size_buckets_sort_buckets(self):
+    """Tests buckets are read from the environment in ascending order."""
+    with mock.patch.dict(os.environ,
+                         {"PREDICTION_BATCH_SIZE_BUCKETS": "8,1,2"}):
+      self.assertEqual(main._get_batch_size_buckets(), [1, 2, 8])
+
+
+class TestObservationDecoding(unittest.TestCase):
+  """Test class for decoding observations of prediction requests."""
+
+  def test_decode_observation_of_packed_buffer_without_copy(self):
+    """Tests a packed buffer decodes to the encoded values, without a copy."""
+    observation = np.random.rand(BATCH_SIZE, RANK_K).astype(np.float32)
+
+    decoded = main.decode_observation(main.encode_observation(observation))
+
+    self.assertEqual(decoded.dtype, np.float32)
+    self.assertFalse(decoded.flags.owndata)
+    np.testing.assert_array_equal(decoded, observation)
+
+  def test_decode_observation_of_nested_list(self):
+    """Tests nested lists of floats are still accepted."""
+    decoded = main.decode_observation(OBSERVATION)
+
+    self.assertEqual(decoded.dtype, np.float32)
+    np.testing.assert_array_equal(decoded, OBSERVATION)
+
+  def test_given_shape_not_matching_buffer_raise_exception(self):
+    """Tests a packed buffer with the wrong shape is rejected."""
+    encoded = main.encode_observation(np.zeros((BATCH_SIZE, RANK_K)))
+    encoded["shape"] = [BATCH_SIZE, RANK_K + 1]
+
+    with self.assertRaises(ValueError):
+      main.decode_observation(encoded)
+
+  def test__predict_log_packed_buffers_as_nested_lists(self):
+    """Tests _predict sends observations of packed buffers as lists."""
+    observations = np.eye(RANK_K)[:BATCH_SIZE]
+    mock_aggregator = mock.MagicMock()
+
+    predictions = main._predict(
+        [{"observation": main.encode_observation(observations)}],
+        FakeSavedPolicy(), mock_aggregator)
+
+    self.assertEqual(predictions["predictions"],
+                     [{"PolicyStep 0": list(range(BATCH_SIZE))}])
+    mock_aggregator.add.assert_called_once_with(
+        observations=[{"observation": observations.tolist()}],
+        predicted_actions=[{"predicted_action": list(range(BATCH_SIZE))}])
+
+
+class FakePolicy:
+  """A fake of the trained policy, predicting the argmax of each row."""
+
+  def __init__(self, error=None):
+    self.batch_sizes = []
+    self.error = error
+
+  def __call__(self, observations):
+    self.batch_sizes.append(len(observations))
+    if self.error is not None:
+      raise self.error
+    return np.argmax(observations, axis=1)
+
+
+class TestPolicyBatcher(unittest.TestCase):
+  """Test class for the batcher of policy calls."""
+
+  def run_requests(self, batcher, observations):
+    """Runs concurrent prediction requests through `batcher`."""
+    async def run():
+      batcher.start()
+      try:
+        return await asyncio.wait_for(
+            asyncio.gather(
+                *[batcher.predict(observation)
+                  for observation in observations],
+                return_exceptions=True),
+            timeout=10)
+      finally:
+        await batcher.stop()
+    return asyncio.run(run())
+
+  def test_merge_concurrent_requests_into_one_policy_call(self):
+    """Tests concurrent requests share one policy call and get their rows."""
+    policy = FakePolicy()
+    batcher = main.PolicyBatcher(
+        predict_actions=policy, max_batch_size=100, max_latency_secs=0.01)
+    observations = [
+        np.eye(RANK_K)[[1, 2]].tolist(),
+        np.eye(RANK_K)[[3, 4, 5]].tolist(),
+        np.eye(RANK_K)[[6]].tolist(),
+    ]
+
+    results = self.run_requests(batcher, observations)
+
+    self.assertEqual(policy.batch_sizes, [6])
+    self.assertEqual(results, [[1, 2], [3, 4, 5], [6]])
+
+  def test_run_batch_once_max_batch_size_is_reached(self):
+    """Tests a full batch runs without waiting for the latency budget."""
+    policy = FakePolicy()
+    batcher = main.PolicyBatcher(
+        predict_actions=policy, max_batch_size=4, max_latency_secs=60)
+    observations = [np.eye(RANK_K)[[1, 2]].tolist()] * 4
+
+    results = self.run_requests(batcher, observations)
+
+    self.assertEqual(policy.batch_sizes, [4, 4])
+    self.assertEqual(results, [[1, 2]] * 4)
+
+  def test_run_at_most_max_concurrent_batches_in_executor(self):
+    """Tests batches run in the executor, at most `max_concurrent_batches`."""
+    lock = threading.Lock()
+    num_running = [0]
+    max_running = [0]
+
+    def slow_policy(observations):
+      with lock:
+        num_running[0] += 1
+        max_running[0] = max(max_running[0], num_running[0])
+      time.sleep(0.05)
+      with lock:
+        num_running[0] -= 1
+      return np.argmax(observations, axis=1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+      batcher = main.PolicyBatcher(
+          predict_actions=slow_policy, max_batch_size=1, max_latency_secs=0,
+          executor=executor, max_concurrent_batches=2)
+      results = self.run_requests(batcher,
+                                  [np.eye(RANK_K)[[1]].tolist()] * 6)
+
+    self.assertEqual(results, [[1]] * 6)
+    self.assertEqual(max_running[0], 2)
+
+  def test_given_policy_error_fail_all_requests_of_batch(self):
+    """Tests a policy error is raised for every request of the batch."""
+    policy = FakePolicy(error=RuntimeError("policy error"))
+    batcher = main.PolicyBatcher(
+        predict_actions=policy, max_batch_size=100, max_latency_secs=0.01)
+
+    results = self.run_requests(batcher, [OBSERVATION, OBSERVATION])
+
+    self.assertEqual(len(results), 2)
+    for result in results:
+      self.assertIsInstance(result, RuntimeError)
+
+  def test_given_wrong_observation_width_fail_only_that_request(self):
+    """Tests an observation of the wrong width doesn't fail its batch."""
+    policy = FakePolicy()
+    batcher = main.PolicyBatcher(
+        predict_actions=policy, max_batch_size=100, max_latency_secs=0.01,
+        observation_dim=RANK_K)
+
+    results = self.run_requests(
+        batcher, [np.eye(RANK_K)[[1, 2]].tolist(), [[1.0, 2.0, 3.0]]])
+
+    self.assertEqual(policy.batch_sizes, [2])
+    self.assertEqual(results[0], [1, 2])
+    self.assertIsInstance(results[1], ValueError)
+
+  def test__predict_with_batcher_build_predictions_and_log(self):
+    """Tests _predict_with_batcher gives one prediction per observation."""
+    policy = FakePolicy()
+    batcher = main.PolicyBatcher(
+        predict_actions=policy, max_batch_size=100, max_latency_secs=0.01)
+    mock_aggregator = mock.MagicMock()
+
+    async def run():
+      batcher.start()
+      try:
+        return await main._predict_with_batcher(
+            REQUEST_INSTANCES, batcher, mock_aggregator)
+      finally:
+        await batcher.stop()
+    predictions = asyncio.run(run())
+
+    self.assertEqual(policy.batch_sizes, [BATCH_SIZE * NUM_OBSERVATIONS])
+    self.assertEqual(len(predictions["predictions"]), NUM_OBSERVATIONS)
+    mock_aggregator.add.assert_called_once_with(
+        observations=REQUEST_INSTANCES, predicted_actions=PREDICTED_ACTIONS)
+
+
+class TestLoggerMessageAggregator(unittest.TestCase):
+  """Test class for the aggregator of Logger messages."""
+
+  def setUp(self):
+    super().setUp()
+    self.messages = []
+    self.sent = threading.Event()
+
+  def send(self, observations, predicted_actions):
+    self.messages.append((observations, predicted_actions))
+    self.sent.set()
+
+  def test_send_one_message_per_full_batch(self):
+    """Tests requests are sent in one message once the batch is full."""
+    aggregator = main.LoggerMessageAggregator(
+        send=self.send, max_batch_size=NUM_OBSERVATIONS * 2,
+        max_latency_secs=60)
+
+    aggregator.add(REQUEST_INSTANCES, PREDICTED_ACTIONS)
+    self.assertEqual(self.messages, [])
+    aggregator.add(REQUEST_INSTANCES, PREDICTED_ACTIONS)
+
+    self.assertEqual(self.messages, [
+        (REQUEST_INSTANCES * 2, PREDICTED_ACTIONS * 2),
+    ])
+
+  def test_send_partial_batch_after_max_latency(self):
+    """Tests a partial batch is sent once its latency budget is used up."""
+    aggregator = main.LoggerMessageAggregator(
+        send=self.send, max_batch_size=100, max_latency_secs=0.01)
+
+    aggregator.add(REQUEST_INSTANCES, PREDICTED_ACTIONS)
+
+    self.assertTrue(self.sent.wait(timeout=10))
+    self.assertEqual(self.messages, [(REQUEST_INSTANCES, PREDICTED_ACTIONS)])
+
+  def test_flush_send_nothing_for_empty_batch(self):
+    """Tests flushing an empty buffer doesn't send a message."""
+    aggregator = main.LoggerMessageAggregator(
+        send=self.send, max_batch_size=100, max_latency_secs=60)
+
+    aggregator.add(REQUEST_INSTANCES, PREDICTED_ACTIONS)
+    aggregator.flush()
+    aggregator.flush()
+
+    self.assertEqual(self.messages, [(REQUEST_INSTANCES, PREDICTED_ACTIONS)])
+
+  def test_given_invalid_max_batch_size_raise_exception(self):
+    """Tests the aggregator raises an exception for a non-positive size."""
+    with self.assertRaises(ValueError):
+      main.LoggerMessageAggregator(
+          send=self.send, max_batch_size=0, max_latency_secs=60)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -13,15 +13,22 @@
 # limitations under the License.
 
 """The Simulator component for sending recurrent prediction requests."""
+import hashlib
+import io
 import logging
 import os
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+import uuid
 
 import dataclasses
 from google import cloud  # For patch of google.cloud.aiplatform to work.
 from google.cloud import aiplatform  # For using the module.  # pylint: disable=unused-import
-import tensorflow as tf  # For tf_agents to work.  # pylint: disable=unused-import
+import numpy as np
+import tensorflow as tf
+from tf_agents.bandits.environments import bandit_py_environment
 from tf_agents.bandits.environments import movielens_py_environment
+from tf_agents.specs import array_spec
+from tf_agents.trajectories import time_step as ts
 
 
 @dataclasses.dataclass
@@ -38,6 +45,8 @@ class EnvVars:
     batch_size: A integer of the batch size of environment generated quantities.
     num_actions: A integer of the number of actions (movie items) to choose
       from.
+    environment_cache_dir: A string of the path to the directory holding
+      cached MovieLens environments, or None to not use the cache.
   """
   project_id: str
   region: str
@@ -46,6 +55,7 @@ class EnvVars:
   rank_k: int
   batch_size: int
   num_actions: int
+  environment_cache_dir: Optional[str]
 
 
 def get_env_vars() -> EnvVars:
@@ -61,7 +71,173 @@ def get_env_vars() -> EnvVars:
       raw_data_path=os.getenv("RAW_DATA_PATH"),
       rank_k=int(os.getenv("RANK_K")),
       batch_size=int(os.getenv("BATCH_SIZE")),
-      num_actions=int(os.getenv("NUM_ACTIONS")))
+      num_actions=int(os.getenv("NUM_ACTIONS")),
+      environment_cache_dir=os.getenv("ENVIRONMENT_CACHE_DIR"))
+
+
+class CachedMovieLensPyEnvironment(
+    movielens_py_environment.MovieLensPyEnvironment):
+  """A MovieLens environment built from cached matrix factorization results.
+
+  Behaves as `movielens_py_environment.MovieLensPyEnvironment`, without loading
+  the data file or computing the matrix factorization.
+  """
+
+  def __init__(self,
+               u_hat: np.ndarray,
+               v_hat: np.ndarray,
+               rank_k: int,
+               batch_size: int):  # pylint: disable=super-init-not-called
+    """Initializes the environment from the user and movie factor matrices.
+
+    Args:
+      u_hat: User factor matrix, of shape [num_users, rank].
+      v_hat: Movie factor matrix, of shape [rank, num_movies].
+      rank_k: Rank for matrix factorization in the MovieLens environment; also
+        the observation dimension.
+      batch_size: Batch size of environment generated quantities eg. rewards.
+    """
+    self._num_actions = v_hat.shape[1]
+    self._batch_size = batch_size
+    self._context_dim = rank_k
+    self._effective_num_users = u_hat.shape[0]
+    self._u_hat = u_hat
+    self._v_hat = v_hat
+    self._approx_ratings_matrix = np.matmul(u_hat, v_hat)
+
+    self._current_users = np.zeros(batch_size)
+    self._previous_users = np.zeros(batch_size)
+
+    self._action_spec = array_spec.BoundedArraySpec(
+        shape=(),
+        dtype=np.int32,
+        minimum=0,
+        maximum=self._num_actions - 1,
+        name="action")
+    observation_spec = array_spec.ArraySpec(
+        shape=(self._context_dim,), dtype=np.float64, name="observation")
+    self._time_step_spec = ts.time_step_spec(observation_spec)
+    self._observation = np.zeros((self._batch_size, self._context_dim))
+
+    self._optimal_action_table = np.argmax(
+        self._approx_ratings_matrix, axis=1)
+    self._optimal_reward_table = np.max(
+        self._approx_ratings_matrix, axis=1)
+
+    bandit_py_environment.BanditPyEnvironment.__init__(
+        self, observation_spec, self._action_spec, name="movielens")
+
+
+def get_environment_cache_dir(
+    environment_cache_dir: str,
+    raw_data_path: str,
+    rank_k: int,
+    num_actions: int) -> str:
+  """Gets the directory of the cached environment for the given parameters.
+
+  The cache is keyed by a fingerprint of the data file, made of its path, size
+  and modification time, so that looking up the cache doesn't read the file.
+
+  Args:
+    environment_cache_dir: Path to the directory holding cached environments.
+    raw_data_path: Path to MovieLens 100K's "u.data" file.
+    rank_k: Rank for matrix factorization in the MovieLens environment.
+    num_actions: Number of actions (movie items) to choose from.
+
+  Returns:
+    Path to the directory of the cached environment.
+  """
+  stat = tf.io.gfile.stat(raw_data_path)
+  key = (f"{raw_data_path}:{stat.length}:{stat.mtime_nsec}:{rank_k}:"
+         f"{num_actions}")
+  key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+  return os.path.join(environment_cache_dir, f"movielens-{key_hash}")
+
+
+def save_array(path: str, array: np.ndarray) -> None:
+  """Saves `array` as a .npy file, which is replaced atomically.
+
+  Args:
+    path: Local or Cloud Storage path of the file.
+    array: Array to save.
+  """
+  buffer = io.BytesIO()
+  np.save(buffer, array)
+  tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+  with tf.io.gfile.GFile(tmp_path, "wb") as f:
+    f.write(buffer.getvalue())
+  tf.io.gfile.rename(tmp_path, path, overwrite=True)
+
+
+def load_array(path: str) -> np.ndarray:
+  """Loads an array from a .npy file, memory-mapping local files.
+
+  Args:
+    path: Local or Cloud Storage path of the file.
+
+  Returns:
+    The array in the file.
+  """
+  if "://" not in path:
+    return np.load(path, mmap_mode="r")
+  with tf.io.gfile.GFile(path, "rb") as f:
+    return np.load(io.BytesIO(f.read()))
+
+
+def load_movielens_environment(
+    raw_data_path: str,
+    rank_k: int,
+    batch_size: int,
+    num_actions: int,
+    environment_cache_dir: Optional[str]
+) -> movielens_py_environment.MovieLensPyEnvironment:
+  """Loads the MovieLens simulation environment, from the cache if possible.
+
+  Without a cache directory, the environment is built from the data file. With
+  one, the user and movie factor matrices are loaded from the cache, or saved to
+  it after building the environment the first time.
+
+  Args:
+    raw_data_path: Path to MovieLens 100K's "u.data" file.
+    rank_k: Rank for matrix factorization in the MovieLens environment; also
+      the observation dimension.
+    batch_size: Batch size of environment generated quantities eg. rewards.
+    num_actions: Number of actions (movie items) to choose from.
+    environment_cache_dir: Local or Cloud Storage path to the directory holding
+      cached environments, shared by the Generator, Logger and Simulator.
+
+  Returns:
+    A MovieLens simulation environment.
+  """
+  if not environment_cache_dir:
+    return movielens_py_environment.MovieLensPyEnvironment(
+        raw_data_path,
+        rank_k,
+        batch_size,
+        num_movies=num_actions,
+        csv_delimiter="\t")
+
+  cache_dir = get_environment_cache_dir(environment_cache_dir, raw_data_path,
+                                        rank_k, num_actions)
+  u_hat_path = os.path.join(cache_dir, "u_hat.npy")
+  v_hat_path = os.path.join(cache_dir, "v_hat.npy")
+  if tf.io.gfile.exists(u_hat_path) and tf.io.gfile.exists(v_hat_path):
+    return CachedMovieLensPyEnvironment(
+        u_hat=load_array(u_hat_path),
+        v_hat=load_array(v_hat_path),
+        rank_k=rank_k,
+        batch_size=batch_size)
+
+  env = movielens_py_environment.MovieLensPyEnvironment(
+      raw_data_path,
+      rank_k,
+      batch_size,
+      num_movies=num_actions,
+      csv_delimiter="\t")
+  tf.io.gfile.makedirs(cache_dir)
+  save_array(v_hat_path, env._v_hat)  # pylint: disable=protected-access
+  save_array(u_hat_path, env._u_hat)  # pylint: disable=protected-access
+  return env
 
 
 def simulate(event: Dict[str, Any], context) -> None:  # pylint: disable=unused-argument
@@ -86,10 +262,13 @@ def simulate(event: Dict[str, Any], context) -> None:  # pylint: disable=unused-
   """
   env_vars = get_env_vars()
 
-  # Create MovieLens simulation environment.
-  env = movielens_py_environment.MovieLensPyEnvironment(
-      env_vars.raw_data_path, env_vars.rank_k, env_vars.batch_size,
-      num_movies=env_vars.num_actions, csv_delimiter="\t")
+  # Load MovieLens simulation environment.
+  env = load_movielens_environment(
+      raw_data_path=env_vars.raw_data_path,
+      rank_k=env_vars.rank_k,
+      batch_size=env_vars.batch_size,
+      num_actions=env_vars.num_actions,
+      environment_cache_dir=env_vars.environment_cache_dir)
 
   # Get environment observation.
   observation_array = env._observe()  # pylint: disable=protected-access
@@ -45,6 +45,7 @@ ENV_VARS = {
     "RANK_K": RANK_K,
     "BATCH_SIZE": BATCH_SIZE,
     "NUM_ACTIONS": NUM_ACTIONS,
+    "ENVIRONMENT_CACHE_DIR": "",
 }
 
 OBSERVATION_ARRAY = np.zeros((int(BATCH_SIZE), int(RANK_K)))
@@ -128,6 +129,28 @@ class TestSimulator(unittest.TestCase):
         ],
     )
 
+  def test_given_environment_cache_dir_simulate_load_cached_environment(self):
+    """Tests simulate() loads the environment with the cache directory."""
+    env_vars = ENV_VARS.copy()
+    env_vars["ENVIRONMENT_CACHE_DIR"] = "gs://bucket-name/environment-cache"
+    self.mock_os_getenv.side_effect = build_side_effect_function(env_vars)
+    patcher_load_environment = mock.patch(
+        "src.simulator.main.load_movielens_environment")
+    mock_load_environment = patcher_load_environment.start()
+    mock_load_environment.return_value = self.mock_env
+
+    main.simulate(None, None)
+
+    mock_load_environment.assert_called_once_with(
+        raw_data_path=RAW_DATA_PATH,
+        rank_k=int(RANK_K),
+        batch_size=int(BATCH_SIZE),
+        num_actions=int(NUM_ACTIONS),
+        environment_cache_dir="gs://bucket-name/environment-cache")
+    self.mock_env._observe.assert_called_once()
+
+    patcher_load_environment.stop()
+
   def test_given_float_rank_k_simulate_raise_exception(self):
     """Tests given a float as `RANK_K` simulate() raises an exception."""
     env_vars = ENV_VARS.copy()
@@ -13,26 +13,106 @@
 # limitations under the License.
 
 """Prediction server that uses a trained policy to give predicted actions."""
+import asyncio
+import concurrent.futures
 import os
 
 from fastapi import FastAPI
 from fastapi import Request
+from fastapi import Response
 
+import numpy as np
 import tensorflow as tf
 import tf_agents
 
 
 app = FastAPI()
 _model = tf.compat.v2.saved_model.load(os.environ["AIP_STORAGE_URI"])
+_ready = False
+
+# Batch sizes that observations are padded to, so that the policy only sees
+# batch sizes it was warmed up with.
+_batch_size_buckets = sorted(
+    int(bucket) for bucket in os.environ.get(
+        "PREDICTION_BATCH_SIZE_BUCKETS", "1,2,4,8,16,32,64,128,256").split(",")
+    if bucket)
+
+# Runs policy inference off the event loop, so that concurrent requests don't
+# wait on each other.
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("PREDICTION_NUM_WORKERS", "4")))
+
+
+def _predict_actions(observations):
+  """Queries the trained policy for the predicted actions of observations.
+
+  The policy traces its `action` function again for every new batch size it
+  sees, which takes much longer than running it. So observations are padded
+  with zeros to the smallest batch size bucket that fits, and split into
+  chunks of the largest bucket.
+
+  Args:
+    observations: Observations of shape [batch_size, rank_k].
+
+  Returns:
+    Predicted actions of shape [batch_size].
+  """
+  max_bucket = _batch_size_buckets[-1]
+  actions = []
+  for start in range(0, len(observations), max_bucket):
+    chunk = observations[start:start + max_bucket]
+    bucket = next(
+        bucket for bucket in _batch_size_buckets if bucket >= len(chunk))
+    padded_chunk = np.zeros((bucket,) + chunk.shape[1:], dtype=np.float32)
+    padded_chunk[:len(chunk)] = chunk
+
+    # Reconstruct TimeStep. Rewards default to 0.
+    time_step = tf_agents.trajectories.restart(
+        observation=padded_chunk, batch_size=tf.convert_to_tensor([bucket]))
+    actions.append(_model.action(time_step).action.numpy()[:len(chunk)])
+  return np.concatenate(actions)
+
+
+def _warm_up():
+  """Runs the policy once for every batch size bucket, then reports ready."""
+  global _ready
+  _, input_specs = _model.signatures["action"].structured_input_signature
+  [observation_spec] = [
+      spec for name, spec in input_specs.items()
+      if name.endswith("observation")
+  ]
+  for bucket in _batch_size_buckets:
+    _predict_actions(
+        np.zeros((bucket, observation_spec.shape[-1]), dtype=np.float32))
+  _ready = True
+
+
+@app.on_event("startup")
+async def startup_event():
+  """Warms up the trained policy in the background."""
+  asyncio.get_event_loop().run_in_executor(_executor, _warm_up)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+  """Shuts down the thread pool of policy inference."""
+  _executor.shutdown(wait=True)
 
 
 @app.get(os.environ["AIP_HEALTH_ROUTE"], status_code=200)
-def health():
+def health(response: Response):
   """Handles server health check requests.
 
+  Responds with status 503 until the trained policy is warmed up.
+
+  Args:
+    response: Response to the health check request.
+
   Returns:
     An empty dict.
   """
+  if not _ready:
+    response.status_code = 503
   return {}
 
 
@@ -53,16 +133,24 @@ async def predict(request: Request):
   body = await request.json()
   instances = body["instances"]
 
-  predictions = []
-  for index, instance in enumerate(instances):
-    # Unpack request body and reconstruct TimeStep. Rewards default to 0.
-    batch_size = len(instance["observation"])
-    time_step = tf_agents.trajectories.restart(
-        observation=instance["observation"],
-        batch_size=tf.convert_to_tensor([batch_size]))
-    policy_step = _model.action(time_step)
+  if not instances:
+    return {"predictions": []}
+
+  # Query the policy once for the observations of all instances. Bandit
+  # policies act on each row of a batch independently, so this gives the same
+  # predicted actions as one query per instance.
+  observations = [
+      np.asarray(instance["observation"], dtype=np.float32)
+      for instance in instances
+  ]
+  actions = await asyncio.get_event_loop().run_in_executor(
+      _executor, _predict_actions, np.concatenate(observations))
 
-    predictions.append(
-        {f"PolicyStep {index}": policy_step.action.numpy().tolist()})
+  predictions = []
+  start = 0
+  for index, observation in enumerate(observations):
+    end = start + len(observation)
+    predictions.append({f"PolicyStep {index}": actions[start:end].tolist()})
+    start = end
 
   return {"predictions": predictions}